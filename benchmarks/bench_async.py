@@ -0,0 +1,173 @@
+"""
+
+Latency benchmark and concurrency check for the async API (`md_utils.async_api`), simulating a server that
+receives many simultaneous page requests.
+
+For each configuration, `--requests` page requests (spread over `--n-pages` journals) are issued at once, each as
+an asyncio task calling `acompile_markdown_document()`, while a heartbeat task measures how long the event loop is
+stalled (the maximum delay of a 5 ms `asyncio.sleep()`). The request latencies (p50/p95/p99/max), the throughput,
+and the maximum event-loop lag are reported. The 'blocking' configuration calls `compile_markdown_document()`
+directly in the coroutines, for comparison (its latencies look low, since they don't include the time each
+request waits for the blocked loop to start it; the loop lag shows the actual stall).
+
+Concurrency checks (the script exits with a non-zero status if any of these fail):
+
+* Every concurrent request returns the same HTML as a sequential `compile_markdown_document()` call.
+* `aiter_documents()` yields the same documents, in the same order, as `iter_documents()`, including while
+    several iterations run concurrently, and can be closed early.
+* Requests from several event loops (in different threads) can share a runner.
+
+Usage:
+
+    $ python benchmarks/bench_async.py [--n-journals 500] [--requests 500] [--n-pages 50] [--workers 4]
+
+If no basedir is given, a synthetic notebook is generated in a temporary directory (see `eln_corpus.py`).
+
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+import threading
+
+from zepto_eln.md_utils.document_io import find_md_files, iter_documents
+from zepto_eln.md_utils.markdown_compilation import compile_markdown_document
+from zepto_eln.md_utils.async_api import AsyncRunner, acompile_markdown_document, aiter_documents
+
+try:
+    from eln_corpus import generate_corpus
+except ImportError:
+    from benchmarks.eln_corpus import generate_corpus
+
+HEARTBEAT_INTERVAL = 0.005
+
+
+async def heartbeat(lags, stop):
+    """ Record how late each `asyncio.sleep(HEARTBEAT_INTERVAL)` wakes up (i.e. how long the loop was blocked). """
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        lags.append(time.perf_counter() - start - HEARTBEAT_INTERVAL)
+
+
+async def serve_requests(paths, template_dir, runner=None):
+    """ Issue all requests at once, returning (latencies, htmls, elapsed, max loop lag). """
+    lags, stop = [], asyncio.Event()
+    monitor = asyncio.ensure_future(heartbeat(lags, stop))
+    await asyncio.sleep(0)
+
+    async def request(path):
+        start = time.perf_counter()
+        if runner is None:
+            document = compile_markdown_document(path, outputfn=None, template_dir=template_dir)  # Blocking!
+        else:
+            document = await acompile_markdown_document(path, runner=runner, outputfn=None, template_dir=template_dir)
+        return time.perf_counter() - start, document['html']
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(request(path) for path in paths))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+    return [latency for latency, _ in results], [html for _, html in results], elapsed, max(lags, default=0.0)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+async def check_aiter_documents(basedir, runner):
+    """ Check that aiter_documents() matches iter_documents(), also when run concurrently. """
+    expected = [(doc['filename'], doc['meta'], doc['content']) for doc in iter_documents(basedir)]
+
+    async def collect():
+        return [(doc['filename'], doc['meta'], doc['content'])
+                async for doc in aiter_documents(basedir, runner=runner, window=8)]
+
+    results = await asyncio.gather(*(collect() for _ in range(4)))
+    failures = [f"aiter_documents() run {i} differs from iter_documents()."
+                for i, result in enumerate(results) if result != expected]
+    # Closing the iteration early cancels the pending loads:
+    agen = aiter_documents(basedir, runner=runner, window=8)
+    first = await agen.__anext__()
+    await agen.aclose()
+    if first['filename'] != expected[0][0]:
+        failures.append("aiter_documents() closed early returned the wrong first document.")
+    return failures
+
+
+def check_multiple_loops(paths, template_dir, expected, runner, n_threads=4):
+    """ Run requests from several event loops (one per thread) sharing the same runner. """
+    failures = []
+
+    def run_loop():
+        _, htmls, _, _ = asyncio.run(serve_requests(paths, template_dir, runner))
+        if htmls != expected:
+            failures.append("Requests from multiple event loops returned the wrong HTML.")
+
+    threads = [threading.Thread(target=run_loop) for _ in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return failures
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--n-journals', type=int, default=500)
+    ap.add_argument('--requests', type=int, default=500, help="Number of simultaneous requests.")
+    ap.add_argument('--n-pages', type=int, default=50, help="Number of distinct journals requested.")
+    ap.add_argument('--workers', type=int, default=None, help="CPU workers (default: one per CPU core).")
+    ap.add_argument('--basedir', default=None, help="Use an existing notebook (must have a template dir).")
+    ap.add_argument('--template-dir', default=None)
+    args = ap.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        basedir, template_dir = args.basedir, args.template_dir
+        if basedir is None:
+            print(f"Generating synthetic corpus ({args.n_journals} journals) in {tmpdir} ...", file=sys.stderr)
+            basedir = os.path.join(tmpdir, 'notebook')
+            template_dir = generate_corpus(basedir, n_journals=args.n_journals)['template_dir']
+        pages = find_md_files(basedir)[:args.n_pages]
+        paths = [pages[i % len(pages)] for i in range(args.requests)]
+        reference = {path: compile_markdown_document(path, outputfn=None, template_dir=template_dir)['html']
+                     for path in pages}
+        expected = [reference[path] for path in paths]
+
+        failures = []
+        print(f"{args.requests} simultaneous requests for {len(pages)} pages:")
+        print(f"{'executor':<10} {'req/s':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'max (ms)':>9} "
+              f"{'loop lag (ms)':>14}")
+        for name in ('blocking', 'thread', 'process'):
+            runner = None if name == 'blocking' else AsyncRunner(cpu_executor=name, cpu_workers=args.workers)
+            try:
+                if runner is not None:
+                    asyncio.run(serve_requests(paths[:runner.cpu_workers], template_dir, runner))  # Warm up the pool.
+                latencies, htmls, elapsed, max_lag = asyncio.run(serve_requests(paths, template_dir, runner))
+                if htmls != expected:
+                    failures.append(f"{name}: concurrent requests returned the wrong HTML.")
+                print(f"{name:<10} {len(paths) / elapsed:8.1f} {statistics.median(latencies) * 1e3:9.1f} "
+                      f"{percentile(latencies, 95) * 1e3:9.1f} {percentile(latencies, 99) * 1e3:9.1f} "
+                      f"{max(latencies) * 1e3:9.1f} {max_lag * 1e3:14.1f}")
+                if runner is not None and runner.cpu_executor == 'thread':
+                    failures += asyncio.run(check_aiter_documents(basedir, runner))
+                    failures += check_multiple_loops(paths[:50], template_dir, expected[:50], runner)
+            finally:
+                if runner is not None:
+                    runner.shutdown()
+
+    for failure in failures:
+        print("FAIL:", failure)
+    if not failures:
+        print("All concurrency checks passed.")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
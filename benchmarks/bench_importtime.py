@@ -0,0 +1,130 @@
+"""
+
+Import-time benchmark for the CLI modules, using `python -X importtime`.
+
+The CLI commands are invoked by editors on every save, so their startup time matters.
+For each module, the import is run in a fresh interpreter (`--repeats` times, best time reported), and:
+
+* The cumulative import time of the module is reported, with the slowest imports it pulls in.
+* Modules that should only be imported by the code paths that need them (see DEFERRED_MODULES) are flagged if
+    they are imported at module import time.
+* The wall time of `<command> --help` is reported for each CLI command.
+
+The script exits with a non-zero status if a deferred module is imported, or (with `--budget-ms`) if a module's
+import time exceeds the budget, so it can be used as a check in CI.
+
+Usage:
+
+    $ python benchmarks/bench_importtime.py [--repeats 5] [--top 8] [--budget-ms 150] [--output importtime.json]
+
+"""
+
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+MODULES = (
+    'zepto_eln.eln_cli.converter_cli',
+    'zepto_eln.eln_cli.reports_cli',
+    'zepto_eln.md_utils.document_io',
+    'zepto_eln.md_utils.markdown_compilation',
+)
+# CLI commands, as (module, command object) 2-tuples:
+COMMANDS = (
+    ('zepto_eln.eln_cli.converter_cli', 'convert_md_file_to_html_cli'),
+    ('zepto_eln.eln_cli.converter_cli', 'build_site_cli'),
+    ('zepto_eln.eln_cli.reports_cli', 'print_started_exps_cli'),
+    ('zepto_eln.eln_cli.reports_cli', 'query_cli'),
+)
+# Heavy modules that must not be imported just by importing the modules above:
+DEFERRED_MODULES = (
+    'requests', 'markdown', 'jinja2', 'webbrowser', 'pandas', 'pyarrow', 'watchdog', 'multiprocessing', 'pstats',
+)
+
+
+def parse_importtime(stderr):
+    """ Parse `-X importtime` output into a list of (self_us, cumulative_us, module_name) 3-tuples. """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports.append((int(self_us), int(cumulative_us), name.strip()))
+    return imports
+
+
+def run_importtime(code):
+    """ Run code in a fresh interpreter with `-X importtime`, returning the parsed imports. """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"Running {code!r} failed:\n{proc.stderr}")
+    return parse_importtime(proc.stderr)
+
+
+def measure_import(module, repeats=5):
+    """ Import module in a fresh interpreter `repeats` times, returning (total_us, imports) for the fastest run. """
+    best = None
+    for _ in range(repeats):
+        imports = run_importtime(f"import {module}")
+        total = next(cumulative for _, cumulative, name in imports if name == module)
+        if best is None or total < best[0]:
+            best = (total, imports)
+    return best
+
+
+def measure_help(module, command, repeats=5):
+    """ Return the best wall time (seconds) of running `<command> --help` in a fresh interpreter. """
+    code = f"from {module} import {command}; {command}(['--help'])"
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], capture_output=True, check=True)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--repeats', type=int, default=5)
+    ap.add_argument('--top', type=int, default=8, help="Show this many of the slowest imports for each module.")
+    ap.add_argument('--budget-ms', type=float, default=None, help="Fail if a module takes longer than this.")
+    ap.add_argument('--output', default=None, help="Write the results as JSON to this file.")
+    args = ap.parse_args(argv)
+
+    # Modules imported by the interpreter itself at startup (e.g. by site) are not counted:
+    startup_modules = {name for _, _, name in run_importtime('pass')}
+    results, failures = {}, []
+    for module in MODULES:
+        total_us, imports = measure_import(module, repeats=args.repeats)
+        names = {name for _, _, name in imports}
+        deferred = sorted(name for name in names if name.split('.')[0] in DEFERRED_MODULES
+                          and name not in startup_modules and '.' not in name)
+        results[module] = {'import_ms': total_us / 1e3, 'n_modules': len(names), 'deferred_imported': deferred}
+        print(f"\n{module}: {total_us / 1e3:.1f} ms, {len(names)} modules")
+        slowest = sorted((item for item in imports if item[2] != module and item[2] not in startup_modules),
+                         key=lambda item: item[1], reverse=True)
+        for self_us, cumulative_us, name in slowest[:args.top]:
+            print(f"  {cumulative_us / 1e3:8.1f} ms  {name}")
+        if deferred:
+            failures.append(f"{module} imports {', '.join(deferred)} at import time.")
+        if args.budget_ms is not None and total_us / 1e3 > args.budget_ms:
+            failures.append(f"{module} takes {total_us / 1e3:.1f} ms to import (budget: {args.budget_ms} ms).")
+
+    print(f"\n{'command':<32} {'--help (ms)':>12}")
+    for module, command in COMMANDS:
+        elapsed = measure_help(module, command, repeats=args.repeats)
+        results[f"{command} --help"] = {'wall_ms': elapsed * 1e3}
+        print(f"{command:<32} {elapsed * 1e3:12.1f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fd:
+            json.dump(results, fd, indent=1)
+    for failure in failures:
+        print("FAIL:", failure)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+
+Benchmark for `document_io.load_all_documents()`, showing how loading scales with the number of worker processes.
+
+Usage:
+
+    $ python benchmarks/bench_load_documents.py [--n-docs 5000] [--max-workers 8] [--basedir <existing notebook>]
+
+If no basedir is given, a synthetic notebook is generated in a temporary directory.
+
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+from zepto_eln.md_utils.document_io import load_all_documents
+
+JOURNAL_TEMPLATE = """---
+title: {expid} - Synthetic journal
+description: Synthetic journal for benchmarking.
+author: Benchmark
+expid: {expid}
+titledesc: Synthetic journal number {i}
+status: {status}
+startdate: 2018-01-{day:02}
+enddate: null
+result: null
+tags: [benchmark, synthetic, journal]
+---
+
+# %meta.title%
+
+{body}
+"""
+
+
+def make_synthetic_notebook(basedir, n_docs=5000, n_paragraphs=20, docs_per_dir=100):
+    """ Create a synthetic notebook with n_docs journals in basedir. """
+    paragraph = "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor. " * 5
+    body = "\n\n".join(paragraph for _ in range(n_paragraphs))
+    for i in range(n_docs):
+        expid = f"RS{i:05}"
+        dirname = os.path.join(basedir, f"dir{i // docs_per_dir:04}")
+        os.makedirs(dirname, exist_ok=True)
+        with open(os.path.join(dirname, expid + ".md"), 'w', encoding='utf-8') as fd:
+            fd.write(JOURNAL_TEMPLATE.format(
+                expid=expid, i=i, status=('started', 'completed')[i % 2], day=i % 28 + 1, body=body))
+
+
+def bench_load_all_documents(basedir, worker_counts, repeats=3):
+    results = []
+    for workers in worker_counts:
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            documents = load_all_documents(basedir=basedir, workers=workers)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        results.append((workers, len(documents), best))
+        print(f"workers={workers:>3}: {len(documents)} documents in {best:.3f} s "
+              f"({len(documents) / best:.0f} docs/s, speedup {results[0][2] / best:.2f}x)")
+    return results
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--basedir', default=None)
+    ap.add_argument('--n-docs', type=int, default=5000)
+    ap.add_argument('--max-workers', type=int, default=os.cpu_count())
+    ap.add_argument('--repeats', type=int, default=3)
+    args = ap.parse_args(argv)
+    worker_counts = sorted({1, *(2**i for i in range(1, 8) if 2**i <= args.max_workers), args.max_workers})
+    if args.basedir:
+        return bench_load_all_documents(args.basedir, worker_counts, repeats=args.repeats)
+    with tempfile.TemporaryDirectory() as basedir:
+        print(f"Generating {args.n_docs} synthetic journals in {basedir} ...", file=sys.stderr)
+        make_synthetic_notebook(basedir, n_docs=args.n_docs)
+        return bench_load_all_documents(basedir, worker_counts, repeats=args.repeats)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+
+Benchmark for the per-document overhead of `compile_markdown_to_html()`, comparing
+`markdown.markdown()` (which creates a new Markdown instance and loads all extensions for every document)
+with the cached, reused instances from `markdown_compilation.get_markdown_converter()`.
+
+Usage:
+
+    $ python benchmarks/bench_markdown.py [--n-docs 2000]
+
+"""
+
+import time
+import argparse
+import contextlib
+import io
+
+import markdown
+
+from zepto_eln.md_utils.markdown_compilation import (
+    compile_markdown_to_html, get_markdown_converter, DEFAULT_MARKDOWN_EXTENSIONS)
+
+SMALL_JOURNAL = """
+# RS{i:05} - Small journal
+
+Started experiment. See [protocol](protocol.md).
+
+* Step 1: Mix `buffer A` with buffer B.
+* Step 2: Incubate 10 min.
+
+| Sample | Conc. |
+|--------|-------|
+| S1     | {i}   |
+
+```python
+print("hello")
+```
+"""
+
+
+def bench(n_docs=2000):
+    documents = [SMALL_JOURNAL.format(i=i) for i in range(n_docs)]
+    extensions = list(DEFAULT_MARKDOWN_EXTENSIONS)
+
+    start = time.perf_counter()
+    expected = [markdown.markdown(doc, extensions=extensions) for doc in documents]
+    t_fresh = time.perf_counter() - start
+
+    start = time.perf_counter()
+    md = get_markdown_converter(extensions)
+    results = [md.reset().convert(doc) for doc in documents]
+    t_reused = time.perf_counter() - start
+    assert results == expected, "Reused Markdown instance gave different output."
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = [compile_markdown_to_html(doc) for doc in documents]
+    t_compile = time.perf_counter() - start
+    assert results == expected
+
+    print(f"{n_docs} small journals:")
+    print(f"  markdown.markdown() (new instance per doc): {t_fresh / n_docs * 1e6:8.1f} us/doc")
+    print(f"  reused Markdown instance (.reset()):        {t_reused / n_docs * 1e6:8.1f} us/doc")
+    print(f"  compile_markdown_to_html():                 {t_compile / n_docs * 1e6:8.1f} us/doc")
+    print(f"  speedup: {t_fresh / t_reused:.2f}x")
+
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--n-docs', type=int, default=2000)
+    bench(ap.parse_args().n_docs)
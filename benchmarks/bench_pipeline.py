@@ -0,0 +1,93 @@
+"""
+
+Benchmark for the streaming pipeline (`md_utils.pipeline`): peak memory and time, compared with materialising
+each step as a list (load all documents, then convert all documents, then write all documents).
+
+Peak memory is measured with tracemalloc, so all stages run in the current process (inline or thread executors);
+the peak for the pipeline should stay roughly constant as the notebook grows, while the list-based peak grows
+with the size of the notebook. The 'separate' run uses separate 'markdown' and 'template' stages
+(`fuse_render=False`), for comparison with the default fused 'render' stage.
+
+Usage:
+
+    $ python benchmarks/bench_pipeline.py [--n-journals 2000] [--queue-size 16] [--basedir <existing notebook>]
+
+If no basedir is given, a synthetic notebook is generated in a temporary directory (see `eln_corpus.py`).
+
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+from zepto_eln.md_utils.document_io import find_md_files
+from zepto_eln.md_utils.pipeline import (
+    markdown_pipeline, load_stage, pico_stage, markdown_stage, template_stage, write_stage)
+
+try:
+    from eln_corpus import generate_corpus
+except ImportError:
+    from benchmarks.eln_corpus import generate_corpus
+
+
+def run_lists(basedir, template_dir, outputfn):
+    """ Process the notebook one step at a time, materialising a list of documents for each step. """
+    documents = [load_stage(path) for path in find_md_files(basedir)]
+    documents = [pico_stage(document) for document in documents]
+    documents = [markdown_stage(document) for document in documents]
+    documents = [template_stage(document, template_dir=template_dir) for document in documents]
+    return len([write_stage(document, outputfn=outputfn) for document in documents])
+
+
+def run_pipeline(basedir, template_dir, outputfn, executor='thread', queue_size=16, fuse_render=True):
+    pipeline = markdown_pipeline(
+        basedir, outputfn=outputfn, template_dir=template_dir, executor=executor, workers=2, queue_size=queue_size,
+        errors='raise', fuse_render=fuse_render)
+    return pipeline.run()
+
+
+def measure(func, *args, **kwargs):
+    """ Return (result, seconds, peak traced memory in MB) for func(*args, **kwargs). """
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak / 1e6
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--n-journals', type=int, default=2000)
+    ap.add_argument('--queue-size', type=int, default=16)
+    ap.add_argument('--basedir', default=None, help="Use an existing notebook (must have a template dir).")
+    ap.add_argument('--template-dir', default=None)
+    args = ap.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        basedir, template_dir = args.basedir, args.template_dir
+        if basedir is None:
+            print(f"Generating synthetic corpus ({args.n_journals} journals) in {tmpdir} ...", file=sys.stderr)
+            basedir = os.path.join(tmpdir, 'notebook')
+            template_dir = generate_corpus(basedir, n_journals=args.n_journals)['template_dir']
+        outputfn = os.path.join(tmpdir, 'out', '{filename_noext}.html')
+        print(f"{'method':<28} {'docs':>6} {'time (s)':>9} {'peak (MB)':>10}")
+        for name, func, kwargs in [
+            ('lists', run_lists, {}),
+            ('pipeline (inline)', run_pipeline, {'executor': 'inline', 'queue_size': args.queue_size}),
+            ('pipeline (thread)', run_pipeline, {'executor': 'thread', 'queue_size': args.queue_size}),
+            ('pipeline (thread, separate)', run_pipeline,
+             {'executor': 'thread', 'queue_size': args.queue_size, 'fuse_render': False}),
+        ]:
+            n, elapsed, peak_mb = measure(func, basedir, template_dir, outputfn, **kwargs)
+            print(f"{name:<28} {n:>6} {elapsed:9.2f} {peak_mb:10.1f}")
+
+
+if __name__ == '__main__':
+    main()
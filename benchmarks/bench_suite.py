@@ -0,0 +1,239 @@
+"""
+
+Benchmark suite: Time each stage of the ELN pipeline on a synthetic corpus (see `eln_corpus.py`).
+
+Stages:
+
+* scan:             `document_io.find_md_files()`
+* split_yfm:        `yfm.split_yfm()` on the (pre-read) raw file contents.
+* parse_yfm:        `yfm.parse_yfm()` on the raw file contents (split + YAML parsing).
+* pico:             `substitute_pico_variables()` on the markdown content.
+* markdown:         `compile_markdown_to_html()` on the (substituted) markdown content.
+* apply_template:   `templating.apply_template()` with the compiled HTML.
+* compile_document: End-to-end `compile_markdown_document()`, including writing the HTML file.
+* render_cached:    `render_cache.RenderCache.get()` for every document, on a warm cache (i.e. validating and serving
+                    the cached HTML; compare with compile_document).
+* build_site:       `eln_build_site.build_site()` on the whole notebook, using one worker process per CPU core
+                    (compare with compile_document for the parallel speed-up).
+* report_*:         The report commands (started/unfinished experiments, YFM issues), with and without the
+                    metadata index.
+* query_indexed:    `query_metadata()` with indexed conditions and sorting, on a warm index (including the
+                    index refresh, i.e. a scan and stat of all files).
+
+In-memory stages (split_yfm to apply_template) use pre-read inputs, so they measure only that stage.
+Each stage is run `--repeats` times; the best, median and mean times are reported.
+Results are written as JSON (`--output`), and can be compared against a previous run (`--compare`).
+
+Usage:
+
+    $ python benchmarks/bench_suite.py --n-journals 2000 --output results.json
+    $ python benchmarks/bench_suite.py --n-journals 2000 --compare results.json
+    $ python benchmarks/bench_suite.py --stages scan,parse_yfm,markdown
+
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import datetime
+import tempfile
+import statistics
+import subprocess
+import contextlib
+
+from zepto_eln.md_utils.document_io import find_md_files, get_fileinfo
+from zepto_eln.md_utils.yfm import split_yfm, parse_yfm
+from zepto_eln.md_utils.pico_utils import substitute_pico_variables
+from zepto_eln.md_utils.markdown_compilation import compile_markdown_to_html, compile_markdown_document
+from zepto_eln.md_utils.templating import apply_template
+from zepto_eln.eln_utils.eln_exp_filters import get_started_exps, get_unfinished_exps
+from zepto_eln.eln_utils.eln_md_pico import print_document_yfm_issues, REQUIRED_KEYS
+from zepto_eln.md_utils.query import query_metadata
+from zepto_eln.md_utils.render_cache import RenderCache
+from zepto_eln.eln_utils.eln_build_site import build_site
+
+try:
+    from eln_corpus import CORPUS_DEFAULTS, generate_corpus
+except ImportError:
+    from benchmarks.eln_corpus import CORPUS_DEFAULTS, generate_corpus
+
+RESULTS_SCHEMA_VERSION = 1
+STAGES = (
+    'scan', 'split_yfm', 'parse_yfm', 'pico', 'markdown', 'apply_template', 'compile_document', 'render_cached',
+    'build_site',
+    'report_started', 'report_unfinished', 'report_yfm_issues', 'report_started_indexed', 'query_indexed',
+)
+
+
+@contextlib.contextmanager
+def quiet():
+    """ Suppress stdout/stderr output from the code being benchmarked. """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        yield
+
+
+def time_stage(func, repeats=3, n_items=1, n_bytes=None):
+    """ Time `func()` `repeats` times, returning a dict with timing statistics. """
+    timings = []
+    for _ in range(repeats):
+        with quiet():
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    best = min(timings)
+    result = {
+        'repeats': repeats, 'n_items': n_items,
+        'best_s': best, 'median_s': statistics.median(timings), 'mean_s': statistics.mean(timings),
+        'per_item_us': best / n_items * 1e6 if n_items else None,
+        'items_per_s': n_items / best if best > 0 else None,
+    }
+    if n_bytes is not None:
+        result['mb_per_s'] = n_bytes / best / 1e6 if best > 0 else None
+    return result
+
+
+def get_git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_suite(basedir, template_dir, stages=STAGES, repeats=3):
+    """ Run the benchmark stages on the notebook in basedir.
+
+    Returns:
+        Dict with {stage: timing results}.
+    """
+    results = {}
+
+    def run(stage, func, **kwargs):
+        if stage in stages:
+            results[stage] = time_stage(func, repeats=repeats, **kwargs)
+            r = results[stage]
+            print(f"{stage:<24} {r['best_s']*1e3:10.1f} ms  ({r['per_item_us']:9.1f} us/item)", file=sys.stderr)
+
+    files = find_md_files(basedir)
+    n = len(files)
+    raw_contents = []
+    for fn in files:
+        with open(fn, encoding='utf-8') as fd:
+            raw_contents.append(fd.read())
+    n_bytes = sum(len(raw.encode('utf-8')) for raw in raw_contents)
+    parsed = [parse_yfm(raw) for raw in raw_contents]
+    pico_vars = [dict(meta=meta, content=content, **get_fileinfo(fn)) for fn, (meta, content) in zip(files, parsed)]
+    with quiet():
+        contents = [substitute_pico_variables(content, template_vars=tvars)
+                    for (_, content), tvars in zip(parsed, pico_vars)]
+        htmls = [compile_markdown_to_html(content) for content in contents]
+    template_source = open(os.path.join(template_dir, 'index.jinja'), encoding='utf-8').read()
+
+    run('scan', lambda: find_md_files(basedir), n_items=n)
+    run('split_yfm', lambda: [split_yfm(raw) for raw in raw_contents], n_items=n, n_bytes=n_bytes)
+    run('parse_yfm', lambda: [parse_yfm(raw) for raw in raw_contents], n_items=n, n_bytes=n_bytes)
+    run('pico', lambda: [
+        substitute_pico_variables(content, template_vars=tvars)
+        for (_, content), tvars in zip(parsed, pico_vars)], n_items=n, n_bytes=n_bytes)
+    run('markdown', lambda: [compile_markdown_to_html(content) for content in contents], n_items=n, n_bytes=n_bytes)
+    run('apply_template', lambda: [
+        apply_template(template_source, template_vars=dict(tvars, content=html))
+        for tvars, html in zip(pico_vars, htmls)], n_items=n)
+
+    with tempfile.TemporaryDirectory() as outdir:
+        outputfn = os.path.join(outdir, "{filename_noext}.html")
+        run('compile_document', lambda: [
+            compile_markdown_document(fn, outputfn=outputfn, template_dir=template_dir) for fn in files],
+            n_items=n, n_bytes=n_bytes)
+
+        if 'render_cached' in stages:
+            render_cache = RenderCache(template_dir=template_dir)
+            with quiet():
+                for fn in files:
+                    render_cache.get(fn)
+            run('render_cached', lambda: [render_cache.get(fn) for fn in files], n_items=n)
+
+        def build():
+            with quiet():  # build_site() prints a summary.
+                build_site(basedir, os.path.join(outdir, 'site'), workers=0, template_dir=template_dir)
+        run('build_site', build, n_items=n, n_bytes=n_bytes)
+
+    run('report_started', lambda: get_started_exps(basedir), n_items=n)
+    run('report_unfinished', lambda: get_unfinished_exps(basedir), n_items=n)
+    run('report_yfm_issues', lambda: print_document_yfm_issues(basedir, REQUIRED_KEYS), n_items=n)
+    if 'report_started_indexed' in stages or 'query_indexed' in stages:
+        with quiet():
+            get_started_exps(basedir, use_index=True)  # Build the index; the benchmark measures warm-index queries.
+    run('report_started_indexed', lambda: get_started_exps(basedir, use_index=True), n_items=n)
+    run('query_indexed', lambda: query_metadata(
+        basedir, ['status=started', 'startdate<2024-01-01'], sort='-startdate', fields=['expid', 'titledesc']),
+        n_items=n)
+    return results
+
+
+def compare_results(baseline, current):
+    """ Print a comparison table (time per item) of two result dicts (as written by `main()`). """
+    if baseline.get('corpus') != current.get('corpus'):
+        print("\nNOTE: The baseline was run on a different corpus; comparing time per item.")
+    print(f"\n{'stage':<24} {'baseline (us/item)':>19} {'current (us/item)':>19} {'ratio':>8}")
+    for stage, result in current['results'].items():
+        base = baseline['results'].get(stage)
+        if base is None:
+            print(f"{stage:<24} {'-':>19} {result['per_item_us']:19.1f} {'-':>8}")
+            continue
+        ratio = result['per_item_us'] / base['per_item_us'] if base['per_item_us'] else float('nan')
+        print(f"{stage:<24} {base['per_item_us']:19.1f} {result['per_item_us']:19.1f} {ratio:8.2f}")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--basedir', default=None, help="Generate the corpus in this directory (default: a temp dir).")
+    ap.add_argument('--stages', default=','.join(STAGES), help="Comma-separated list of stages to run.")
+    ap.add_argument('--repeats', type=int, default=3)
+    ap.add_argument('--output', default=None, help="Write the results as JSON to this file ('-' for stdout).")
+    ap.add_argument('--compare', default=None, help="Compare with the results in this JSON file.")
+    for key, default in CORPUS_DEFAULTS.items():
+        ap.add_argument('--' + key.replace('_', '-'), type=type(default), default=default,
+                        help=f"Corpus parameter (default: {default}).")
+    args = ap.parse_args(argv)
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        ap.error(f"Unknown stages: {sorted(unknown)}. Available stages: {', '.join(STAGES)}.")
+    corpus_params = {key: getattr(args, key) for key in CORPUS_DEFAULTS}
+
+    with contextlib.ExitStack() as stack:
+        basedir = args.basedir or stack.enter_context(tempfile.TemporaryDirectory())
+        print(f"Generating synthetic corpus ({args.n_journals} journals) in {basedir} ...", file=sys.stderr)
+        corpus = generate_corpus(basedir, **corpus_params)
+        results = run_suite(basedir, corpus.pop('template_dir'), stages=stages, repeats=args.repeats)
+
+    output = {
+        'schema_version': RESULTS_SCHEMA_VERSION,
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'git_commit': get_git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'corpus': corpus,
+        'results': results,
+    }
+    if args.output == '-':
+        json.dump(output, sys.stdout, indent=1)
+        print()
+    elif args.output:
+        with open(args.output, 'w', encoding='utf-8') as fd:
+            json.dump(output, fd, indent=1)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as fd:
+            compare_results(json.load(fd), output)
+    return output
+
+
+if __name__ == '__main__':
+    main()
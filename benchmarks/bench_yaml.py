@@ -0,0 +1,200 @@
+"""
+
+Conformance check and benchmark for the fast YAML front-matter parsing in `md_utils.flat_yaml`.
+
+Conformance: `flat_yaml.load_yaml()` must give results identical to `yaml.load(text, Loader=yaml.SafeLoader)`
+(same types and values, or the same exception type) for:
+
+* A list of hand-written edge cases (quoting, comments, indicators, special scalars, dates, ...).
+* Headers in the shapes generated by the synthetic corpus (flat, flat with lists, nested).
+* Randomly generated "almost flat" headers, built from tokens that are known to be tricky.
+
+The script exits with a non-zero status if any case differs.
+
+Benchmark: Time per header for SafeLoader, CSafeLoader (if available), and `load_yaml()`, for each header shape.
+
+Usage:
+
+    $ python benchmarks/bench_yaml.py [--n-random 20000] [--n-headers 2000] [--no-bench]
+
+"""
+
+import sys
+import math
+import time
+import random
+import argparse
+import datetime
+
+import yaml
+
+from zepto_eln.md_utils.flat_yaml import load_yaml, parse_flat_yaml, NOT_FLAT
+
+try:
+    from eln_corpus import _flat_yfm, _nested_yfm
+except ImportError:
+    from benchmarks.eln_corpus import _flat_yfm, _nested_yfm
+
+EDGE_CASES = [
+    "a: 1", "a: -1", "a: +1", "a: 0x1F", "a: 0o17", "a: 017", "a: 1_000", "a: 1:30", "a: 1.5", "a: 1e3", "a: .5",
+    "a: .inf", "a: -.inf", "a: .nan", "a: .NaN", "a: yes", "a: No", "a: on", "a: OFF", "a: y", "a: true",
+    "a: null", "a: ~", "a: Null", "a:", "a: ", "a:    ", "a:  value  ", "a: =", "a: <<",
+    "a: 2018-01-05", "a: 2018-1-5", "a: 2018-13-45", "a: 2018-01-05 10:20:30", "a: 2018-01-05T10:20:30Z",
+    "a: 2018-01-05 10:20:30.5 +02:00", "a: 20180105",
+    "a: http://example.com/a#b", "a: value # comment", "a: value #not a comment", "a: a: b", "a: a:b", "a: b:",
+    "a: 'quoted'", 'a: "quoted"', "a: it's", 'a: say "hi"', "a: -", "a: - b", "a: --b", "a: -b", "a: ?", "a: ? b",
+    "a: :b", "a: !tag b", "a: !!str 1", "a: &anchor b", "a: *alias", "a: |", "a: >", "a: %b", "a: @b", "a: `b`",
+    "a: {b: c}", "a: {}", "a: []", "a: [ ]", "a: [b, c]", "a: [b,c]", "a: [ b , c ]", "a: [1, 2.5, yes, null, ~]",
+    "a: [b, [c]]", "a: [b, c,]", "a: [b,, c]", "a: ['b', c]", "a: [b: c]", "a: [b #c]", "a: [b] c", "a: [b",
+    "a: [2018-01-05, .inf]", "a: b\tc", "a:\tb", "a: b\x85c", "a: b\u2028c", "a: \ufeffb", "a: b\xa0c",
+    "a: æøå ☃", "æ: b", "a b: c", "a-b: c", "a_b: c", "_a: b", "1: b", "yes: b", "null: b", "True: b", "-a: b",
+    "a: 1\na: 2", "a: 1\nb: 2\nc: 3", "a: 1\r\nb: 2\r\n", "# comment\na: 1", "a: 1\n# comment\n", "  # comment\na: 1",
+    "a: 1\n\n\nb: 2", "a: 1\n  b: 2", "a:\n  - 1\n  - 2", "a:\n  b: 1", "a: b\n  c", "a: |\n  text\n",
+    "", "\n", "# only a comment", "...", "a: 1\n...", "%YAML 1.1\n---\na: 1", "- a\n- b", "just a string",
+    "a: [b,\n  c]", "a: 'multi\n  line'", "? a\n: b", "a: 1 ", "a: b  ", "a: 12:30:00", "a: 1,000", "a: $100",
+    "a: 100%", "a: C:\\path\\file", "a: <b>", "a: a|b", "a: a>b", "a: a{b}", "a: a[b]", "a: b]", "a: b}",
+]
+
+RANDOM_KEYS = ['a', 'b_c', 'expid', 'yes', 'null', '1', 'a b', 'x-y', 'k']
+RANDOM_VALUES = [
+    '', 'value', 'two words', '1', '-2', '3.0', '.inf', 'true', 'no', '~', 'null', '2018-02-03', '2018-02-03 04:05',
+    'a: b', 'a:b', 'a #b', 'a#b', "'q'", '"q"', '[a, b]', '[1, 2]', '[]', '[a,]', '{a: b}', '-', '- a', '?', '|', '>',
+    '&x', '*x', '!t x', '%x', '@x', 'http://x.y/z', 'ø', 'a\tb', '[a, [b]]', '0x10', '010', '1_0', '=', '<<',
+]
+
+
+def same(a, b):
+    """ Return True if a and b have identical types and values (treating NaN as equal to NaN). """
+    if type(a) is not type(b):
+        return False
+    if isinstance(a, float) and math.isnan(a):
+        return math.isnan(b)
+    if isinstance(a, dict):
+        return list(a) == list(b) and all(same(k1, k2) for k1, k2 in zip(a, b)) and all(
+            same(a[k], b[k]) for k in a)
+    if isinstance(a, list):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    if isinstance(a, (datetime.datetime, datetime.time)):
+        return a == b and a.tzinfo == b.tzinfo
+    return a == b
+
+
+def reference_load(text):
+    try:
+        return 'ok', yaml.load(text, Loader=yaml.SafeLoader)
+    except Exception as exc:
+        return 'error', type(exc)
+
+
+def fast_load(text):
+    try:
+        return 'ok', load_yaml(text)
+    except Exception as exc:
+        return 'error', type(exc)
+
+
+def check_case(text):
+    """ Return None if load_yaml(text) is identical to SafeLoader, else a description of the difference. """
+    ref_kind, ref = reference_load(text)
+    kind, result = fast_load(text)
+    if kind != ref_kind or (kind == 'ok' and not same(result, ref)) or (kind == 'error' and result is not ref):
+        return f"{text!r}: SafeLoader -> {ref_kind} {ref!r}, load_yaml -> {kind} {result!r}"
+    return None
+
+
+def uses_fast_path(text):
+    try:
+        return parse_flat_yaml(text) is not NOT_FLAT
+    except ValueError:  # E.g. invalid dates, which SafeLoader also raises.
+        return True
+
+
+def random_header(rng):
+    return "\n".join(
+        f"{rng.choice(RANDOM_KEYS)}:{rng.choice(['', ' ', '  '])}{rng.choice(RANDOM_VALUES)}"
+        + rng.choice(['', '', ' ', ' # c'])
+        for _ in range(rng.randint(1, 6)))
+
+
+def corpus_headers(n, kind, seed=0):
+    rng = random.Random(seed)
+    make = {'flat': _flat_yfm, 'nested': _nested_yfm}[kind]
+    return [make(rng, i, f"RS{i:05}") for i in range(n)]
+
+
+def run_conformance(n_random=20000, seed=0):
+    """ Run the conformance check. Returns a list of failures (str).
+
+    A case fails if the flat fast path was used and the result differs from SafeLoader in any way,
+    or if SafeLoader accepts the text and load_yaml gives a different result.
+    Invalid YAML that falls back to CSafeLoader is not a failure: libyaml is more lenient than the pure-Python
+    scanner for some invalid input (e.g. tabs inside plain scalars), and raises different exception types.
+    These divergences are counted and reported separately.
+    """
+    rng = random.Random(seed)
+    cases = list(EDGE_CASES)
+    cases += corpus_headers(200, 'flat', seed) + corpus_headers(200, 'nested', seed)
+    cases += [random_header(rng) for _ in range(n_random)]
+    failures, divergences, n_fast = [], [], 0
+    for case in cases:
+        fast = uses_fast_path(case)
+        n_fast += fast
+        difference = check_case(case)
+        if difference is None:
+            continue
+        if fast or reference_load(case)[0] == 'ok':
+            failures.append(difference)
+        else:
+            divergences.append(difference)
+    print(f"Conformance: {len(cases)} cases ({n_fast} via the flat fast path), {len(failures)} differences.")
+    print(f"({len(divergences)} cases of invalid YAML rejected by SafeLoader but handled differently by libyaml.)")
+    for failure in failures[:50]:
+        print("  DIFFERENT:", failure)
+    return failures
+
+
+def bench(headers, func, repeats=3):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for text in headers:
+            func(text)
+        best = min(best, time.perf_counter() - start)
+    return best / len(headers) * 1e6
+
+
+def run_benchmark(n_headers=2000):
+    shapes = {
+        'flat': corpus_headers(n_headers, 'flat'),
+        'flat (no lists)': [
+            "\n".join(line for line in text.split('\n') if not line.startswith('tags:'))
+            for text in corpus_headers(n_headers, 'flat')],
+        'nested': corpus_headers(n_headers, 'nested'),
+    }
+    loaders = {'SafeLoader': lambda text: yaml.load(text, Loader=yaml.SafeLoader)}
+    if hasattr(yaml, 'CSafeLoader'):
+        loaders['CSafeLoader'] = lambda text: yaml.load(text, Loader=yaml.CSafeLoader)
+    else:
+        print("NOTE: PyYAML was built without libyaml; CSafeLoader is not available.")
+    loaders['load_yaml'] = load_yaml
+    print(f"\n{'shape':<18}" + "".join(f"{name + ' (us)':>18}" for name in loaders) + f"{'speedup':>10}")
+    for shape, headers in shapes.items():
+        timings = {name: bench(headers, loader) for name, loader in loaders.items()}
+        print(f"{shape:<18}" + "".join(f"{t:18.1f}" for t in timings.values())
+              + f"{timings['SafeLoader'] / timings['load_yaml']:9.1f}x")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--n-random', type=int, default=20000)
+    ap.add_argument('--n-headers', type=int, default=2000)
+    ap.add_argument('--no-bench', dest='bench', action='store_false')
+    args = ap.parse_args(argv)
+    failures = run_conformance(n_random=args.n_random)
+    if args.bench:
+        run_benchmark(n_headers=args.n_headers)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
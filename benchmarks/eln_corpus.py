@@ -0,0 +1,186 @@
+"""
+
+Synthetic ELN corpus generator, for benchmarks.
+
+Generates a notebook directory tree of markdown journals with YAML front-matter, with configurable:
+
+* Number of journals (and journals per sub-directory).
+* Size distribution: the number of paragraphs per journal is log-normally distributed,
+    so most journals are short and a few are long, as in a real notebook.
+* Front-matter complexity: 'flat' (`key: scalar` headers, like most of our journals),
+    'nested' (lists of mappings, multi-line strings), or 'mixed' (mostly flat, some nested).
+* Pico %placeholder% density (average number of placeholders per paragraph).
+* Number of tables and fenced code blocks per journal.
+
+The corpus is deterministic for a given seed, so benchmark runs on different machines/commits are comparable.
+A template directory (with an `index` template as both `.jinja` and `.twig`) is also created.
+
+Usage:
+
+    $ python benchmarks/eln_corpus.py <basedir> [--n-journals 1000] [--yfm mixed] ...
+
+"""
+
+import os
+import math
+import json
+import random
+import argparse
+
+CORPUS_DEFAULTS = dict(
+    n_journals=1000,
+    docs_per_dir=100,
+    size_median=12,  # Median number of paragraphs per journal.
+    size_sigma=0.8,  # Sigma of the log-normal paragraph count distribution.
+    yfm='mixed',  # 'flat', 'nested', or 'mixed'.
+    placeholder_density=0.5,  # Average number of %placeholders% per paragraph.
+    tables=1,  # Tables per journal.
+    table_rows=10,
+    code_blocks=1,  # Fenced code blocks per journal.
+    seed=0,
+)
+
+STATUSES = ('started', 'completed', 'completed', 'completed', 'cancelled', 'planned')
+AUTHORS = ('Rasmus Scholer Sorensen', 'Jane Doe', 'John Smith', 'Kim Larsen', 'Ana Garcia')
+WORDS = (
+    "buffer sample incubate protocol gel ladder band lane DNA oligo staple scaffold anneal fold purify spin "
+    "column elute measure absorbance concentration dilute aliquot store freezer result image scan analysis "
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore"
+).split()
+PLACEHOLDERS = ('%meta.expid%', '%meta.title%', '%meta.author%', '%filename%', '%meta.status%', '%dirname%')
+
+INDEX_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><title>{{ meta.title }}</title></head>
+<body>
+<h1>{{ meta.expid }} - {{ meta.titledesc }}</h1>
+<p class="meta">{{ meta.author }}, {{ meta.startdate }}{% if meta.enddate %} to {{ meta.enddate }}{% endif %}</p>
+{% if meta.tags %}<ul class="tags">{% for tag in meta.tags %}<li>{{ tag }}</li>{% endfor %}</ul>{% endif %}
+<article>
+{{ content }}
+</article>
+</body>
+</html>
+"""
+
+
+def _flat_yfm(rng, i, expid):
+    status = rng.choice(STATUSES)
+    startdate = f"20{18 + i % 8}-{i % 12 + 1:02}-{i % 28 + 1:02}"
+    enddate = f"20{18 + i % 8}-{i % 12 + 1:02}-{min(28, i % 28 + 3):02}" if status == 'completed' else 'null'
+    return "\n".join([
+        f"title: {expid} - Synthetic journal {i}",
+        "description: Synthetic journal for benchmarking.",
+        f"author: {rng.choice(AUTHORS)}",
+        f"expid: {expid}",
+        f"titledesc: Synthetic journal number {i}",
+        f"status: {status}",
+        f"startdate: {startdate}",
+        f"enddate: {enddate}",
+        f"result: {'null' if status != 'completed' else 'Success'}",
+        f"tags: [{', '.join(rng.sample(WORDS[:20], 3))}]",
+    ])
+
+
+def _nested_yfm(rng, i, expid):
+    samples = "\n".join(
+        f"  - name: S{j}\n    conc: {rng.uniform(1, 100):.2f}\n    buffer: {rng.choice(WORDS)}"
+        for j in range(rng.randint(2, 6)))
+    return "\n".join([
+        _flat_yfm(rng, i, expid),
+        "project:",
+        f"  name: Project {i % 17}",
+        f"  funding: [grant-{i % 5}, grant-{i % 7}]",
+        "samples:",
+        samples,
+        "notes: |",
+        "  Multi-line notes,",
+        f"  for journal {expid}.",
+    ])
+
+
+def _paragraph(rng, placeholder_density):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(30, 80))]
+    # Poisson-ish number of placeholders, at random positions:
+    n_placeholders = sum(rng.random() < placeholder_density / 4 for _ in range(4))
+    for _ in range(n_placeholders):
+        words.insert(rng.randrange(len(words)), rng.choice(PLACEHOLDERS))
+    if rng.random() < 0.3:
+        words.insert(rng.randrange(len(words)), "`inline %code%`")
+    if rng.random() < 0.2:
+        words.insert(rng.randrange(len(words)), "**important**")
+    return " ".join(words) + "."
+
+
+def _table(rng, n_rows):
+    rows = ["| Sample | Conc (nM) | Volume (ul) | Note |", "|---|---:|---:|---|"]
+    rows += [f"| S{j} | {rng.uniform(1, 500):.1f} | {rng.randint(1, 100)} | {rng.choice(WORDS)} |"
+             for j in range(n_rows)]
+    return "\n".join(rows)
+
+
+def _code_block(rng):
+    lines = [f"{rng.choice(WORDS)} = {rng.randint(0, 1000)}  # %not_a_placeholder%" for _ in range(rng.randint(3, 12))]
+    return "```python\n" + "\n".join(lines) + "\n```"
+
+
+def make_journal(rng, i, expid, params):
+    """ Return the text of a single synthetic journal. """
+    yfm_kind = params['yfm']
+    if yfm_kind == 'mixed':
+        yfm_kind = 'nested' if rng.random() < 0.2 else 'flat'
+    yfm = (_nested_yfm if yfm_kind == 'nested' else _flat_yfm)(rng, i, expid)
+    n_paragraphs = max(1, round(rng.lognormvariate(math.log(params['size_median']), params['size_sigma'])))
+    blocks = ["# %meta.title%"]
+    blocks += [_paragraph(rng, params['placeholder_density']) for _ in range(n_paragraphs)]
+    extras = [_table(rng, params['table_rows']) for _ in range(params['tables'])]
+    extras += [_code_block(rng) for _ in range(params['code_blocks'])]
+    for extra in extras:
+        blocks.insert(rng.randint(1, len(blocks)), extra)
+    blocks.insert(1, "## Procedure\n\n1. Step one\n2. Step two\n    * Sub-step with %meta.expid%")
+    return f"---\n{yfm}\n---\n\n" + "\n\n".join(blocks) + "\n"
+
+
+def generate_corpus(basedir, **params):
+    """ Generate a synthetic notebook in basedir.
+
+    Args:
+        basedir: The directory to create the notebook in (created if it doesn't exist).
+        **params: Corpus parameters, see CORPUS_DEFAULTS.
+
+    Returns:
+        Dict with the corpus parameters, and 'n_files', 'total_bytes', 'template_dir'.
+    """
+    unknown = set(params) - set(CORPUS_DEFAULTS)
+    if unknown:
+        raise TypeError(f"Unknown corpus parameters: {sorted(unknown)}")
+    params = dict(CORPUS_DEFAULTS, **params)
+    rng = random.Random(params['seed'])
+    total_bytes = 0
+    for i in range(params['n_journals']):
+        expid = f"RS{i:05}"
+        dirname = os.path.join(basedir, f"dir{i // params['docs_per_dir']:04}", f"{expid} Synthetic journal")
+        os.makedirs(dirname, exist_ok=True)
+        text = make_journal(rng, i, expid, params)
+        with open(os.path.join(dirname, expid + ".md"), 'w', encoding='utf-8', newline='\n') as fd:
+            total_bytes += fd.write(text)
+    template_dir = os.path.join(basedir, '_templates')
+    os.makedirs(template_dir, exist_ok=True)
+    for ext in ('.jinja', '.twig'):
+        with open(os.path.join(template_dir, 'index' + ext), 'w', encoding='utf-8') as fd:
+            fd.write(INDEX_TEMPLATE)
+    return dict(params, n_files=params['n_journals'], total_bytes=total_bytes, template_dir=template_dir)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('basedir')
+    for key, default in CORPUS_DEFAULTS.items():
+        ap.add_argument('--' + key.replace('_', '-'), type=type(default), default=default)
+    args = vars(ap.parse_args(argv))
+    basedir = args.pop('basedir')
+    print(json.dumps(generate_corpus(basedir, **args), indent=1))
+
+
+if __name__ == '__main__':
+    main()
@@ -54,7 +54,11 @@ setup(
             'eln-print-started-exps=zepto_eln.eln_cli.reports_cli:print_started_exps_cli',
             'eln-print-unfinished-exps=zepto_eln.eln_cli.reports_cli:print_unfinished_exps_cli',
             'eln-print-journal-yfm-issues=zepto_eln.eln_cli.reports_cli:print_journal_yfm_issues_cli',
+            'eln-metadata-index=zepto_eln.eln_cli.reports_cli:metadata_index_cli',
+            'eln-query=zepto_eln.eln_cli.reports_cli:query_cli',
             'eln-md-to-html=zepto_eln.eln_cli.converter_cli:convert_md_file_to_html_cli',
+            'eln-build-site=zepto_eln.eln_cli.converter_cli:build_site_cli',
+            'eln-daemon=zepto_eln.eln_cli.daemon_cli:daemon_cli',
         ],
     },
 
@@ -65,6 +69,10 @@ setup(
         'click',     # Easy creation of command line interfaces (CLI).
         # 'python-dotenv',
     ],
+    extras_require={
+        'watch': ['watchdog'],  # File system notifications for `eln-md-to-html --watch` (falls back to polling).
+        'dataframe': ['pandas', 'pyarrow'],  # DataFrame helpers and the columnar metadata snapshot (eln_df_utils).
+    },
     classifiers=[
         # How mature is this project? Common values are
         #   3 - Alpha
@@ -0,0 +1,207 @@
+"""
+
+Tests for the async API (`md_utils.async_api`): concurrent calls must give the same results as the blocking
+functions, the runner must bound the number of calls in flight, and `aiter_documents()` must keep the order of
+`iter_documents()`, take paths from the scanner as needed, and stop loading documents when the consumer stops
+iterating.
+
+"""
+
+import time
+import asyncio
+import threading
+
+import pytest
+
+from zepto_eln.md_utils import async_api
+from zepto_eln.md_utils.async_api import AsyncRunner, acompile_markdown_document, aload_document, aiter_documents
+from zepto_eln.md_utils.document_io import find_md_files, iter_documents, load_document
+from zepto_eln.md_utils.markdown_compilation import compile_markdown_document
+from benchmarks.eln_corpus import generate_corpus
+
+
+@pytest.fixture(scope='module')
+def corpus(tmp_path_factory):
+    basedir = str(tmp_path_factory.mktemp('notebook'))
+    return basedir, generate_corpus(basedir, n_journals=30)['template_dir']
+
+
+@pytest.fixture
+def runner():
+    with AsyncRunner(cpu_executor='thread', cpu_workers=4) as runner:
+        yield runner
+
+
+def compile_all(paths, template_dir, runner):
+    """ Compile all paths concurrently (in one event loop), returning the HTML for each path. """
+    async def main():
+        documents = await asyncio.gather(*(
+            acompile_markdown_document(path, runner=runner, outputfn=None, template_dir=template_dir)
+            for path in paths))
+        return [document['html'] for document in documents]
+    return asyncio.run(main())
+
+
+def expected_html(paths, template_dir):
+    return [compile_markdown_document(path, outputfn=None, template_dir=template_dir)['html'] for path in paths]
+
+
+@pytest.mark.parametrize('cpu_executor', ['thread', 'process'])
+def test_concurrent_compile(corpus, cpu_executor):
+    basedir, template_dir = corpus
+    paths = find_md_files(basedir) * 2
+    with AsyncRunner(cpu_executor=cpu_executor, cpu_workers=2) as runner:
+        assert compile_all(paths, template_dir, runner) == expected_html(paths, template_dir)
+
+
+def test_concurrent_load(corpus, runner):
+    basedir, _ = corpus
+    paths = find_md_files(basedir)
+
+    async def main():
+        return await asyncio.gather(*(aload_document(path, runner=runner) for path in paths))
+
+    assert asyncio.run(main()) == [load_document(path) for path in paths]
+
+
+class InFlightCounter:
+    """ Callable that sleeps, keeping track of the maximum number of concurrent calls. """
+
+    def __init__(self, duration=0.02):
+        self.duration = duration
+        self.in_flight = self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, value):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.duration)
+        with self.lock:
+            self.in_flight -= 1
+        return value
+
+
+def test_cpu_concurrency_is_bounded():
+    counter = InFlightCounter()
+
+    async def main(runner):
+        return await asyncio.gather(*(runner.run_cpu(counter, i) for i in range(12)))
+
+    with AsyncRunner(cpu_executor='thread', cpu_workers=4, max_cpu_concurrency=2) as runner:
+        assert asyncio.run(main(runner)) == list(range(12))
+    assert counter.max_in_flight == 2
+
+
+def test_io_concurrency_is_bounded():
+    counter = InFlightCounter()
+
+    async def main(runner):
+        return await asyncio.gather(*(runner.run_io(counter, i) for i in range(12)))
+
+    with AsyncRunner(io_workers=8, max_io_concurrency=3) as runner:
+        assert asyncio.run(main(runner)) == list(range(12))
+    assert counter.max_in_flight == 3
+
+
+def _summary(document):
+    return document['filename'], document['meta'], document.get('content')
+
+
+@pytest.mark.parametrize('header_only', [False, True])
+def test_aiter_documents_order(corpus, runner, header_only):
+    basedir, _ = corpus
+    expected = [_summary(doc) for doc in iter_documents(basedir, header_only=header_only)]
+
+    async def collect():
+        return [_summary(doc) async for doc in aiter_documents(
+            basedir, runner=runner, window=4, header_only=header_only)]
+
+    async def main():
+        return await asyncio.gather(*(collect() for _ in range(3)))
+
+    assert expected
+    assert asyncio.run(main()) == [expected] * 3
+
+
+@pytest.mark.parametrize('close', ['break', 'aclose'])
+def test_aiter_documents_stops_loading(corpus, runner, monkeypatch, close):
+    basedir, _ = corpus
+    loaded = []
+    load_document_or_skip = async_api._load_document_or_skip
+
+    def load(filepath, **kwargs):
+        loaded.append(filepath)
+        return load_document_or_skip(filepath, **kwargs)
+
+    monkeypatch.setattr(async_api, '_load_document_or_skip', load)
+
+    async def main():
+        agen = aiter_documents(basedir, runner=runner, window=4)
+        if close == 'break':
+            async for document in agen:
+                break
+            await agen.aclose()  # Done by e.g. `contextlib.aclosing()`, or (later) when the generator is collected.
+        else:
+            document = await agen.__anext__()
+            await agen.aclose()
+        # The loads that were pending when the iteration stopped are cancelled (or finish), none are left running:
+        for _ in range(100):
+            others = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            if not others:
+                break
+            await asyncio.sleep(0.01)
+        return document, others
+
+    document, others = asyncio.run(main())
+    assert document['filename'] == find_md_files(basedir)[0]
+    assert others == []
+    assert len(loaded) <= 4 < len(find_md_files(basedir))
+
+
+def test_aiter_documents_streams_paths(corpus, runner, monkeypatch):
+    basedir, _ = corpus
+    scanned = []
+    iter_md_files = async_api.iter_md_files
+
+    def iter_files(basedir):
+        for path in iter_md_files(basedir):
+            scanned.append(path)
+            yield path
+
+    monkeypatch.setattr(async_api, 'iter_md_files', iter_files)
+
+    async def main():
+        agen = aiter_documents(basedir, runner=runner, window=4)
+        document = await agen.__anext__()
+        await agen.aclose()
+        return document
+
+    assert asyncio.run(main())['filename'] == find_md_files(basedir)[0]
+    assert len(scanned) == 4  # Only the first batch of paths has been taken from the scanner.
+    assert [_summary(doc) for doc in iter_documents(basedir)] == asyncio.run(collect_all(basedir, runner))
+
+
+async def collect_all(basedir, runner, window=3):
+    return [_summary(doc) async for doc in aiter_documents(basedir, runner=runner, window=window)]
+
+
+def test_multiple_event_loops(corpus, runner):
+    basedir, template_dir = corpus
+    paths = find_md_files(basedir)
+    expected = expected_html(paths, template_dir)
+    results, errors = [], []
+
+    def run_loop():
+        try:
+            results.append(compile_all(paths, template_dir, runner))
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=run_loop) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert results == [expected] * 4
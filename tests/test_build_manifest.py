@@ -0,0 +1,105 @@
+"""
+
+Tests for incremental builds (`md_utils.build_manifest`, `eln_md_to_html.convert_md_files_to_html(incremental=True)`):
+which documents are skipped, and which are re-built.
+
+"""
+
+import os
+
+import pytest
+
+from zepto_eln.md_utils.build_manifest import BuildManifest, get_config_hash
+from zepto_eln.eln_utils.eln_md_to_html import convert_md_files_to_html
+
+
+def touch(path, delta_ns=10**9):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + delta_ns))
+
+
+@pytest.fixture
+def notebook(tmp_path):
+    template_dir = tmp_path / 'templates'
+    template_dir.mkdir()
+    (template_dir / 'index.twig').write_text(
+        '{% extends "base.html" %}{% block body %}{% include "footer.html" %}{{ content }}{% endblock %}',
+        encoding='utf-8')
+    (template_dir / 'plain.twig').write_text('PLAIN {{ content }}', encoding='utf-8')
+    (template_dir / 'base.html').write_text('<html>{% block body %}{% endblock %}</html>', encoding='utf-8')
+    (template_dir / 'footer.html').write_text('FOOTER v1', encoding='utf-8')
+    (tmp_path / 'RS001.md').write_text("---\ntitle: First\n---\n# First\n", encoding='utf-8')
+    (tmp_path / 'RS002.md').write_text("---\ntitle: Second\ntemplate: plain\n---\n# Second\n", encoding='utf-8')
+    return tmp_path
+
+
+def build(notebook, **kwargs):
+    options = dict(template_dir=str(notebook / 'templates'), outputfn='{inputfn}.html', open_webbrowser=False)
+    options.update(kwargs)
+    return convert_md_files_to_html(
+        [str(notebook / '*.md')], incremental=True, manifest=str(notebook / 'manifest.json'), **options)
+
+
+def test_skip_unchanged(notebook):
+    assert build(notebook) == {'built': 2, 'skipped': 0, 'failed': 0}
+    assert 'FOOTER v1' in (notebook / 'RS001.md.html').read_text(encoding='utf-8')
+    assert build(notebook) == {'built': 0, 'skipped': 2, 'failed': 0}
+    # Touched, but not modified:
+    touch(notebook / 'RS001.md')
+    assert build(notebook) == {'built': 0, 'skipped': 2, 'failed': 0}
+
+
+def test_rebuild_changed_source_and_missing_output(notebook):
+    build(notebook)
+    (notebook / 'RS001.md').write_text("---\ntitle: First\n---\n# First, edited\n", encoding='utf-8')
+    (notebook / 'RS002.md.html').unlink()
+    assert build(notebook) == {'built': 2, 'skipped': 0, 'failed': 0}
+    assert 'First, edited' in (notebook / 'RS001.md.html').read_text(encoding='utf-8')
+
+
+def test_rebuild_on_included_template_change(notebook):
+    build(notebook)
+    (notebook / 'templates' / 'footer.html').write_text('FOOTER v2', encoding='utf-8')
+    touch(notebook / 'templates' / 'footer.html')
+    # Only RS001's template (index.twig) includes footer.html:
+    assert build(notebook) == {'built': 1, 'skipped': 1, 'failed': 0}
+    assert 'FOOTER v2' in (notebook / 'RS001.md.html').read_text(encoding='utf-8')
+
+
+def test_rebuild_on_template_dir_and_option_changes(notebook):
+    build(notebook)
+    (notebook / 'templates' / 'other.twig').write_text('OTHER {{ content }}', encoding='utf-8')
+    touch(notebook / 'templates')
+    assert build(notebook) == {'built': 2, 'skipped': 0, 'failed': 0}
+    assert build(notebook, extensions=['extra']) == {'built': 2, 'skipped': 0, 'failed': 0}
+    assert build(notebook, extensions=['extra']) == {'built': 0, 'skipped': 2, 'failed': 0}
+    assert build(notebook, extensions=['extra'], overwrite=True) == {'built': 0, 'skipped': 2, 'failed': 0}
+
+
+def test_failed_documents_are_rebuilt(notebook):
+    (notebook / 'templates' / 'broken.twig').write_text('{% if %}', encoding='utf-8')
+    (notebook / 'RS003.md').write_text("---\ntitle: Third\ntemplate: broken\n---\n# Third\n", encoding='utf-8')
+    assert build(notebook) == {'built': 2, 'skipped': 0, 'failed': 1}
+    assert build(notebook) == {'built': 0, 'skipped': 2, 'failed': 1}
+
+
+def test_manifest_entries(tmp_path):
+    source, output, dependency = tmp_path / 'a.md', tmp_path / 'a.html', tmp_path / 'base.html'
+    for path in (source, output, dependency):
+        path.write_text('x', encoding='utf-8')
+    manifest = BuildManifest(str(tmp_path / 'manifest.json'))
+    params = dict(parser='python-markdown', extensions=['extra'], config_hash=get_config_hash({'a': 1}))
+    assert not manifest.is_up_to_date(str(source), **params)
+    manifest.record(str(source), outputs=[str(output)], dependencies=[str(dependency)], **params)
+    manifest.save()
+    manifest = BuildManifest(str(tmp_path / 'manifest.json'))
+    assert manifest.is_up_to_date(str(source), **params)
+    assert not manifest.is_up_to_date(str(source), **dict(params, config_hash=get_config_hash({'a': 2})))
+    assert not manifest.is_up_to_date(str(source), **dict(params, extensions=['extra', 'toc']))
+    touch(dependency)
+    assert not manifest.is_up_to_date(str(source), **params)
+    manifest.remove(str(source))
+    assert manifest.entries == {} and manifest.modified
+    # A corrupt manifest is ignored:
+    (tmp_path / 'manifest.json').write_text('{', encoding='utf-8')
+    assert BuildManifest(str(tmp_path / 'manifest.json')).entries == {}
@@ -0,0 +1,55 @@
+"""
+
+Tests for the whole-notebook site build (`eln_utils.eln_build_site`).
+
+"""
+
+import os
+
+import pytest
+
+from zepto_eln.eln_utils.eln_build_site import build_site, iter_site_documents
+
+
+@pytest.fixture
+def source_root(tmp_path):
+    root = tmp_path / 'notebook'
+    (root / 'sub').mkdir(parents=True)
+    (root / 'RS001.md').write_text("---\ntitle: First\n---\n# First\n", encoding='utf-8')
+    (root / 'sub' / 'RS002.md').write_text("---\ntitle: Second\n---\n# Second\n", encoding='utf-8')
+    (root / 'README.md').write_text("# Readme\n\nNo metadata here.\n", encoding='utf-8')
+    return str(root)
+
+
+def test_build_site(source_root, tmp_path):
+    output_root = str(tmp_path / 'site')
+    summary = build_site(source_root, output_root, workers=1)
+    assert (summary['built'], summary['failures']) == (3, [])
+    assert os.path.isfile(os.path.join(output_root, 'sub', 'RS002.html'))
+    with open(os.path.join(output_root, 'README.html'), encoding='utf-8') as fd:
+        assert '<h1>Readme</h1>' in fd.read()
+
+
+def test_invalid_yfm_fails_document(source_root, tmp_path):
+    with open(os.path.join(source_root, 'RS003.md'), 'w', encoding='utf-8') as fd:
+        fd.write("---\ntitle: [unclosed\n---\nContent\n")
+    summary = build_site(source_root, str(tmp_path / 'site'), workers=1)
+    assert summary['built'] == 3
+    assert [path for path, _ in summary['failures']] == ['RS003.md']
+
+
+def test_output_root_inside_source_root(source_root):
+    output_root = os.path.join(source_root, '_site')
+    assert build_site(source_root, output_root, workers=1)['built'] == 3
+    assert sorted(iter_site_documents(source_root, output_root)) == sorted(
+        ['README.md', 'RS001.md', os.path.join('sub', 'RS002.md')])
+
+
+def test_output_root_same_as_source_root(source_root):
+    with pytest.raises(ValueError):
+        build_site(source_root, source_root + os.sep, workers=1)
+
+
+def test_source_root_inside_output_root(source_root):
+    sub = os.path.join(source_root, 'sub')
+    assert list(iter_site_documents(sub, source_root)) == ['RS002.md']
@@ -0,0 +1,25 @@
+"""
+
+Tests for `eln_utils.eln_md_to_html.ConversionContext`.
+
+"""
+
+import inspect
+
+from zepto_eln.eln_utils.eln_md_to_html import ConversionContext, convert_md_file_to_html
+
+
+def test_defaults_match_convert_md_file_to_html():
+    file_params = inspect.signature(convert_md_file_to_html).parameters
+    for name, param in inspect.signature(ConversionContext).parameters.items():
+        assert param.default == file_params[name].default, name
+
+
+def test_convert(tmp_path):
+    inputfn = tmp_path / 'RS001.md'
+    inputfn.write_text("---\ntitle: First\n---\n# First\n", encoding='utf-8')
+    context = ConversionContext(open_webbrowser=False, apply_template=False)
+    outputfn = context.convert(str(inputfn))
+    assert outputfn == str(inputfn) + '.html'
+    with open(outputfn, encoding='utf-8') as fd:
+        assert '<h1>First</h1>' in fd.read()
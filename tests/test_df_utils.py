@@ -0,0 +1,96 @@
+"""
+
+Tests for the columnar metadata snapshot (`eln_utils.eln_df_utils`): incremental updates, removed rows, dtypes,
+column projection, and the fallback when the snapshot can't be used.
+
+"""
+
+import os
+import datetime
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('pyarrow')
+
+from zepto_eln.eln_utils.eln_df_utils import (  # noqa: E402
+    update_metadata_snapshot, load_metadata_snapshot, get_journals_metadata_df, get_default_snapshot_path)
+
+DOCUMENTS = {
+    'RS001.md': "expid: RS001\nstatus: started\nauthor: Jane Doe\nstartdate: 2019-08-05\ntags: [gel, pcr]",
+    'RS002.md': "expid: RS002\nstatus: completed\nauthor: Kim Larsen\nstartdate: 2019-09-01\nenddate: 2019-09-02",
+    'sub/RS003.md': "expid: RS003\nstatus: started\nproject: {name: Origami}\nstartdate: not a date",
+}
+
+
+def write_document(basedir, relpath, yfm):
+    path = os.path.join(basedir, relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as fd:
+        fd.write(f"---\n{yfm}\n---\nContent\n")
+
+
+@pytest.fixture
+def basedir(tmp_path):
+    for relpath, yfm in DOCUMENTS.items():
+        write_document(str(tmp_path), relpath, yfm)
+    return str(tmp_path)
+
+
+def test_incremental_update(basedir):
+    assert update_metadata_snapshot(basedir) == {'kept': 0, 'updated': 3, 'removed': 0}
+    assert update_metadata_snapshot(basedir) == {'kept': 3, 'updated': 0, 'removed': 0}
+    mtime = os.stat(get_default_snapshot_path(basedir)).st_mtime_ns
+    write_document(basedir, 'RS002.md', "expid: RS002\nstatus: cancelled\nauthor: Kim Larsen")
+    write_document(basedir, 'RS004.md', "expid: RS004\nstatus: started")
+    os.remove(os.path.join(basedir, 'RS001.md'))
+    assert update_metadata_snapshot(basedir) == {'kept': 1, 'updated': 2, 'removed': 1}
+    assert os.stat(get_default_snapshot_path(basedir)).st_mtime_ns != mtime
+    df = load_metadata_snapshot(basedir, update=False)
+    assert df['expid'].tolist() == ['RS002', 'RS004', 'RS003']  # Sorted by path.
+    assert df.set_index('expid').loc['RS002', 'status'] == 'cancelled'
+    assert pd.isna(df.set_index('expid').loc['RS002', 'startdate'])
+
+
+def test_dtypes(basedir):
+    df = load_metadata_snapshot(basedir).set_index('expid')
+    assert isinstance(df['status'].dtype, pd.CategoricalDtype)
+    assert isinstance(df['author'].dtype, pd.CategoricalDtype)
+    assert pd.api.types.is_datetime64_any_dtype(df['startdate'])
+    assert pd.api.types.is_datetime64_any_dtype(df['enddate'])
+    assert df.loc['RS001', 'startdate'] == pd.Timestamp(datetime.date(2019, 8, 5))
+    assert pd.isna(df.loc['RS003', 'startdate'])  # Invalid dates are NaT.
+    assert df.loc['RS001', 'tags'] == 'gel, pcr'
+    assert df.loc['RS003', 'project'] == '{"name": "Origami"}'
+    # The snapshot gives the same values and dtypes as building the DataFrame from the metadata dicts:
+    expected = get_journals_metadata_df(basedir, use_snapshot=False).set_index('expid')
+    pd.testing.assert_frame_equal(df.sort_index(axis=1), expected.loc[df.index].sort_index(axis=1),
+                                  check_categorical=False)
+
+
+def test_column_projection(basedir):
+    df = load_metadata_snapshot(basedir, columns=['expid', 'status', 'nonexistent'])
+    assert df.columns.tolist() == ['expid', 'status']
+    df = load_metadata_snapshot(basedir, add_fileinfo_to_meta=False)
+    assert 'filename' not in df.columns and '_path' not in df.columns
+    assert 'filename' in load_metadata_snapshot(basedir).columns
+
+
+def test_rebuild_after_basedir_change(basedir, tmp_path_factory):
+    snapshot_path = get_default_snapshot_path(basedir)
+    update_metadata_snapshot(basedir)
+    other = str(tmp_path_factory.mktemp('other'))
+    write_document(other, 'RS100.md', "expid: RS100")
+    result = update_metadata_snapshot(other, snapshot_path=snapshot_path)
+    assert result == {'kept': 0, 'updated': 1, 'removed': 0}
+    assert load_metadata_snapshot(other, snapshot_path=snapshot_path, update=False)['expid'].tolist() == ['RS100']
+
+
+def test_falls_back_if_snapshot_unavailable(tmp_path, caplog):
+    basedir = str(tmp_path)
+    for relpath, yfm in DOCUMENTS.items():
+        write_document(basedir, relpath, yfm)
+    (tmp_path / '.zepto-eln').write_text('')  # Neither the index nor the snapshot can be created.
+    df = get_journals_metadata_df(basedir, columns=['expid', 'status'])
+    assert sorted(df['expid']) == ['RS001', 'RS002', 'RS003']
+    assert "Unable to use the metadata snapshot" in caplog.text
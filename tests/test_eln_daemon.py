@@ -0,0 +1,85 @@
+"""
+
+Tests for the ELN daemon client (`eln_utils.eln_daemon`): the socket directory must be private, and commands
+must run in-process whenever the daemon can't be used.
+
+"""
+
+import os
+import socket
+import threading
+
+import pytest
+
+from zepto_eln.eln_utils import eln_daemon
+
+pytestmark = pytest.mark.skipif(not eln_daemon.is_supported(), reason="Unix sockets are not supported.")
+
+
+@pytest.fixture
+def default_socket_dir(tmp_path, monkeypatch):
+    """ Use the default per-user socket directory, in a private temp dir. """
+    monkeypatch.delenv(eln_daemon.SOCKET_ENV_VAR, raising=False)
+    monkeypatch.delenv('XDG_RUNTIME_DIR', raising=False)
+    monkeypatch.setattr(eln_daemon.tempfile, 'gettempdir', lambda: str(tmp_path))
+    return os.path.dirname(eln_daemon.get_socket_path())
+
+
+def test_socket_dir_is_created_private(default_socket_dir):
+    assert eln_daemon.ensure_socket_dir(eln_daemon.get_socket_path()) == default_socket_dir
+    assert os.lstat(default_socket_dir).st_mode & 0o777 == 0o700
+
+
+def test_socket_dir_accessible_by_others_is_refused(default_socket_dir):
+    os.makedirs(default_socket_dir, mode=0o755)
+    os.chmod(default_socket_dir, 0o755)
+    with pytest.raises(PermissionError):
+        eln_daemon.ensure_socket_dir(eln_daemon.get_socket_path())
+    assert eln_daemon.try_forward('build_site', {}) == (False, None)
+
+
+def test_socket_dir_symlink_is_refused(default_socket_dir, tmp_path):
+    target = tmp_path / 'elsewhere'
+    target.mkdir(mode=0o700)
+    os.symlink(target, default_socket_dir)
+    with pytest.raises(PermissionError):
+        eln_daemon.ensure_socket_dir(eln_daemon.get_socket_path())
+
+
+def test_not_running_is_not_forwarded(default_socket_dir):
+    assert eln_daemon.try_forward('build_site', {}) == (False, None)
+
+
+def test_daemon_dying_mid_request_is_not_forwarded(tmp_path):
+    """ A daemon that closes the connection without responding makes the command run in-process. """
+    socket_path = str(tmp_path / 'daemon.sock')
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+
+    def accept_and_close():
+        conn, _ = server.accept()
+        conn.close()
+
+    thread = threading.Thread(target=accept_and_close)
+    thread.start()
+    try:
+        assert eln_daemon.try_forward('build_site', {}, socket_path=socket_path) == (False, None)
+    finally:
+        thread.join()
+        server.close()
+
+
+def test_metadata_index_is_kept_open(tmp_path):
+    (tmp_path / 'RS001.md').write_text("---\nexpid: RS001\nstatus: started\n---\n", encoding='utf-8')
+    daemon = eln_daemon.ElnDaemon(socket_path=str(tmp_path / 'daemon.sock'))
+    daemon.warm_up()
+    try:
+        request = {'command': 'eln-metadata-index', 'kwargs': {'basedir': '.'}, 'cwd': str(tmp_path)}
+        assert daemon.handle(request)['result'] == {'cached': 0, 'parsed': 1, 'removed': 0}
+        assert daemon.status()['open_indexes'] == 1
+        assert daemon.handle(request)['result'] == {'cached': 1, 'parsed': 0, 'removed': 0}
+        assert daemon.status()['open_indexes'] == 1
+    finally:
+        from zepto_eln.md_utils.metadata_index import close_kept_indexes
+        close_kept_indexes()
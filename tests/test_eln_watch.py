@@ -0,0 +1,69 @@
+"""
+
+Tests for watch mode (`eln_utils.eln_watch`): only the affected documents are re-built, including documents whose
+template extends or includes a changed template.
+
+"""
+
+import time
+import threading
+
+import pytest
+
+from zepto_eln.eln_utils.eln_watch import watch_md_files
+
+
+@pytest.fixture
+def notebook(tmp_path):
+    template_dir = tmp_path / 'templates'
+    template_dir.mkdir()
+    (template_dir / 'index.twig').write_text(
+        '{% extends "base.html" %}{% block body %}{{ content }}{% endblock %}', encoding='utf-8')
+    (template_dir / 'plain.twig').write_text('PLAIN {{ content }}', encoding='utf-8')
+    (template_dir / 'base.html').write_text('<html>BASE v1 {% block body %}{% endblock %}</html>', encoding='utf-8')
+    (tmp_path / 'RS001.md').write_text("---\ntitle: First\n---\n# First\n", encoding='utf-8')
+    (tmp_path / 'RS002.md').write_text("---\ntitle: Second\ntemplate: plain\n---\n# Second\n", encoding='utf-8')
+    return tmp_path
+
+
+def watch_until(notebook, change, max_rebuilds=1):
+    """ Start watch mode in a thread, make a change once the initial build is done, and wait for the re-build. """
+    result = {}
+
+    def run():
+        result['counts'] = watch_md_files(
+            [str(notebook / '*.md')], template_dir=str(notebook / 'templates'), open_webbrowser=False,
+            outputfn='{inputfn}.html', poll_interval=0.05, debounce=0.05, use_notifications=False,
+            max_rebuilds=max_rebuilds)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    for _ in range(200):
+        if (notebook / 'RS002.md.html').exists():
+            break
+        time.sleep(0.05)
+    time.sleep(0.1)
+    change()
+    thread.join(timeout=20)
+    assert not thread.is_alive()
+    return result['counts']
+
+
+def test_base_template_change_rebuilds_dependent_documents(notebook):
+    def change():
+        (notebook / 'templates' / 'base.html').write_text(
+            '<html>BASE v2 (edited) {% block body %}{% endblock %}</html>', encoding='utf-8')
+
+    counts = watch_until(notebook, change)
+    assert counts == {'built': 3, 'failed': 0}  # The initial build, and only RS001 is re-built.
+    assert 'BASE v2' in (notebook / 'RS001.md.html').read_text(encoding='utf-8')
+    assert (notebook / 'RS002.md.html').read_text(encoding='utf-8').startswith('PLAIN')
+
+
+def test_input_change_rebuilds_document(notebook):
+    def change():
+        (notebook / 'RS002.md').write_text("---\ntitle: Second\ntemplate: plain\n---\n# Changed\n", encoding='utf-8')
+
+    counts = watch_until(notebook, change)
+    assert counts == {'built': 3, 'failed': 0}
+    assert 'Changed' in (notebook / 'RS002.md.html').read_text(encoding='utf-8')
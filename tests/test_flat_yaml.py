@@ -0,0 +1,114 @@
+"""
+
+Conformance tests for the flat YAML front matter fast path (`md_utils.flat_yaml`): `load_yaml()` must give the
+same values, of the same types, as `yaml.safe_load()`.
+
+"""
+
+import os
+import math
+import datetime
+
+import pytest
+import yaml
+
+from zepto_eln.md_utils.flat_yaml import load_yaml, parse_flat_yaml, NOT_FLAT
+from zepto_eln.md_utils.yfm import read_yfm_header
+from benchmarks.eln_corpus import generate_corpus
+
+# Flat headers, which must be parsed by the fast path (and give the same result as yaml.safe_load):
+FLAT_CASES = [
+    # Dates and timestamps:
+    "startdate: 2019-08-05", "a: 2018-1-5", "a: 2018-01-05 10:20:30", "a: 2018-01-05T10:20:30Z",
+    "a: 2018-01-05 10:20:30.5 +02:00", "a: 20180105", "a: [2018-01-05, 2018-01-06]",
+    # YAML 1.1 booleans:
+    "a: yes", "a: no", "a: Yes", "a: NO", "a: on", "a: off", "a: On", "a: OFF", "a: y", "a: n", "a: true", "a: False",
+    "yes: b", "on: b",
+    # Nulls:
+    "a: ~", "a: null", "a: Null", "a:", "a: ", "a: [~, null]", "null: b",
+    # Numbers:
+    "a: 1", "a: -1", "a: 0x1F", "a: 017", "a: 1_000", "a: 1:30", "a: 1.5", "a: 1e3", "a: .inf", "a: .nan",
+    # Colons that don't start a mapping value:
+    "a: a:b", "a: http://example.com/a#b", "a: 12:30:00", "a: C:\\path\\file",
+    # Duplicate keys (the last value wins):
+    "a: 1\na: 2", "a: 1\nb: 2\na: 3", "a: [x]\na: y",
+    # Other:
+    "title: Some title", "a: value#not a comment", "a: 1\r\nb: 2\r\n", "# comment\na: 1", "a: æøå ☃",
+]
+
+# Headers that must fall back to the full YAML loader (and still give the same result as yaml.safe_load):
+FALLBACK_CASES = [
+    # Quoted scalars:
+    "a: 'quoted'", 'a: "quoted"', "a: 'yes'", 'a: "2019-08-05"', "a: '~'", "a: 'it''s'", "a: ['b', c]", "'a': b",
+    '"yes": b',
+    # ': ' inside values:
+    'a: "b: c"', "a: 'b: c'", "a: [b: c]", "a: [x, 'b: c']",
+    # Comments after values:
+    "a: value # comment", "a: [b, c] # comment", "a: 1 # comment\nb: 2",
+    # Special keys:
+    "~: b", "a b: c", "1.5: b",
+    # Nested and multi-line values:
+    "a:\n  - 1\n  - 2", "a:\n  b: 1", "a: b\n  c", "a: |\n  text\n", "a: {b: c}",
+    # Tags, anchors and aliases:
+    "a: !!str 1", "a: &x b\nc: *x",
+]
+
+
+def _typed(value):
+    """ Return a representation of value that also compares the types (e.g. True != 1, 1.0 != 1). """
+    if isinstance(value, dict):
+        return ('dict', [(_typed(key), _typed(item)) for key, item in value.items()])
+    if isinstance(value, list):
+        return ('list', [_typed(item) for item in value])
+    if isinstance(value, float) and math.isnan(value):
+        return ('float', 'nan')
+    if isinstance(value, datetime.datetime):
+        return ('datetime', value, value.tzinfo)
+    return (type(value).__name__, value)
+
+
+def assert_conforms(text):
+    assert _typed(load_yaml(text)) == _typed(yaml.safe_load(text))
+
+
+@pytest.mark.parametrize('text', FLAT_CASES)
+def test_flat_cases_use_fast_path(text):
+    assert parse_flat_yaml(text) is not NOT_FLAT
+    assert_conforms(text)
+
+
+@pytest.mark.parametrize('text', FALLBACK_CASES)
+def test_fallback_cases(text):
+    assert parse_flat_yaml(text) is NOT_FLAT
+    assert_conforms(text)
+
+
+@pytest.mark.parametrize('text', ["a: b: c", "a: b:", "a: [b #c]", "a: [b", "a: 'b"])
+def test_invalid_yaml_raises(text):
+    with pytest.raises(yaml.YAMLError):
+        yaml.safe_load(text)
+    with pytest.raises(yaml.YAMLError):
+        load_yaml(text)
+
+
+def test_invalid_date_raises_like_safe_load():
+    with pytest.raises(ValueError):
+        yaml.safe_load("a: 2018-13-45")
+    with pytest.raises(ValueError):
+        load_yaml("a: 2018-13-45")
+
+
+@pytest.mark.parametrize('yfm_kind', ['flat', 'nested'])
+def test_corpus_headers(tmp_path, yfm_kind):
+    generate_corpus(str(tmp_path), n_journals=200, yfm=yfm_kind)
+    n_fast = 0
+    for dirpath, _, filenames in os.walk(tmp_path):
+        for filename in filenames:
+            if not filename.endswith('.md'):
+                continue
+            with open(os.path.join(dirpath, filename), 'rb') as fd:
+                text, _ = read_yfm_header(fd)
+            n_fast += parse_flat_yaml(text) is not NOT_FLAT
+            assert_conforms(text)
+    if yfm_kind == 'flat':
+        assert n_fast == 200
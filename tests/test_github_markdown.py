@@ -0,0 +1,134 @@
+"""
+
+Tests for the GitHub Markdown API backend (`md_utils.github_markdown`), using a local stand-in for the API:
+the disk cache, retries of rate-limited requests and server errors, and waiting for the rate limit to reset.
+
+"""
+
+import time
+import threading
+import http.server
+from collections import deque
+
+import pytest
+
+from zepto_eln.md_utils.github_markdown import GithubMarkdownClient
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """ Stand-in for the GitHub `/markdown/raw` endpoint. Returns the queued error responses first, if any. """
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        with server.lock:
+            server.requests.append((self.path, body, self.headers.get('Authorization')))
+            status, headers = server.responses.popleft() if server.responses else (200, {})
+        html = f"<p>{body}</p>".encode('utf-8') if status == 200 else b'{"message": "error"}'
+        self.send_response(status)
+        headers = {'X-RateLimit-Remaining': '59', 'X-RateLimit-Reset': str(int(time.time()) + 3600), **headers}
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(html)))
+        self.end_headers()
+        self.wfile.write(html)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.responses = deque()
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+    thread.start()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server, tmp_path):
+    client = GithubMarkdownClient(base_url=server.url, token='', cache_dir=str(tmp_path / 'cache'), backoff=0.01)
+    yield client
+    client.close()
+
+
+def test_render_and_cache(server, client, tmp_path):
+    assert client.render("# Heading") == "<p># Heading</p>"
+    assert client.render("# Heading") == "<p># Heading</p>"
+    assert client.stats == {'requests': 1, 'cache_hits': 1, 'retries': 0}
+    assert server.requests == [('/markdown/raw', "# Heading", None)]
+    assert client.ratelimit_remaining == 59
+    # The cache is persistent:
+    other = GithubMarkdownClient(base_url=server.url, cache_dir=str(tmp_path / 'cache'))
+    assert other.render("# Heading") == "<p># Heading</p>"
+    assert len(server.requests) == 1
+    # ... and keyed by the API URL:
+    other = GithubMarkdownClient(base_url=server.url + '/', cache_dir=str(tmp_path / 'cache'))
+    assert other.render("# Heading") == "<p># Heading</p>" and len(server.requests) == 1
+    assert GithubMarkdownClient(base_url=f"{server.url}/api", cache_dir=str(tmp_path / 'cache'))._cache_get(
+        "# Heading") is None
+
+
+def test_base_url_and_token_from_environment(server, monkeypatch):
+    monkeypatch.setenv('ZEPTO_ELN_GITHUB_API_URL', server.url)
+    monkeypatch.setenv('GITHUB_TOKEN', 'secret')
+    client = GithubMarkdownClient(cache_dir=None)
+    assert client.render("Text") == "<p>Text</p>"
+    client.render("Text")
+    assert server.requests == [('/markdown/raw', "Text", 'token secret')] * 2  # No cache.
+
+
+@pytest.mark.parametrize('status, headers', [
+    (429, {'Retry-After': '0'}),
+    (403, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '0'}),
+    (502, {}),
+])
+def test_retries(server, client, status, headers):
+    server.responses.extend([(status, headers)] * 2)
+    assert client.render("Text") == "<p>Text</p>"
+    assert client.stats == {'requests': 3, 'cache_hits': 0, 'retries': 2}
+
+
+def test_gives_up_after_max_retries(server, tmp_path):
+    import requests
+    client = GithubMarkdownClient(base_url=server.url, cache_dir=str(tmp_path), max_retries=2, backoff=0.01)
+    server.responses.extend([(503, {})] * 5)
+    with pytest.raises(requests.HTTPError):
+        client.render("Text")
+    assert client.stats['requests'] == 3
+    # Client errors are not retried:
+    server.responses.clear()
+    server.responses.append((422, {}))
+    with pytest.raises(requests.HTTPError):
+        client.render("Text")
+    assert client.stats['requests'] == 4
+
+
+def test_waits_for_ratelimit_reset(server, client, monkeypatch):
+    reset = int(time.time()) + 100
+    server.responses.append((200, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': str(reset)}))
+    client.render("First")
+    sleeps = []
+    monkeypatch.setattr(time, 'sleep', sleeps.append)
+    client.render("Second")
+    assert len(sleeps) == 1 and 90 < sleeps[0] <= 102
+    # Don't wait for longer than max_wait:
+    client.ratelimit_remaining = 0
+    client.max_wait = 10
+    with pytest.raises(RuntimeError):
+        client.render("Third")
+    assert [body for _, body, _ in server.requests] == ["First", "Second"]
+
+
+def test_render_many(server, client):
+    markdowns = [f"Document {i}" for i in range(20)]
+    assert client.render_many(markdowns) == [f"<p>{markdown}</p>" for markdown in markdowns]
+    assert client.render_many(markdowns, max_workers=2) == [f"<p>{markdown}</p>" for markdown in markdowns]
+    assert client.stats == {'requests': 20, 'cache_hits': 20, 'retries': 0}
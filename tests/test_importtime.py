@@ -0,0 +1,35 @@
+"""
+
+Tests that importing the CLI modules doesn't import heavy modules, which are only needed when a command runs
+in-process (see `eln_cli.cli_lazy`). See also `benchmarks/bench_importtime.py`.
+
+"""
+
+import os
+import sys
+import json
+import pkgutil
+import subprocess
+
+import pytest
+
+import zepto_eln.eln_cli
+
+HEAVY_MODULES = ('markdown', 'jinja2', 'yaml', 'requests', 'multiprocessing')
+CLI_MODULES = sorted(
+    f"zepto_eln.eln_cli.{module.name}" for module in pkgutil.iter_modules(zepto_eln.eln_cli.__path__))
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def imported_modules(module):
+    """ Import module in a fresh interpreter, and return the heavy modules it imported. """
+    code = (f"import sys, json, {module}; "
+            f"print(json.dumps([name for name in {HEAVY_MODULES!r} if name in sys.modules]))")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])))
+    proc = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env, check=True)
+    return json.loads(proc.stdout)
+
+
+@pytest.mark.parametrize('module', CLI_MODULES)
+def test_cli_import_is_lazy(module):
+    assert imported_modules(module) == []
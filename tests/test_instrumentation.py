@@ -0,0 +1,111 @@
+"""
+
+Tests for per-stage profiling (`md_utils.instrumentation`): the active profile is a context variable, so threads,
+asyncio tasks, and copied contexts don't record stages into each other's profiles.
+
+"""
+
+import asyncio
+import threading
+import contextvars
+
+from zepto_eln.md_utils.instrumentation import (
+    BuildProfile, stage, get_active_profile, profile_call, NULL_STAGE)
+from zepto_eln.md_utils.parallel import thread_map
+
+
+def run_stages(name, n=3, data=b'1234'):
+    for _ in range(n):
+        with stage(name, data) as st:
+            st.data_out = data * 2
+
+
+def test_disabled_by_default():
+    assert get_active_profile() is None
+    assert stage('markdown') is NULL_STAGE
+    with stage('markdown') as st:
+        st.data_out = 'ignored'
+
+
+def test_activate_and_reset():
+    outer, inner = BuildProfile(), BuildProfile()
+    with outer.activate():
+        run_stages('outer', n=1)
+        with inner.activate():
+            assert get_active_profile() is inner
+            run_stages('inner', n=2)
+        assert get_active_profile() is outer
+        run_stages('outer', n=1)
+    assert get_active_profile() is None
+    assert outer.stages['outer'][0] == 2 and 'inner' not in outer.stages
+    assert (inner.stages['inner'][0], *inner.stages['inner'][3:]) == (2, 8, 16)
+
+
+def test_threads_do_not_inherit_the_active_profile():
+    profile = BuildProfile()
+    seen = []
+    with profile.activate():
+        thread = threading.Thread(target=lambda: (seen.append(get_active_profile()), run_stages('thread')))
+        thread.start()
+        thread.join()
+    assert seen == [None]
+    assert profile.stages == {}
+
+
+def test_concurrent_threads_have_separate_profiles():
+    barrier = threading.Barrier(4)
+
+    def work(i):
+        profile = BuildProfile()
+        with profile.activate():
+            barrier.wait()  # All threads have a profile active at the same time.
+            run_stages(f'stage{i}', n=i + 1)
+            barrier.wait()
+            assert get_active_profile() is profile
+        return profile
+
+    profiles = list(thread_map(work, range(4), workers=4))
+    # (count, bytes in, bytes out) for each profile:
+    assert [{name: (totals[0], *totals[3:]) for name, totals in profile.stages.items()} for profile in profiles] == [
+        {f'stage{i}': (i + 1, 4 * (i + 1), 8 * (i + 1))} for i in range(4)]
+
+
+def test_copied_context():
+    profile = BuildProfile()
+    with profile.activate():
+        context = contextvars.copy_context()
+    assert get_active_profile() is None
+    context.run(run_stages, 'copied', 2)
+    assert profile.stages['copied'][0] == 2
+    run_stages('not copied')
+    assert 'not copied' not in profile.stages
+
+
+def test_asyncio_tasks_have_separate_profiles():
+    async def task(name, n):
+        profile = BuildProfile()
+        with profile.activate():
+            for _ in range(n):
+                with stage(name):
+                    await asyncio.sleep(0)  # Let the other tasks run while the stage is active.
+        return profile
+
+    async def main():
+        return await asyncio.gather(*(task(f'task{i}', i + 1) for i in range(3)))
+
+    profiles = asyncio.run(main())
+    assert [{name: totals[0] for name, totals in profile.stages.items()} for profile in profiles] == [
+        {'task0': 1}, {'task1': 2}, {'task2': 3}]
+
+
+def test_profile_call_and_merge():
+    combined = BuildProfile(cprofile_slowest=1)
+    for filename in ('a.md', 'b.md'):
+        result, state = profile_call(lambda fn: run_stages('markdown') or fn, filename, cprofile_slowest=1)
+        assert result == filename
+        combined.merge(state)
+    assert get_active_profile() is None
+    assert combined.stages['markdown'][0] == 6
+    assert sorted(filename for _, filename, _ in combined.files) == ['a.md', 'b.md']
+    assert len(combined.cprofiles) == 1
+    assert combined.to_dict()['n_files'] == 2
@@ -0,0 +1,80 @@
+"""
+
+Tests for lazily loaded documents (`document_io.Document`, `load_document(lazy=True)`): the same entries as the
+document dicts, content read on first access, and pickling (e.g. for sending documents to worker processes).
+
+"""
+
+import pickle
+
+import pytest
+
+from zepto_eln.md_utils.document_io import Document, load_document, iter_documents
+
+TEXT = "---\ntitle: Blåbær\nexpid: RS001\n---\n# Heading\r\n\r\nSome ✓ content.\n"
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = tmp_path / 'RS001.md'
+    path.write_bytes(TEXT.encode('utf-8'))
+    return str(path)
+
+
+def test_same_entries_as_document_dict(path):
+    expected = load_document(path)
+    document = load_document(path, lazy=True)
+    assert isinstance(document, Document)
+    assert document._content is None and document._raw_content is None  # Only the header has been read.
+    assert document.meta == expected['meta']
+    assert document['fileinfo'] == expected['fileinfo']
+    assert document['content'] == expected['content']
+    assert document['raw_content'] == expected['raw_content']
+    assert document.copy() == expected
+    assert list(document) == ['filename', 'fileinfo', 'raw_content', 'content', 'meta']
+
+
+def test_content_is_loaded_on_first_access(path, tmp_path):
+    document = load_document(path, lazy=True)
+    assert 'content' in document and document._content is None
+    content = document['content']
+    (tmp_path / 'RS001.md').write_text("Changed", encoding='utf-8')
+    assert document['content'] is content  # Cached.
+    document['content'] = 'New content'
+    assert document.content == 'New content'
+
+
+def test_extra_keys(path):
+    document = load_document(path, lazy=True)
+    document['html'] = '<h1>Heading</h1>'
+    assert 'html' in document and len(document) == 6
+    assert document.copy()['html'] == '<h1>Heading</h1>'
+    del document['html']
+    assert 'html' not in document
+    with pytest.raises(KeyError):
+        document['html']
+    with pytest.raises(TypeError):
+        document['fileinfo'] = {}
+    with pytest.raises(TypeError):
+        del document['meta']
+
+
+@pytest.mark.parametrize('access_content', [False, True])
+def test_pickling(path, access_content):
+    document = load_document(path, lazy=True)
+    document['html'] = '<h1>Heading</h1>'
+    if access_content:
+        document['content']
+    restored = pickle.loads(pickle.dumps(document))
+    assert isinstance(restored, Document)
+    assert (restored.filename, restored.meta, restored.content_offset) == (
+        document.filename, document.meta, document.content_offset)
+    assert (restored._content is None) == (not access_content)
+    assert restored.copy() == document.copy()
+
+
+def test_iter_documents_lazy(path, tmp_path):
+    eager = list(iter_documents(str(tmp_path)))
+    lazy = list(iter_documents(str(tmp_path), lazy=True))
+    assert all(isinstance(document, Document) for document in lazy)
+    assert [document.copy() for document in lazy] == eager
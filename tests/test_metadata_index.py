@@ -0,0 +1,129 @@
+"""
+
+Tests for the persistent metadata index (`md_utils.metadata_index`): refresh and invalidation of entries, and the
+tagged-JSON encoding of the stored metadata.
+
+"""
+
+import os
+import datetime
+
+import pytest
+import yaml
+
+from zepto_eln.md_utils.document_io import load_all_documents_metadata
+from zepto_eln.md_utils.metadata_index import (
+    MetadataIndex, encode_meta, decode_meta, get_default_index_path, keep_indexes_open, close_kept_indexes)
+
+
+def write_document(path, yfm, content="Content\n"):
+    with open(path, 'w', encoding='utf-8') as fd:
+        fd.write(f"---\n{yfm}\n---\n{content}")
+
+
+@pytest.fixture
+def basedir(tmp_path):
+    write_document(tmp_path / 'RS001.md', "expid: RS001\nstatus: started\nstartdate: 2019-08-05")
+    write_document(tmp_path / 'RS002.md', "expid: RS002\nstatus: completed")
+    (tmp_path / 'sub').mkdir()
+    write_document(tmp_path / 'sub' / 'RS003.md', "expid: RS003\nauthor: [Jane Doe, Kim Larsen]")
+    return str(tmp_path)
+
+
+def test_refresh_and_invalidation(basedir):
+    with MetadataIndex(basedir) as index:
+        assert index.refresh() == {'cached': 0, 'parsed': 3, 'removed': 0}
+    assert os.path.isfile(get_default_index_path(basedir))
+    with MetadataIndex(basedir) as index:
+        assert index.refresh() == {'cached': 3, 'parsed': 0, 'removed': 0}
+        # Changed size:
+        write_document(os.path.join(basedir, 'RS002.md'), "expid: RS002\nstatus: cancelled")
+        # Same size, changed mtime:
+        path = os.path.join(basedir, 'RS001.md')
+        st = os.stat(path)
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        os.remove(os.path.join(basedir, 'sub', 'RS003.md'))
+        write_document(os.path.join(basedir, 'RS004.md'), "expid: RS004")
+        assert index.refresh() == {'cached': 0, 'parsed': 3, 'removed': 1}
+        metadata = {meta['expid']: meta for meta in index.load_all_metadata()}
+        assert sorted(metadata) == ['RS001', 'RS002', 'RS004']
+        assert metadata['RS002']['status'] == 'cancelled'
+        assert metadata['RS001']['startdate'] == datetime.date(2019, 8, 5)
+        assert metadata['RS001']['filename'] == path
+        assert index.verify()['ok'] == ['RS001.md', 'RS002.md', 'RS004.md']
+
+
+def test_touched_files_are_not_reparsed_with_hash(basedir):
+    path = os.path.join(basedir, 'RS001.md')
+    with MetadataIndex(basedir, use_hash=True) as index:
+        index.refresh()
+        os.utime(path, ns=(0, 10**18))
+        assert index.refresh() == {'cached': 3, 'parsed': 0, 'removed': 0}
+        assert index.verify()['stale'] == []
+
+
+def test_yfm_errors_are_recorded(basedir):
+    with open(os.path.join(basedir, 'broken.md'), 'w', encoding='utf-8') as fd:
+        fd.write("---\nexpid: [unclosed\n---\nContent\n")
+    with MetadataIndex(basedir) as index:
+        entries = {os.path.basename(fn): (yfm, error) for fn, yfm, error in index.update()}
+        assert entries['broken.md'][0] is None and 'Error' in entries['broken.md'][1]
+        index.update()
+        assert index.stats['parsed'] == 0
+
+
+def test_same_metadata_as_scanning(basedir):
+    expected = load_all_documents_metadata(basedir)
+    assert load_all_documents_metadata(basedir, use_index=True) == expected
+    assert load_all_documents_metadata(basedir, use_index=True) == expected  # Now from the index.
+
+
+YFM_VALUES = [
+    "startdate: 2019-08-05\ncreated: 2019-08-05 12:30:00",
+    "tags: !!set {gel: null, pcr: null}",
+    "data: !!binary aGVsbG8=",
+    "numbers: {1: one, 2.5: two and a half, null: none, true: yes}",
+    "nested: {'$date': not a date, list: [1, 2.5, true, null, {'$set': [1]}]}",
+    "unicode: Blåbærgrød ✓",
+]
+
+
+@pytest.mark.parametrize('yfm', YFM_VALUES)
+def test_tagged_json_round_trip(yfm):
+    meta = yaml.safe_load(yfm)
+    encoded = encode_meta(meta)
+    assert isinstance(encoded, str)
+    decoded = decode_meta(encoded)
+    assert decoded == meta
+    assert [type(value) for value in decoded.values()] == [type(value) for value in meta.values()]
+
+
+@pytest.fixture
+def kept_indexes():
+    pool = keep_indexes_open()
+    yield pool
+    close_kept_indexes()
+
+
+def test_kept_index_connections(basedir, kept_indexes):
+    with MetadataIndex(basedir) as index:
+        index.refresh()
+        connection = index.connection
+    assert len(kept_indexes.connections) == 1
+    with MetadataIndex(basedir) as index:
+        assert index.connection is connection
+        assert index.refresh() == {'cached': 3, 'parsed': 0, 'removed': 0}
+        # Opening the same index while it is in use gives a separate connection:
+        with MetadataIndex(basedir) as other:
+            assert other.connection is not connection
+    # The index file is deleted (or replaced), so the kept connection can't be used:
+    os.remove(get_default_index_path(basedir))
+    with MetadataIndex(basedir) as index:
+        assert index.connection is not connection
+        assert index.refresh() == {'cached': 0, 'parsed': 3, 'removed': 0}
+    close_kept_indexes()
+    assert kept_indexes.connections == {}
+    with MetadataIndex(basedir) as index:
+        connection = index.connection
+    with MetadataIndex(basedir) as index:
+        assert index.connection is not connection
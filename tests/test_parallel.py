@@ -0,0 +1,120 @@
+"""
+
+Tests for the parallel map helpers (`md_utils.parallel`) and `iter_documents()`: results are yielded in order,
+items are consumed lazily, and stopping early cancels the remaining work.
+
+"""
+
+import time
+import threading
+
+import pytest
+
+from zepto_eln.md_utils.document_io import iter_documents, load_all_documents, find_md_files
+from zepto_eln.md_utils.parallel import process_map, thread_map, get_worker_count, get_chunksize
+from benchmarks.eln_corpus import generate_corpus
+
+
+@pytest.fixture(scope='module')
+def basedir(tmp_path_factory):
+    basedir = str(tmp_path_factory.mktemp('notebook'))
+    generate_corpus(basedir, n_journals=30)
+    return basedir
+
+
+def square(value):
+    return value * value
+
+
+def fail_on_three(value):
+    if value == 3:
+        raise ValueError(value)
+    return value
+
+
+def sleep_and_return(value):
+    time.sleep(0.001 * (value % 4))  # Later items often finish first.
+    return value
+
+
+class CountingIterable:
+    """ Iterable that keeps track of how many items have been consumed. """
+
+    def __init__(self, n):
+        self.n = n
+        self.consumed = 0
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        for i in range(self.n):
+            with self.lock:
+                self.consumed += 1
+            yield i
+
+
+def test_get_worker_count():
+    assert get_worker_count(None) == 1
+    assert get_worker_count(3) == 3
+    assert get_worker_count(0) >= 1
+    with pytest.raises(ValueError):
+        get_worker_count(-1)
+    assert get_chunksize(10, 4) == 1
+    assert get_chunksize(100000, 4) == 64
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_process_map_order(workers):
+    assert list(process_map(square, range(50), workers=workers, chunksize=3)) == [i * i for i in range(50)]
+    assert list(process_map(square, list(range(50)), workers=workers)) == [i * i for i in range(50)]
+    assert list(process_map(square, [], workers=workers)) == []
+
+
+def test_thread_map_order():
+    assert list(thread_map(sleep_and_return, range(40), workers=4)) == list(range(40))
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_exceptions_are_raised_in_order(workers):
+    results = process_map(fail_on_three, range(10), workers=workers, chunksize=1)
+    assert [next(results) for _ in range(3)] == [0, 1, 2]
+    with pytest.raises(ValueError):
+        next(results)
+
+
+@pytest.mark.parametrize('map_func, kwargs', [
+    (process_map, {'workers': 2, 'chunksize': 2}),
+    (thread_map, {'workers': 2}),
+    (thread_map, {}),
+])
+def test_early_exit(map_func, kwargs):
+    items = CountingIterable(1000)
+    results = map_func(sleep_and_return, items, **kwargs)
+    assert next(results) == 0
+    results.close()
+    # Only the chunks that were in flight (2 per worker) have been consumed:
+    assert items.consumed <= 2 * 2 * kwargs.get('chunksize', 1) + 1
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_iter_documents_order(basedir, workers):
+    paths = find_md_files(basedir)
+    documents = list(iter_documents(basedir, workers=workers, chunksize=3))
+    assert [document['filename'] for document in documents] == paths
+    assert documents == load_all_documents(basedir)
+
+
+def test_iter_documents_early_exit(basedir, monkeypatch):
+    from zepto_eln.md_utils import document_io
+    loaded = []
+    load_document = document_io.load_document
+
+    def load(filepath, **kwargs):
+        loaded.append(filepath)
+        return load_document(filepath, **kwargs)
+
+    monkeypatch.setattr(document_io, 'load_document', load)
+    documents = iter_documents(basedir)
+    first = next(documents)
+    documents.close()
+    assert first['filename'] == find_md_files(basedir)[0]
+    assert loaded == [first['filename']]
@@ -0,0 +1,65 @@
+"""
+
+Tests for Pico %variable% substitution (`md_utils.pico_utils`): placeholders in code blocks and code spans are
+left alone, `%%variable%%` gives a literal `%variable%`, and missing variables are handled per `errors`.
+
+"""
+
+import pytest
+
+from zepto_eln.md_utils.pico_utils import substitute_pico_variables, get_attrs_string_value
+
+TEMPLATE_VARS = {
+    'meta': {'title': 'My experiment', 'expid': 'RS001', 'author': ['Jane Doe', 'Kim Larsen']},
+    'filename': 'RS001.md',
+}
+
+
+@pytest.mark.parametrize('content, expected', [
+    ("# %meta.title% (%meta.expid%)", "# My experiment (RS001)"),
+    ("%meta.expid%%meta.expid%", "RS001RS001"),
+    ("File: %filename%, %meta.nonexistent%", "File: RS001.md, %meta.nonexistent%"),
+    ("Use `%meta.title%` to insert the title.", "Use `%meta.title%` to insert the title."),
+    ("Use ``code with ` and %meta.title%`` here, %meta.expid%.",
+     "Use ``code with ` and %meta.title%`` here, RS001."),
+    ("```\n%meta.title%\n```\n%meta.expid%", "```\n%meta.title%\n```\nRS001"),
+    ("~~~~python\nx = '%meta.title%'\n~~~~\n\n%meta.expid%", "~~~~python\nx = '%meta.title%'\n~~~~\n\nRS001"),
+    ("  ```\n  %meta.title%\n  ```", "  ```\n  %meta.title%\n  ```"),
+    ("```\nUnclosed %meta.title%", "```\nUnclosed %meta.title%"),
+    ("A literal %%meta.title%% placeholder.", "A literal %meta.title% placeholder."),
+    ("Code: `%%meta.title%%`", "Code: `%%meta.title%%`"),
+    ("100% sure, 50 %", "100% sure, 50 %"),
+])
+def test_substitution(content, expected):
+    assert substitute_pico_variables(content, TEMPLATE_VARS) == expected
+
+
+def test_no_code_skip():
+    content = "`%meta.expid%`, %%meta.expid%%\n```\n%meta.expid%\n```"
+    expected = "`RS001`, %meta.expid%\n```\nRS001\n```"
+    assert substitute_pico_variables(content, TEMPLATE_VARS, skip_code=False) == expected
+
+
+def test_varfmt():
+    content = "%meta.author% / %meta.expid%"
+    expected = "<['Jane Doe', 'Kim Larsen']> / <RS001>"
+    assert substitute_pico_variables(content, TEMPLATE_VARS, varfmt="<{sub}>") == expected
+    varfmt = {'meta.author': "{}", 'meta.expid': "[{var}]"}
+    assert substitute_pico_variables(content, TEMPLATE_VARS, varfmt=varfmt) == "['Jane Doe', 'Kim Larsen'] / [RS001]"
+
+
+def test_errors(caplog):
+    with pytest.raises(KeyError):
+        substitute_pico_variables("%meta.nonexistent%", TEMPLATE_VARS, errors='raise')
+    assert substitute_pico_variables("`%meta.nonexistent%`", TEMPLATE_VARS, errors='raise') == "`%meta.nonexistent%`"
+    assert substitute_pico_variables("%meta.nonexistent%", TEMPLATE_VARS, errors='print') == "%meta.nonexistent%"
+    assert "meta.nonexistent" in caplog.text
+    with pytest.raises(ValueError):
+        substitute_pico_variables("", TEMPLATE_VARS, errors='ignore')
+
+
+def test_get_attrs_string_value():
+    assert get_attrs_string_value(TEMPLATE_VARS, 'meta.expid') == 'RS001'
+    assert get_attrs_string_value(TEMPLATE_VARS, 'meta.missing', default=None) is None
+    with pytest.raises(KeyError):
+        get_attrs_string_value(TEMPLATE_VARS, 'meta.missing')
@@ -0,0 +1,56 @@
+"""
+
+Tests for the streaming document pipeline (`md_utils.pipeline`).
+
+"""
+
+import os
+
+import pytest
+
+from zepto_eln.md_utils.document_io import find_md_files
+from zepto_eln.md_utils.markdown_compilation import compile_markdown_document
+from zepto_eln.md_utils.pipeline import markdown_pipeline, rewrite_md_links, Stage
+from benchmarks.eln_corpus import generate_corpus
+
+
+@pytest.fixture(scope='module')
+def corpus(tmp_path_factory):
+    basedir = str(tmp_path_factory.mktemp('notebook'))
+    return basedir, generate_corpus(basedir, n_journals=20)['template_dir']
+
+
+def read_outputs(outdir):
+    outputs = {}
+    for filename in os.listdir(outdir):
+        with open(os.path.join(outdir, filename), encoding='utf-8') as fd:
+            outputs[filename] = fd.read()
+    return outputs
+
+
+@pytest.mark.parametrize('fuse_render', [True, False])
+def test_markdown_pipeline_matches_compile_markdown_document(corpus, tmp_path, fuse_render):
+    basedir, template_dir = corpus
+    pipeline = markdown_pipeline(
+        basedir, outputfn=str(tmp_path / '{filename_noext}.html'), template_dir=template_dir,
+        executor='thread', workers=2, errors='raise', fuse_render=fuse_render)
+    expected_stages = ['load', 'pico', 'render', 'write'] if fuse_render else [
+        'load', 'pico', 'markdown', 'template', 'write']
+    assert pipeline.stage_names() == expected_stages
+    paths = find_md_files(basedir)
+    assert pipeline.run() == len(paths)
+    expected = {
+        os.path.splitext(os.path.basename(path))[0] + '.html':
+            compile_markdown_document(path, outputfn=None, template_dir=template_dir)['html']
+        for path in paths}
+    assert read_outputs(tmp_path) == expected
+
+
+def test_stage_between_markdown_and_template(corpus, tmp_path):
+    basedir, template_dir = corpus
+    pipeline = markdown_pipeline(
+        basedir, outputfn=str(tmp_path / '{filename_noext}.html'), template_dir=template_dir,
+        executor='inline', errors='raise', fuse_render=False)
+    pipeline.insert_stage(Stage(rewrite_md_links, name='links'), before='template')
+    assert pipeline.stage_names() == ['load', 'pico', 'markdown', 'links', 'template', 'write']
+    assert pipeline.run() == len(find_md_files(basedir))
@@ -0,0 +1,94 @@
+"""
+
+Tests for metadata queries (`md_utils.query`): conditions evaluated in SQL must give the same results as when
+evaluated in Python, also for list values, and the returned values must have the same types either way.
+
+"""
+
+import datetime
+
+import pytest
+import yaml
+
+from zepto_eln.md_utils.metadata_index import MetadataIndex
+from zepto_eln.md_utils.query import query_metadata, iter_scan_query, match_condition, parse_condition
+
+DOCUMENTS = {
+    'a.md': "expid: RS001\nauthor: [Jane Doe, Kim Larsen]\nstatus: started\nstartdate: 2019-08-05",
+    'b.md': "expid: RS002\nauthor: Jane Doe\nstatus: completed\nstartdate: 2019-09-01\nenddate: 2019-09-02",
+    'c.md': "expid: RS003\nauthor: Kim Larsen\nstartdate: 2020-01-01",
+    'd.md': "expid: RS004\nauthor: []\nstatus: started",
+}
+
+CONDITIONS = [
+    'author=Jane Doe', 'author!=Kim Larsen', 'author~kim', 'author<K', 'author>=Kim Larsen', 'author=null',
+    'author!=null', 'status=started', 'status!=started', 'startdate<2019-09-01', 'startdate>=2019-09-01',
+    'enddate=null', 'expid~rs00', 'path=a.md', 'path!=a.md',
+]
+
+
+@pytest.fixture
+def basedir(tmp_path):
+    for filename, yfm in DOCUMENTS.items():
+        (tmp_path / filename).write_text(f"---\n{yfm}\n---\nContent\n", encoding='utf-8')
+    return str(tmp_path)
+
+
+@pytest.mark.parametrize('condition', CONDITIONS)
+def test_sql_conditions_match_python(basedir, condition):
+    results = query_metadata(basedir, [condition], fields=['expid'])
+    cond = parse_condition(condition)
+    with MetadataIndex(basedir) as index:
+        expected = [yfm['expid'] for filepath, yfm, _ in index.update()
+                    if match_condition(dict(yfm, path=index._key(filepath)), cond)]
+    assert [result['expid'] for result in results] == sorted(expected)
+
+
+def test_list_values(basedir):
+    assert [m['expid'] for m in query_metadata(basedir, ['author=Jane Doe'])] == ['RS001', 'RS002']
+    assert [m['expid'] for m in query_metadata(basedir, ['author!=Kim Larsen'])] == ['RS002', 'RS004']
+
+
+def test_projected_field_types(basedir):
+    indexed_only = query_metadata(basedir, sort='expid', fields=['expid', 'startdate'])
+    with_other = query_metadata(basedir, sort='expid', fields=['expid', 'startdate', 'title'])
+    assert indexed_only[0]['startdate'] == datetime.date(2019, 8, 5)
+    assert [{k: m[k] for k in ('expid', 'startdate')} for m in with_other] == indexed_only
+
+
+def test_index_is_updated_when_list_changes(basedir, tmp_path):
+    assert len(query_metadata(basedir, ['author=Kim Larsen'])) == 2
+    (tmp_path / 'a.md').write_text("---\nexpid: RS001\nauthor: [Jane Doe]\n---\n", encoding='utf-8')
+    assert [m['expid'] for m in query_metadata(basedir, ['author=Kim Larsen'])] == ['RS003']
+    (tmp_path / 'c.md').unlink()
+    assert query_metadata(basedir, ['author=Kim Larsen']) == []
+
+
+@pytest.mark.parametrize('condition', CONDITIONS)
+def test_scan_query_matches_index_query(basedir, condition):
+    kwargs = dict(conditions=[condition], sort='-startdate', fields=['path', 'expid', 'startdate', 'filename'])
+    assert list(iter_scan_query(basedir, **kwargs)) == query_metadata(basedir, **kwargs)
+
+
+def test_index_unavailable_falls_back_to_scan(basedir, tmp_path, caplog):
+    (tmp_path / '.zepto-eln').write_text('')  # The index directory can't be created.
+    assert query_metadata(basedir, ['status=started'], fields=['expid']) == [{'expid': 'RS001'}, {'expid': 'RS004'}]
+    assert "Unable to use metadata index" in caplog.text
+
+
+NUMERIC_DOCUMENTS = {'a.md': 'expid: 9', 'b.md': 'expid: 10', 'c.md': 'expid: 1e1', 'd.md': 'expid: RS01',
+                     'e.md': 'expid: [2, 30]', 'f.md': 'expid: true', 'g.md': "expid: '100'"}
+
+
+@pytest.mark.parametrize('condition', [
+    'expid<10', 'expid<=10', 'expid>10', 'expid>=9.5', 'expid=10', 'expid=10.0', 'expid!=10', 'expid>2',
+    'expid<RS', 'expid=True', 'expid~1',
+])
+def test_numeric_conditions_match_python(tmp_path, condition):
+    for filename, yfm in NUMERIC_DOCUMENTS.items():
+        (tmp_path / filename).write_text(f"---\n{yfm}\n---\n", encoding='utf-8')
+    cond = parse_condition(condition)
+    expected = [filename for filename, yfm in sorted(NUMERIC_DOCUMENTS.items())
+                if match_condition(yaml.safe_load(yfm), cond)]
+    assert [m['path'] for m in query_metadata(str(tmp_path), [condition], fields=['path'])] == expected
+    assert [m['path'] for m in iter_scan_query(str(tmp_path), [condition], fields=['path'])] == expected
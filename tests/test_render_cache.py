@@ -0,0 +1,153 @@
+"""
+
+Tests for the rendered HTML cache (`md_utils.render_cache`): validation on source and template changes (including
+templates extended by the document's template), LRU eviction with a byte budget, stale-while-revalidate, and the
+counters.
+
+"""
+
+import os
+import threading
+
+import pytest
+
+from zepto_eln.md_utils.render_cache import RenderCache
+
+
+@pytest.fixture
+def notebook(tmp_path):
+    template_dir = tmp_path / 'templates'
+    template_dir.mkdir()
+    (template_dir / 'index.jinja').write_text(
+        '{% extends "base.html" %}{% block body %}{{ content }}{% endblock %}', encoding='utf-8')
+    (template_dir / 'base.html').write_text('<html>BASE v1 {% block body %}{% endblock %}</html>', encoding='utf-8')
+    (tmp_path / 'RS001.md').write_text("---\ntitle: First\n---\n# First\n", encoding='utf-8')
+    return tmp_path
+
+
+def touch(path, delta_ns=10**9):
+    """ Change the file's mtime, but not its size. """
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + delta_ns))
+
+
+def test_hits_and_source_changes(notebook):
+    path = str(notebook / 'RS001.md')
+    cache = RenderCache(template_dir=str(notebook / 'templates'))
+    html = cache.get(path)
+    assert 'BASE v1' in html and '<h1>First</h1>' in html
+    assert cache.get(path) == html
+    assert (cache.stats['misses'], cache.stats['hits']) == (1, 1)
+    # Size change:
+    (notebook / 'RS001.md').write_text("---\ntitle: First\n---\n# First, edited\n", encoding='utf-8')
+    assert 'First, edited' in cache.get(path)
+    # Same size, new mtime:
+    (notebook / 'RS001.md').write_text("---\ntitle: First\n---\n# Fir5t, edited\n", encoding='utf-8')
+    touch(path)
+    assert 'Fir5t, edited' in cache.get(path)
+    assert (cache.stats['misses'], cache.stats['hits']) == (3, 1)
+
+
+def test_extended_template_change(notebook):
+    path = str(notebook / 'RS001.md')
+    cache = RenderCache(template_dir=str(notebook / 'templates'))
+    assert 'BASE v1' in cache.get(path)
+    assert 'BASE v1' in cache.get(path)
+    (notebook / 'templates' / 'base.html').write_text(
+        '<html>BASE v2 {% block body %}{% endblock %}</html>', encoding='utf-8')
+    touch(notebook / 'templates' / 'base.html')
+    assert 'BASE v2' in cache.get(path)
+    assert (cache.stats['misses'], cache.stats['hits']) == (2, 1)
+
+
+def test_template_added(notebook):
+    path = str(notebook / 'RS001.md')
+    cache = RenderCache(template_dir=str(notebook / 'templates'))
+    cache.get(path)
+    cache.get(path)
+    # Adding a template can change which template the document resolves to:
+    (notebook / 'templates' / 'other.jinja').write_text('OTHER {{ content }}', encoding='utf-8')
+    touch(notebook / 'templates')
+    assert 'BASE v1' in cache.get(path)
+    assert (cache.stats['misses'], cache.stats['hits']) == (2, 1)
+
+
+class FakeRenderer:
+    """ Render function returning the file content as HTML, optionally blocking until released. """
+
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+        self.release.set()
+        self.fail = False
+
+    def __call__(self, path, outputfn=None, **options):
+        self.calls += 1
+        self.release.wait(timeout=10)
+        if self.fail:
+            raise ValueError("Render failed.")
+        with open(path, encoding='utf-8') as fd:
+            return {'html': fd.read()}
+
+
+@pytest.fixture
+def pages(tmp_path):
+    paths = {}
+    for name in 'abcd':
+        paths[name] = str(tmp_path / f'{name}.md')
+        with open(paths[name], 'w', encoding='utf-8') as fd:
+            fd.write(name * 100)
+    return paths
+
+
+def test_lru_byte_budget(pages, tmp_path):
+    cache = RenderCache(max_bytes=250, render=FakeRenderer())
+    cache.get(pages['a'])
+    cache.get(pages['b'])
+    cache.get(pages['a'])  # 'a' is now the most recently used page.
+    cache.get(pages['c'])  # Evicts 'b'.
+    assert (len(cache), cache.nbytes, cache.stats['evictions']) == (2, 200, 1)
+    cache.get(pages['a'])
+    cache.get(pages['b'])
+    assert (cache.stats['hits'], cache.stats['misses']) == (2, 4)
+    # Pages larger than the budget are not cached:
+    large = str(tmp_path / 'large.md')
+    with open(large, 'w', encoding='utf-8') as fd:
+        fd.write('x' * 300)
+    cache.get(large)
+    assert cache.nbytes <= 250 and len(cache) == 2
+    assert cache.info()['entries'] == 2
+    cache.invalidate(pages['a'])
+    cache.invalidate(pages['b'])
+    assert (len(cache), cache.nbytes) == (0, 0)
+
+
+def test_stale_while_revalidate(pages):
+    render = FakeRenderer()
+    with RenderCache(stale_while_revalidate=True, render=render) as cache:
+        assert cache.get(pages['a']) == 'a' * 100
+        with open(pages['a'], 'w', encoding='utf-8') as fd:
+            fd.write('A' * 120)
+        render.release.clear()
+        # The outdated page is served while it is re-rendered in the background, which is only started once:
+        assert cache.get(pages['a']) == 'a' * 100
+        assert cache.get(pages['a']) == 'a' * 100
+        render.release.set()
+        cache.close()
+        assert cache.get(pages['a']) == 'A' * 120
+        assert cache.stats == {'hits': 1, 'misses': 1, 'stale': 2, 'evictions': 0, 'revalidations': 1, 'errors': 0}
+        assert render.calls == 2
+
+
+def test_stale_while_revalidate_error(pages):
+    render = FakeRenderer()
+    with RenderCache(stale_while_revalidate=True, render=render) as cache:
+        cache.get(pages['a'])
+        with open(pages['a'], 'w', encoding='utf-8') as fd:
+            fd.write('A' * 120)
+        render.fail = True
+        assert cache.get(pages['a']) == 'a' * 100
+        cache.close()
+        assert cache.stats['errors'] == 1 and len(cache) == 0  # The stale page is dropped.
+        with pytest.raises(ValueError):
+            cache.get(pages['a'])
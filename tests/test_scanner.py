@@ -0,0 +1,90 @@
+"""
+
+Tests for the Markdown file scanner (`md_utils.scanner`): `.elnignore` files, pruned directories, deterministic
+order, and the symlink-loop guard.
+
+"""
+
+import os
+
+import pytest
+
+from zepto_eln.md_utils.scanner import scan_files, scan_md_files, read_ignore_file
+
+
+def make_files(basedir, relpaths):
+    for relpath in relpaths:
+        path = os.path.join(basedir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as fd:
+            fd.write("---\ntitle: x\n---\n")
+
+
+def scanned(basedir, **kwargs):
+    return [os.path.relpath(path, basedir).replace(os.sep, '/') for path, _ in scan_md_files(basedir, **kwargs)]
+
+
+@pytest.fixture
+def basedir(tmp_path):
+    make_files(str(tmp_path), [
+        'b.md', 'a.md', 'notes.txt', 'c.draft.md',
+        '2019/RS001.md', '2019/old/RS000.md', '2019/archive/2015-01.md', '2019/archive/2019-01.md',
+        '2020/RS002.md', '2020/old/RS100.md',
+        '.git/README.md', 'node_modules/pkg/README.md', '.zepto-eln/x.md',
+    ])
+    return str(tmp_path)
+
+
+def test_order_and_pruning(basedir):
+    expected = [
+        'a.md', 'b.md', 'c.draft.md',
+        '2019/RS001.md', '2019/archive/2015-01.md', '2019/archive/2019-01.md', '2019/old/RS000.md',
+        '2020/RS002.md', '2020/old/RS100.md',
+    ]
+    assert scanned(basedir) == expected
+    assert scanned(basedir, concurrent=True) == expected
+    assert 'node_modules/pkg/README.md' in scanned(basedir, prune_dirs=('.git',))
+    assert all(stat.st_size > 0 for _, stat in scan_md_files(basedir))
+
+
+def test_elnignore(basedir):
+    with open(os.path.join(basedir, '.elnignore'), 'w', encoding='utf-8') as fd:
+        fd.write("# Comment\n\n*.draft.md\nold/\n")
+    with open(os.path.join(basedir, '2019', '.elnignore'), 'w', encoding='utf-8') as fd:
+        fd.write("archive/2015*\n")
+    expected = ['a.md', 'b.md', '2019/RS001.md', '2019/archive/2019-01.md', '2020/RS002.md']
+    assert scanned(basedir) == expected
+    assert scanned(basedir, concurrent=True) == expected
+    assert len(scanned(basedir, ignore_filename=None)) == 9
+
+
+def test_elnignore_dir_only_and_path_patterns(basedir):
+    make_files(basedir, ['2020/old.md'])
+    with open(os.path.join(basedir, '.elnignore'), 'w', encoding='utf-8') as fd:
+        fd.write("old/\n/2019/archive/\n")
+    assert read_ignore_file(os.path.join(basedir, '.elnignore')) == [('old', True, False), ('2019/archive', True, True)]
+    # 'old/' only matches directories, and '2019/archive/' only matches relative to the .elnignore file:
+    assert scanned(basedir) == ['a.md', 'b.md', 'c.draft.md', '2019/RS001.md', '2020/RS002.md', '2020/old.md']
+
+
+@pytest.mark.skipif(not hasattr(os, 'symlink'), reason="Symlinks not supported.")
+def test_symlink_loop(basedir):
+    try:
+        os.symlink(basedir, os.path.join(basedir, '2019', 'loop'))
+        os.symlink(os.path.join(basedir, '2019'), os.path.join(basedir, '2020', 'link'))
+    except OSError:
+        pytest.skip("Unable to create symlinks.")
+    paths = scanned(basedir)
+    assert len(paths) == len(set(paths))
+    assert not any(path.startswith('2019/loop') for path in paths)
+    # Symlinks to directories that are not an ancestor are followed:
+    assert '2020/link/RS001.md' in paths
+    assert '2020/link/RS001.md' not in scanned(basedir, follow_symlinks=False)
+    assert scanned(basedir, concurrent=True) == paths
+
+
+def test_multiple_roots_and_patterns(basedir):
+    roots = [os.path.join(basedir, '2020'), os.path.join(basedir, '2019', 'old')]
+    assert [os.path.basename(path) for path, _ in scan_files(roots)] == ['RS002.md', 'RS100.md', 'RS000.md']
+    assert [os.path.basename(path) for path, _ in scan_files(basedir, patterns='*.txt')] == ['notes.txt']
+    assert list(scan_md_files(os.path.join(basedir, 'nonexistent'))) == []
@@ -0,0 +1,45 @@
+"""
+
+Module with helpers for defining CLI commands without importing the modules that implement them.
+
+The CLI commands are invoked by editors on every save, so they should start quickly. The implementation modules
+import e.g. yaml, markdown, and jinja2, which is only needed when the command actually runs in this process
+(not for `--help`, and not when the command is forwarded to the daemon, see `eln_utils.eln_daemon`).
+
+"""
+
+import importlib
+
+import click
+
+
+def import_function(spec):
+    """ Import and return a function given as a 'module:function' string. """
+    module_name, func_name = spec.split(':')
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def lazy_callback(spec):
+    """ Return a CLI callback that imports the function given as a 'module:function' string when called. """
+    def callback(**kwargs):
+        return import_function(spec)(**kwargs)
+    callback.__name__ = callback.__qualname__ = spec.split(':')[1]
+    return callback
+
+
+class LazyHelpCommand(click.Command):
+    """ click.Command that takes its help text from a function's docstring, importing the function's module only
+    when the help text is actually needed (e.g. for `--help`).
+
+    Args:
+        help_from: The function, as a 'module:function' string.
+    """
+
+    def __init__(self, *args, help_from=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.help_from = help_from
+
+    def format_help_text(self, ctx, formatter):
+        if self.help is None and self.help_from:
+            self.help = import_function(self.help_from).__doc__
+        super().format_help_text(ctx, formatter)
@@ -0,0 +1,60 @@
+"""
+
+Module for configuring logging for the command line interfaces, via `--quiet` and `--verbose` options.
+
+Library code logs diagnostics to per-module loggers (`logging.getLogger(__name__)`), never directly to the console.
+The CLIs configure the log level:
+
+* Default: Batch summaries and warnings (INFO level). No per-document output.
+* --verbose: Per-document and per-placeholder diagnostics (DEBUG level).
+* --quiet: Only warnings and errors.
+
+"""
+
+import sys
+import logging
+import functools
+
+import click
+
+
+class CliFormatter(logging.Formatter):
+    """ Log formatter that only prefixes the level name for warnings and errors. """
+
+    def format(self, record):
+        message = super().format(record)
+        if record.levelno >= logging.WARNING:
+            return f"{record.levelname}: {message}"
+        return message
+
+
+def configure_logging(quiet=False, verbose=False):
+    """ Configure the root logger for CLI use, writing to sys.stderr. """
+    level = logging.WARNING if quiet else logging.DEBUG if verbose else logging.INFO
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(CliFormatter("%(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    if not verbose:
+        # Don't flood the output with debug messages from third-party libraries, e.g. markdown or urllib3:
+        for name in ('MARKDOWN', 'urllib3', 'watchdog'):
+            logging.getLogger(name).setLevel(max(level, logging.INFO))
+
+
+def with_logging(callback):
+    """ Wrap a CLI callback, so it accepts (and applies) the `--quiet` and `--verbose` logging options. """
+    @functools.wraps(callback)
+    def wrapper(*args, quiet=False, verbose=False, **kwargs):
+        configure_logging(quiet=quiet, verbose=verbose)
+        return callback(*args, **kwargs)
+    return wrapper
+
+
+def logging_options():
+    """ Return the `--quiet` and `--verbose` click options (new instances for each command). """
+    return [
+        click.Option(['--quiet', '-q'], is_flag=True, default=False, help="Only output warnings and errors."),
+        click.Option(['--verbose', '-v'], is_flag=True, default=False,
+                     help="Output detailed diagnostics, e.g. for each document and placeholder."),
+    ]
@@ -1,46 +1,150 @@
 
 import click
 
-from zepto_eln.eln_utils.eln_config import get_combined_app_config
-from zepto_eln.eln_utils.eln_md_to_html import convert_md_files_to_html, convert_md_file_to_html
+from zepto_eln.md_utils.instrumentation import DEFAULT_CPROFILE_DIR
+from zepto_eln.eln_utils.eln_daemon import forward_to_daemon
+from zepto_eln.eln_cli.cli_logging import with_logging, logging_options
+from zepto_eln.eln_cli.cli_lazy import LazyHelpCommand
+
+
+# Options whose defaults are read from the app config files. The config files are found and parsed when the
+# command is invoked (not when this module is imported), so e.g. `--help` doesn't have to wait for it:
+_CONFIG_DEFAULT_OPTIONS = (
+    'outputfn', 'parser', 'extensions', 'template', 'template_dir', 'template_bytecode_cache',
+    'apply_template', 'open_webbrowser',
+)
+# Options for the conversion context (the other options control the batch, e.g. workers or watch mode):
+_CONTEXT_OPTIONS = _CONFIG_DEFAULT_OPTIONS + ('config',)
+
+
+def _convert_md_files_with_config_defaults(**kwargs):
+    """ Create a conversion context, with options not given on the command line taken from the app config,
+    then convert the files. """
+    # Imported here, so the command starts quickly when the conversion is forwarded to the daemon:
+    from zepto_eln.eln_utils.eln_md_to_html import convert_md_files_to_html, ConversionContext
+    context = ConversionContext.from_app_config(**{key: kwargs.pop(key) for key in _CONTEXT_OPTIONS if key in kwargs})
+    return convert_md_files_to_html(context=context, **kwargs)
 
 
-_SYSCONFIG = get_combined_app_config()
 # click.Command(context_settings={'max_content_width': 400})
 # Using a Context with max_content_width isn't enough to prevent rewrapping,
 # probably have to define a custom click.HelpFormatter.
-convert_md_file_to_html_cli = click.Command(
-    callback=convert_md_files_to_html,
-    name=convert_md_file_to_html.__name__,
-    help=convert_md_file_to_html.__doc__,  # Using inspect.getdoc() will un-indent the docstring.
+convert_md_file_to_html_cli = LazyHelpCommand(
+    callback=with_logging(forward_to_daemon('eln-md-to-html', _convert_md_files_with_config_defaults)),
+    name='convert_md_file_to_html',
+    # Using inspect.getdoc() will un-indent the docstring:
+    help_from='zepto_eln.eln_utils.eln_md_to_html:convert_md_file_to_html',
     # context_settings={'max_content_width': 400},  # Control help text rewrapping
     params=[
         click.Option(
-            ['--outputfn'], default=_SYSCONFIG.get('outputfn'), help="Specify the Markdown parser/generator to use."),
+            ['--outputfn'], default=None, help="Specify the Markdown parser/generator to use."),
         click.Option(
-            ['--parser'], default=_SYSCONFIG.get('parser'), help="Specify the Markdown parser/generator to use."),
+            ['--parser'], default=None, help="Specify the Markdown parser/generator to use."),
         click.Option(
-            ['--extensions'], default=_SYSCONFIG.get('extensions'), multiple=True,
+            ['--extensions'], default=None, multiple=True,
             help="Specify which Markdown extensions to use."),
         click.Option(
-            ['--template'], default=_SYSCONFIG.get('template'),
+            ['--template'], default=None,
             help="Load and apply a specific template (file)."),
         click.Option(
-            ['--template-dir'], default=_SYSCONFIG.get('template_dir'),
+            ['--template-dir'], default=None,
             help="The directory to look for templates. Each markdown file can then choose which template (name) "
                  "to use to render the converted markdown."),
         click.Option(
-            ['--apply-template/--no-apply-template'], default=_SYSCONFIG.get('apply_template'),
+            ['--template-bytecode-cache'], default=None,
+            help="A directory where compiled Jinja templates are cached between runs."),
+        click.Option(
+            ['--apply-template/--no-apply-template'], default=None,
             help="Enable/disable template application."),
         click.Option(
-            ['--open-webbrowser/--no-open-webbrowser'], default=_SYSCONFIG.get('open_webbrowser'),
+            ['--open-webbrowser/--no-open-webbrowser'], default=None,
             help="Open the generated HTML file in the default web browser."),
+        click.Option(
+            ['--workers'], default=None, type=int,
+            help="Convert files using this many worker processes (0 = one per CPU core)."),
+        click.Option(
+            ['--incremental/--no-incremental'], default=False,
+            help="Only convert files whose source, template, or options have changed since the last build."),
+        click.Option(
+            ['--manifest'], default=None,
+            help="The build manifest file used for incremental builds (default: .zepto-eln/build-manifest.json)."),
+        click.Option(
+            ['--watch/--no-watch'], default=False,
+            help="Keep watching the input files, templates, and config files, and re-convert documents when they "
+                 "change (uses file system notifications if the `watchdog` package is installed)."),
+        click.Option(
+            ['--poll-interval'], default=1.0, type=float,
+            help="Polling interval (seconds) for --watch, if file system notifications are not available."),
+        click.Option(
+            ['--profile/--no-profile'], default=False,
+            help="Time each conversion stage (YFM, pico, markdown, templating, writing) and print a summary table."),
+        click.Option(
+            ['--profile-json'], default=None, help="Write the profile summary as JSON to this file."),
+        click.Option(
+            ['--cprofile-slowest'], default=0, type=int,
+            help="Run each file under cProfile and write pstats files for this many of the slowest files."),
+        click.Option(
+            ['--cprofile-dir'], default=DEFAULT_CPROFILE_DIR,
+            help="The directory to write cProfile pstats files to."),
         click.Option(
             ['--config'], default=None, help="Read a specific configuration file."),
+        *logging_options(),
         # click.Option(
-        #     ['--default-config/--no-default-config'], default=_SYSCONFIG.get('outputfn'),
+        #     ['--default-config/--no-default-config'], default=False,
         #              help="Enable/disable loading default configuration file."),
         # click.Argument(['inputfn'])  # cannot add help to click arguments.
         click.Argument(['inputfns'], nargs=-1)  # cannot add help to click arguments.
     ]
 )
+
+
+def _build_site_with_config_defaults(**kwargs):
+    """ Fill in options not given on the command line from the app config, then build the site. """
+    from zepto_eln.eln_utils.eln_config import get_combined_app_config
+    from zepto_eln.eln_utils.eln_build_site import build_site
+    sysconfig = get_combined_app_config()
+    for key in _CONFIG_DEFAULT_OPTIONS:
+        if key in kwargs and (kwargs[key] is None or kwargs[key] == ()):
+            kwargs[key] = sysconfig.get(key)
+    try:
+        summary = build_site(**kwargs)
+    except ValueError as exc:
+        raise click.UsageError(str(exc))
+    if summary['failed']:
+        raise SystemExit(1)
+
+
+build_site_cli = LazyHelpCommand(
+    callback=with_logging(_build_site_with_config_defaults),
+    name='eln-build-site',
+    help_from='zepto_eln.eln_utils.eln_build_site:build_site',
+    params=[
+        click.Option(
+            ['--workers'], default=0, type=int,
+            help="Compile documents using this many worker processes (0 = one per CPU core, 1 = no process pool)."),
+        click.Option(
+            ['--copy-assets/--no-copy-assets'], default=True,
+            help="Copy local files referenced by the journals (e.g. images) to the output directory."),
+        click.Option(
+            ['--parser'], default=None, help="Specify the Markdown parser/generator to use."),
+        click.Option(
+            ['--extensions'], default=None, multiple=True,
+            help="Specify which Markdown extensions to use."),
+        click.Option(
+            ['--template'], default=None,
+            help="Load and apply a specific template (file)."),
+        click.Option(
+            ['--template-dir'], default=None,
+            help="The directory to look for templates. Each markdown file can then choose which template (name) "
+                 "to use to render the converted markdown."),
+        click.Option(
+            ['--template-bytecode-cache'], default=None,
+            help="A directory where compiled Jinja templates are cached between runs."),
+        click.Option(
+            ['--apply-template/--no-apply-template'], default=None,
+            help="Enable/disable template application."),
+        *logging_options(),
+        click.Argument(['source_root']),
+        click.Argument(['output_root']),
+    ]
+)
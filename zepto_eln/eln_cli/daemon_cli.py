@@ -0,0 +1,21 @@
+
+import inspect
+import click
+
+from zepto_eln.eln_utils.eln_daemon import daemon_command, DEFAULT_IDLE_TIMEOUT
+from zepto_eln.eln_cli.cli_logging import with_logging, logging_options
+
+
+daemon_cli = click.Command(
+    callback=with_logging(daemon_command),
+    name='eln-daemon',
+    help=inspect.getdoc(daemon_command),
+    params=[
+        click.Option(['--socket', 'socket_path'], default=None,
+                     help="The daemon's Unix socket (default: $ZEPTO_ELN_DAEMON_SOCKET, or a per-user runtime dir)."),
+        click.Option(['--idle-timeout'], default=DEFAULT_IDLE_TIMEOUT, type=float,
+                     help="Stop the daemon after this many seconds without requests."),
+        *logging_options(),
+        click.Argument(['action'], default='status', type=click.Choice(['start', 'stop', 'status', 'run'])),
+    ]
+)
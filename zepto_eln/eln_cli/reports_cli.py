@@ -1,46 +1,122 @@
 # Copyright 2018 Rasmus Scholer Sorensen, <rasmusscholer@gmail.com>
 
-import inspect
 import click
 
-from zepto_eln.eln_utils.eln_md_pico import print_document_yfm_issues
-from zepto_eln.eln_utils.eln_exp_filters import print_started_exps, print_unfinished_exps
+from zepto_eln.eln_utils.eln_daemon import forward_to_daemon
+from zepto_eln.eln_cli.cli_logging import with_logging, logging_options
+from zepto_eln.eln_cli.cli_lazy import LazyHelpCommand, lazy_callback
 
+# The report functions are only imported when a command is run in-process (or for --help), see `cli_lazy`:
+_PRINT_STARTED_EXPS = 'zepto_eln.eln_utils.eln_exp_filters:print_started_exps'
+_PRINT_UNFINISHED_EXPS = 'zepto_eln.eln_utils.eln_exp_filters:print_unfinished_exps'
+_PRINT_DOCUMENT_YFM_ISSUES = 'zepto_eln.eln_utils.eln_md_pico:print_document_yfm_issues'
+_UPDATE_METADATA_INDEX = 'zepto_eln.md_utils.metadata_index:update_metadata_index'
+_PRINT_QUERY = 'zepto_eln.eln_utils.eln_exp_filters:print_query'
 
-print_started_exps_cli = click.Command(
-    callback=print_started_exps,
-    name=print_started_exps.__name__,
-    help=inspect.getdoc(print_started_exps),
+
+# Reports use the persistent metadata index by default; --no-index forces a full re-parse of all journals.
+_index_option = click.Option(
+    ['--index/--no-index', 'use_index'], default=True,
+    help="Use the persistent metadata index (.zepto-eln/metadata-index.sqlite) to only parse new/changed files.")
+_workers_option = click.Option(
+    ['--workers'], default=None, type=int,
+    help="Parse journals using this many worker processes (0 = one per CPU core). Default: no worker processes.")
+_limit_option = click.Option(
+    ['--limit'], default=None, type=int, help="Stop after printing this many journals.")
+
+
+print_started_exps_cli = LazyHelpCommand(
+    callback=with_logging(forward_to_daemon('eln-print-started-exps', lazy_callback(_PRINT_STARTED_EXPS))),
+    name='print_started_exps',
+    help_from=_PRINT_STARTED_EXPS,
     params=[
         # remember: param_decls is a list, *decls.
         click.Option(['--rowfmt'], default='{status:^10}: {expid:<10} {titledesc}'),
+        _index_option,
+        _workers_option,
+        _limit_option,
+        *logging_options(),
         click.Argument(
             ['basedir'], default='.', nargs=1, type=click.Path(dir_okay=True, file_okay=False, exists=True))
 ])
 
 
-print_unfinished_exps_cli = click.Command(
-    callback=print_unfinished_exps,
-    name=print_unfinished_exps.__name__,
-    help=inspect.getdoc(print_unfinished_exps),
+print_unfinished_exps_cli = LazyHelpCommand(
+    callback=with_logging(forward_to_daemon('eln-print-unfinished-exps', lazy_callback(_PRINT_UNFINISHED_EXPS))),
+    name='print_unfinished_exps',
+    help_from=_PRINT_UNFINISHED_EXPS,
     params=[
         click.Option(['--rowfmt'], default='{status:^10}: {expid:<10} {titledesc:<40}  [enddate: {enddate}]'),
+        _index_option,
+        _workers_option,
+        _limit_option,
+        *logging_options(),
         click.Argument(
             ['basedir'], default='.', nargs=1, type=click.Path(dir_okay=True, file_okay=False, exists=True))
 ])
 
 
-print_journal_yfm_issues_cli = click.Command(
-    callback=print_document_yfm_issues,
-    name=print_document_yfm_issues.__name__,
-    help=inspect.getdoc(print_document_yfm_issues),
+print_journal_yfm_issues_cli = LazyHelpCommand(
+    callback=with_logging(forward_to_daemon(
+        'eln-print-journal-yfm-issues', lazy_callback(_PRINT_DOCUMENT_YFM_ISSUES))),
+    name='print_document_yfm_issues',
+    help_from=_PRINT_DOCUMENT_YFM_ISSUES,
     params=[
         # click.Option(['--rowfmt'], default='{status:^10}: {expid:<10} {titledesc} (enddate={enddate})'),
+        _index_option,
+        _workers_option,
+        *logging_options(),
+        click.Argument(
+            ['basedir'], default='.', nargs=1, type=click.Path(dir_okay=True, file_okay=False, exists=True))
+])
+
+
+metadata_index_cli = LazyHelpCommand(
+    callback=with_logging(forward_to_daemon('eln-metadata-index', lazy_callback(_UPDATE_METADATA_INDEX))),
+    name='update_metadata_index',
+    help_from=_UPDATE_METADATA_INDEX,
+    params=[
+        click.Option(['--rebuild/--no-rebuild'], default=False, help="Discard the existing index and re-parse all files."),
+        click.Option(['--verify/--no-verify'], default=False,
+                     help="Check the index against the files on disk, without updating it."),
+        click.Option(['--hash/--no-hash', 'use_hash'], default=False,
+                     help="Also store a content hash, so touched-but-unchanged files are not re-parsed."),
+        _workers_option,
+        *logging_options(),
         click.Argument(
             ['basedir'], default='.', nargs=1, type=click.Path(dir_okay=True, file_okay=False, exists=True))
 ])
 
 
+def _parse_expressions(ctx, param, value):
+    """ Validate query expressions, see `query.parse_condition()`. """
+    from zepto_eln.md_utils.query import parse_condition
+    try:
+        return [parse_condition(expr) for expr in value]
+    except ValueError as exc:
+        raise click.BadParameter(str(exc), ctx=ctx, param=param)
+
+
+query_cli = LazyHelpCommand(
+    callback=with_logging(forward_to_daemon('eln-query', lazy_callback(_PRINT_QUERY))),
+    name='eln-query',
+    help_from=_PRINT_QUERY,
+    params=[
+        click.Option(['--sort'], default=None,
+                     help="Comma-separated sort fields; prefix with '-' for descending, e.g. '-startdate,expid'."),
+        click.Option(['--fields'], default=None,
+                     help="Comma-separated fields to print. Default: expid,status,startdate,enddate,titledesc."),
+        click.Option(['--format', 'output_format'], type=click.Choice(['table', 'tsv', 'json']), default='table'),
+        click.Option(['--basedir'], default='.', type=click.Path(dir_okay=True, file_okay=False, exists=True)),
+        click.Option(['--refresh/--no-refresh'], default=True,
+                     help="Update the metadata index before querying (default). "
+                          "--no-refresh queries the index as-is, which is faster but may be stale."),
+        _workers_option,
+        click.Option(['--limit'], default=None, type=int, help="Print at most this many journals."),
+        *logging_options(),
+        click.Argument(['expressions'], nargs=-1, callback=_parse_expressions),
+])
+
 
 if __name__ == '__main__':
     # For testing only...
@@ -0,0 +1,286 @@
+"""
+
+Module for building a static HTML site from a whole notebook.
+
+`build_site(source_root, output_root)` compiles every journal (*.md) below source_root with
+`compile_markdown_document()`, using a pool of worker processes, and writes the HTML files to output_root,
+mirroring the directory layout of source_root (`dir/RS123.md` -> `<output_root>/dir/RS123.html`).
+
+* Assets referenced by the documents (images, PDFs, etc, i.e. local `src` and `href` links in the compiled HTML)
+    are copied to the same relative location below output_root. Only files within source_root are copied.
+    Assets that are already up-to-date in output_root (same size and modification time) are not copied again.
+* HTML files and assets are written atomically (written to a temporary file, then renamed), so a partially written
+    file is never left in output_root, e.g. if the build is interrupted or a web server is serving the site.
+* Documents that fail to compile are reported and skipped, rather than aborting the whole build.
+    Markdown files without a YFM header (e.g. README.md) are compiled as plain documents, with no metadata.
+* When done, a summary with the throughput (documents/s and MB/s of markdown input) and any failures is printed.
+
+Each worker process caches its Markdown converters and compiled Jinja templates, and documents are submitted in
+chunks, so the build scales with the number of CPU cores for large notebooks.
+
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import logging
+import functools
+from urllib.parse import unquote
+
+from zepto_eln.md_utils.scanner import scan_md_files, DEFAULT_PRUNE_DIRS
+from zepto_eln.md_utils.yfm import YFM_boundary_regex
+from zepto_eln.md_utils.markdown_compilation import compile_markdown_document
+from zepto_eln.md_utils.parallel import process_map, thread_map, get_worker_count
+from zepto_eln.md_utils.instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+# Local references in the compiled HTML, e.g. <img src="images/gel.png"> or <a href="data/plate.xlsx">:
+_REFERENCE_REGEX = re.compile(r"""\b(?:src|href)\s*=\s*(?:"([^"]*)"|'([^']*)')""", re.IGNORECASE)
+_URL_SCHEME_REGEX = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.-]*:')
+# Referenced files that are built rather than copied:
+_DOCUMENT_EXTENSIONS = ('.md', '.html', '.htm')
+# Number of failures listed in the summary (all failures are logged as they happen):
+_MAX_FAILURES_LISTED = 20
+
+
+def find_referenced_assets(html, document_path, source_root):
+    """ Find the local files referenced by a compiled document, e.g. images.
+
+    Args:
+        html: The compiled HTML.
+        document_path: The markdown document's file path (relative links are resolved relative to its directory).
+        source_root: Only files within this directory are returned.
+
+    Returns:
+        Set of asset paths, relative to source_root.
+    """
+    assets = set()
+    dirname = os.path.dirname(os.path.abspath(document_path))
+    source_root = os.path.abspath(source_root)
+    for match in _REFERENCE_REGEX.finditer(html):
+        ref = match.group(1) if match.group(1) is not None else match.group(2)
+        ref = unquote(ref.split('#', 1)[0].split('?', 1)[0]).strip()
+        if not ref or ref.startswith(('/', '\\')) or _URL_SCHEME_REGEX.match(ref):
+            continue  # Page anchors, absolute paths, and URLs (http:, mailto:, data:, etc).
+        if os.path.splitext(ref)[1].lower() in _DOCUMENT_EXTENSIONS:
+            continue
+        path = os.path.normpath(os.path.join(dirname, ref))
+        relpath = os.path.relpath(path, source_root)
+        if relpath.startswith(os.pardir) or not os.path.isfile(path):
+            continue
+        assets.add(relpath)
+    return assets
+
+
+def _write_atomic(path, text):
+    """ Write text to path atomically (each process writes to its own temporary file, then replaces). """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as fd:
+            fd.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _copy_atomic(src, dst):
+    """ Copy file src to dst (with modification time), unless dst is already up-to-date.
+
+    Returns:
+        True if the file was copied, False if dst was already up-to-date.
+    """
+    src_stat = os.stat(src)
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        pass
+    else:
+        if dst_stat.st_size == src_stat.st_size and dst_stat.st_mtime_ns == src_stat.st_mtime_ns:
+            return False
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp_path = f"{dst}.{os.getpid()}.tmp"
+    try:
+        shutil.copy2(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+
+def get_site_output_path(relpath, output_root):
+    """ Return the HTML output path for a document, given its path relative to the source root. """
+    return os.path.join(output_root, os.path.splitext(relpath)[0] + '.html')
+
+
+def has_yfm_header(path):
+    """ Return True if the file at path starts with a YFM boundary marker ('---'), i.e. is a journal with metadata. """
+    with open(path, 'r', encoding='utf-8') as fd:
+        return YFM_boundary_regex.match(fd.readline().rstrip('\r\n')) is not None
+
+
+def _build_site_document(relpath, source_root, output_root, copy_assets=True, **kwargs):
+    """ Compile a single document for `build_site()`.
+
+    This is a module-level function, so it can be sent to worker processes.
+
+    Returns:
+        Dict with 'path' (relative to source_root), 'bytes_in', 'bytes_out', 'assets' (a list of asset paths,
+        relative to source_root), and 'error' (None if the document was built successfully).
+    """
+    path = os.path.join(source_root, relpath)
+    result = {'path': relpath, 'bytes_in': 0, 'bytes_out': 0, 'assets': [], 'error': None}
+    try:
+        result['bytes_in'] = os.path.getsize(path)
+        if not has_yfm_header(path):
+            # Plain markdown file, e.g. README.md; only errors in an actual YFM header fail the document:
+            kwargs = dict(kwargs, yfm_errors='ignore')
+        document = compile_markdown_document(path, outputfn=None, **kwargs)
+        html = document['html']
+        outputfn = get_site_output_path(relpath, output_root)
+        os.makedirs(os.path.dirname(outputfn), exist_ok=True)
+        with stage('write', html):
+            _write_atomic(outputfn, html)
+        result['bytes_out'] = len(html.encode('utf-8'))
+        if copy_assets:
+            result['assets'] = sorted(find_referenced_assets(document['html_content_raw'], path, source_root))
+    except Exception as exc:
+        logger.error("%s: %s while building %r.", exc.__class__.__name__, exc, path)
+        result['error'] = f"{exc.__class__.__name__}: {exc}"
+    return result
+
+
+def _copy_site_asset(relpath, source_root, output_root):
+    """ Copy a single asset for `build_site()`, returning (copied, error) 2-tuple. """
+    try:
+        return _copy_atomic(os.path.join(source_root, relpath), os.path.join(output_root, relpath)), None
+    except OSError as exc:
+        logger.error("%s: %s while copying asset %r.", exc.__class__.__name__, exc, relpath)
+        return False, f"{exc.__class__.__name__}: {exc}"
+
+
+def iter_site_documents(source_root, output_root=None, prune_dirs=DEFAULT_PRUNE_DIRS):
+    """ Yield the markdown documents below source_root (as paths relative to source_root).
+
+    Documents inside output_root are skipped, in case the output root is a subdirectory of the source root.
+    """
+    source_root = os.path.abspath(source_root)
+    skip_prefix = os.path.join(os.path.abspath(output_root), '') if output_root else None
+    if skip_prefix and not skip_prefix.startswith(os.path.join(source_root, '')):
+        skip_prefix = None  # The output root is not a subdirectory of the source root.
+    for path, _ in scan_md_files(source_root, prune_dirs=prune_dirs):
+        if skip_prefix and path.startswith(skip_prefix):
+            continue
+        yield os.path.relpath(path, source_root)
+
+
+def build_site(
+        source_root, output_root, workers=0, copy_assets=True,
+        parser='python-markdown', extensions=None,
+        template=None, template_type='jinja2', template_dir=None, apply_template=None,
+        default_template_name='index', template_bytecode_cache=None,
+):
+    """ ELN: Build a static HTML site from all journals (.md) in a notebook directory.
+
+    The directory layout of the source root is mirrored in the output root, e.g. `<source_root>/2019/RS123.md`
+    is compiled to `<output_root>/2019/RS123.html`, and local assets referenced by the journals (e.g. images)
+    are copied to the output root. Outputs are written atomically.
+    A summary with the throughput and any failures is printed when the build is done.
+
+    \b
+    Args:
+        source_root: The notebook directory with the markdown journals.
+        output_root: The directory to write the HTML site to.
+        workers: Compile documents using a pool of this many worker processes (0 = one per CPU core).
+        copy_assets: Copy local files referenced by the journals to the output root.
+        parser: The Markdown parser to use, e.g. 'python-markdown' or 'github'.
+        extensions: The Markdown extensions to use (None = the default extensions).
+        template: The template (file or name) to apply (default: each journal's YFM 'template', or 'index').
+        template_type: The templating system to use.
+        template_dir: The directory with the templates.
+        apply_template: Apply a template to the compiled HTML. The default (None) is to apply a template if a
+            template or template_dir is given.
+        default_template_name: The template name to use for journals that don't specify a template.
+        template_bytecode_cache: A directory where compiled Jinja templates are cached between runs.
+
+    \b
+    Returns:
+        Dict with the build summary: 'built' and 'failed' (documents), 'assets_copied', 'assets_up_to_date',
+        'bytes_in', 'bytes_out', 'elapsed_s', 'docs_per_s', 'mb_per_s', and 'failures' (a list of (path, error)
+        2-tuples, for both documents and assets).
+
+    \b
+    Raises:
+        ValueError, if output_root is the same directory as source_root.
+    """
+    if os.path.abspath(output_root) == os.path.abspath(source_root):
+        raise ValueError(f"The output root must be different from the source root ({source_root!r}); "
+                         f"otherwise the HTML files would be written next to the journals.")
+    if apply_template is None:
+        apply_template = bool(template or template_dir)
+    if extensions is not None and not extensions:
+        extensions = None  # E.g. an empty tuple from the command line.
+    start = time.perf_counter()
+    relpaths = list(iter_site_documents(source_root, output_root))
+    workers = get_worker_count(workers)
+    logger.info("Building %s documents from %r to %r using %s worker(s)...",
+                len(relpaths), source_root, output_root, workers)
+    build = functools.partial(
+        _build_site_document, source_root=source_root, output_root=output_root, copy_assets=copy_assets,
+        parser=parser, extensions=extensions, yfm_errors='raise', do_apply_template=apply_template,
+        template_type=template_type, template=template, template_dir=template_dir,
+        default_template_name=default_template_name, template_bytecode_cache=template_bytecode_cache)
+    summary = {
+        'built': 0, 'failed': 0, 'assets_copied': 0, 'assets_up_to_date': 0, 'bytes_in': 0, 'bytes_out': 0,
+        'failures': [],
+    }
+    assets = set()
+    for result in process_map(build, relpaths, workers=workers):
+        summary['bytes_in'] += result['bytes_in']
+        if result['error'] is None:
+            summary['built'] += 1
+            summary['bytes_out'] += result['bytes_out']
+            assets.update(result['assets'])
+        else:
+            summary['failed'] += 1
+            summary['failures'].append((result['path'], result['error']))
+
+    # Copying is I/O-bound, so a thread pool is fine:
+    copy = functools.partial(_copy_site_asset, source_root=source_root, output_root=output_root)
+    for relpath, (copied, error) in zip(sorted(assets), thread_map(copy, sorted(assets), workers=workers)):
+        if error is None:
+            summary['assets_copied' if copied else 'assets_up_to_date'] += 1
+        else:
+            summary['failures'].append((relpath, error))
+
+    elapsed = time.perf_counter() - start
+    summary['elapsed_s'] = elapsed
+    summary['docs_per_s'] = summary['built'] / elapsed if elapsed else 0.0
+    summary['mb_per_s'] = summary['bytes_in'] / 1e6 / elapsed if elapsed else 0.0
+    # The summary is the requested output, so it is printed regardless of the log level:
+    print(format_build_summary(summary), file=sys.stderr)
+    return summary
+
+
+def format_build_summary(summary):
+    """ Format the build summary returned by `build_site()` as a human-readable string. """
+    lines = [
+        f"Built {summary['built']} documents in {summary['elapsed_s']:.2f} s "
+        f"({summary['docs_per_s']:.1f} docs/s, {summary['mb_per_s']:.2f} MB/s markdown in, "
+        f"{summary['bytes_out'] / 1e6:.1f} MB HTML out).",
+        f"Assets: {summary['assets_copied']} copied, {summary['assets_up_to_date']} up-to-date.",
+    ]
+    if summary['failures']:
+        lines.append(f"{len(summary['failures'])} failures:")
+        lines.extend(f"  {path}: {error}" for path, error in summary['failures'][:_MAX_FAILURES_LISTED])
+        if len(summary['failures']) > _MAX_FAILURES_LISTED:
+            lines.append(f"  ... and {len(summary['failures']) - _MAX_FAILURES_LISTED} more (see the log).")
+    else:
+        lines.append("No failures.")
+    return "\n".join(lines)
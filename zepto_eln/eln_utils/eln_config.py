@@ -2,12 +2,14 @@
 
 
 import os
+import logging
 import yaml
 from collections import OrderedDict
-from pprint import pprint
 
+logger = logging.getLogger(__name__)
 
-DEFAULT_CONFIG = yaml.load(r"""
+
+DEFAULT_CONFIG = yaml.safe_load(r"""
 outputfn: '{inputfn}.html'
 overwrite: null
 open_webbrowser: null
@@ -25,6 +27,8 @@ template_type: jinja2
 # template_dir: A directory with templates; each markdown file can specify its own template.
 template_dir: D:/Dropbox/_experiment_data/templates/
 apply_template: True
+# template_bytecode_cache: A directory where compiled Jinja templates are cached between runs (optional).
+template_bytecode_cache: null
 # A config (dict or file) containing options for each run, takes precedence over any given arguments!
 config: null
 default_config: null
@@ -83,15 +87,15 @@ def get_app_config_filepaths():
 
 def get_app_configs():
     config_paths = get_app_config_filepaths()
-    print("Using config files:")
-    pprint(config_paths)
+    logger.debug("Using config files: %s", dict(config_paths))
     configs = {}
     for k, path in config_paths.items():
         if path is None:
             configs[k] = None
         else:
             try:
-                configs[k] = yaml.load(open(path, 'r'))
+                with open(path, encoding="utf-8") as fd:
+                    configs[k] = yaml.safe_load(fd)
             except yaml.YAMLError as exc:
                 raise exc
     return configs
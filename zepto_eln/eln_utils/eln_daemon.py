@@ -0,0 +1,416 @@
+"""
+
+Module for an optional, long-running "warm" daemon that runs ELN commands on behalf of the CLIs.
+
+Each CLI invocation pays for Python startup, imports, and warm-up (creating Markdown instances with all extensions,
+Jinja environments, compiling templates, etc.), which for a single document is most of the total time.
+The daemon is a local process that keeps all of this warm, listening on a Unix socket:
+
+    $ eln-daemon start      # Start the daemon in the background.
+    $ eln-daemon status
+    $ eln-daemon stop
+
+When the daemon is running, the CLI commands (e.g. `eln-md-to-html`, `eln-query`) forward their (parsed) arguments
+to it, along with the current working directory and log level, and print the output and log messages it sends back.
+When it isn't running (or on platforms without Unix sockets), the commands just run in-process, as usual.
+
+Notes:
+    * Requests are handled one at a time, in the client's working directory.
+    * The socket is only accessible by the current user. It is placed in $XDG_RUNTIME_DIR if set, otherwise in a
+        per-user directory in the temp dir; set ZEPTO_ELN_DAEMON_SOCKET to use a different path.
+        The per-user directory must be owned by the current user and not accessible by anyone else (mode 0700);
+        otherwise the daemon refuses to start, and the CLIs don't forward commands to it.
+    * Set ZEPTO_ELN_DAEMON=0 to disable forwarding (always run commands in-process).
+    * Template files are still checked for changes on each request (Jinja's auto_reload), but changes to the
+        zepto_eln code itself require restarting the daemon.
+    * The metadata index of each notebook is kept open between requests, see `metadata_index.keep_indexes_open()`.
+        The index is still brought up-to-date with the files on each request.
+    * The daemon exits after being idle for `idle_timeout` seconds (default: 1 hour).
+
+Protocol: The client sends one JSON request line, `{"command": ..., "kwargs": ..., "cwd": ..., "log_level": ...}`,
+and the daemon responds with one JSON line, `{"ok": ..., "result": ..., "stdout": ..., "logs": [...]}`.
+
+"""
+
+import io
+import os
+import sys
+import json
+import stat
+import time
+import socket
+import logging
+import tempfile
+import functools
+import importlib
+import traceback
+import contextlib
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+SOCKET_ENV_VAR = 'ZEPTO_ELN_DAEMON_SOCKET'
+ENABLE_ENV_VAR = 'ZEPTO_ELN_DAEMON'
+DEFAULT_IDLE_TIMEOUT = 3600
+CONNECT_TIMEOUT = 0.5
+# Commands the daemon can run, {name: 'module:function'}:
+DAEMON_COMMANDS = {
+    'eln-md-to-html': 'zepto_eln.eln_cli.converter_cli:_convert_md_files_with_config_defaults',
+    'eln-print-started-exps': 'zepto_eln.eln_utils.eln_exp_filters:print_started_exps',
+    'eln-print-unfinished-exps': 'zepto_eln.eln_utils.eln_exp_filters:print_unfinished_exps',
+    'eln-print-journal-yfm-issues': 'zepto_eln.eln_utils.eln_md_pico:print_document_yfm_issues',
+    'eln-metadata-index': 'zepto_eln.md_utils.metadata_index:update_metadata_index',
+    'eln-query': 'zepto_eln.eln_utils.eln_exp_filters:print_query',
+}
+_PING, _SHUTDOWN = '__ping__', '__shutdown__'
+
+
+class DaemonCommandError(RuntimeError):
+    """ Raised by the client when a command forwarded to the daemon fails. """
+
+
+def get_socket_path():
+    """ Return the daemon's Unix socket path (see module docstring). """
+    path = os.environ.get(SOCKET_ENV_VAR)
+    if path:
+        return path
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtime_dir:
+        runtime_dir = os.path.join(tempfile.gettempdir(), f"zepto-eln-{os.getuid()}")
+    return os.path.join(runtime_dir, 'zepto-eln-daemon.sock')
+
+
+def ensure_socket_dir(socket_path):
+    """ Create the directory for the daemon socket (mode 0700), if it doesn't exist.
+
+    If it is the default per-user directory in the temp dir, an existing directory is only used if it is private
+    (see `check_socket_dir()`).
+
+    Raises:
+        PermissionError, if the directory is not owned by the current user, or is accessible by other users.
+    """
+    socket_dir = os.path.dirname(socket_path) or '.'
+    os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+    if _is_private_dir_required(socket_path):
+        check_socket_dir(socket_dir)
+    return socket_dir
+
+
+def check_socket_dir(socket_dir):
+    """ Raise PermissionError unless socket_dir is owned by the current user, and only accessible by them.
+
+    The default socket directory has a predictable name in the (shared) temp dir, so another user could create
+    it first, and e.g. replace the socket with one of their own.
+    """
+    st = os.lstat(socket_dir)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or stat.S_IMODE(st.st_mode) != 0o700:
+        raise PermissionError(
+            f"The daemon socket directory {socket_dir!r} must be a directory owned by the current user, "
+            f"with mode 0700 (found uid {st.st_uid}, mode {stat.S_IMODE(st.st_mode):o}).")
+
+
+def _is_private_dir_required(socket_path):
+    """ Return True if the socket's directory is the default per-user dir in the temp dir (see `get_socket_path()`).
+    A custom socket path (ZEPTO_ELN_DAEMON_SOCKET) or $XDG_RUNTIME_DIR is the user's responsibility. """
+    return os.path.dirname(socket_path) == os.path.join(tempfile.gettempdir(), f"zepto-eln-{os.getuid()}")
+
+
+def is_supported():
+    return hasattr(socket, 'AF_UNIX')
+
+
+def forwarding_enabled():
+    return is_supported() and os.environ.get(ENABLE_ENV_VAR, '1').lower() not in ('0', 'false', 'no', 'off')
+
+
+# Client:
+
+def send_request(request, socket_path=None, connect_timeout=CONNECT_TIMEOUT):
+    """ Send a request to the daemon and return the response.
+
+    Raises:
+        OSError (e.g. FileNotFoundError or ConnectionRefusedError) if the daemon is not running,
+        PermissionError if the socket directory is not private (see `check_socket_dir()`),
+        ConnectionError if the daemon closed the connection without responding (e.g. if it died).
+    """
+    socket_path = socket_path or get_socket_path()
+    if _is_private_dir_required(socket_path):
+        check_socket_dir(os.path.dirname(socket_path))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(connect_timeout)
+        sock.connect(socket_path)
+        sock.settimeout(None)  # Commands can take a while, e.g. converting a whole notebook.
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile('rb') as fd:
+            line = fd.readline()
+    finally:
+        sock.close()
+    if not line:
+        raise ConnectionError("The daemon closed the connection without responding.")
+    return json.loads(line)
+
+
+def ping(socket_path=None):
+    """ Return the daemon's status dict, or None if the daemon is not running. """
+    try:
+        return send_request({'command': _PING}, socket_path=socket_path)['result']
+    except (OSError, ValueError):
+        return None
+
+
+def try_forward(command, kwargs, socket_path=None):
+    """ Run a command in the daemon, if it is running.
+
+    The daemon's stdout output is written to sys.stdout, and its log records are re-emitted to the local loggers.
+
+    Args:
+        command: The command name, see DAEMON_COMMANDS.
+        kwargs: The command's keyword arguments (must be JSON-serializable).
+
+    Returns:
+        (forwarded, result) 2-tuple. forwarded is False if the daemon is not running, can't be reached
+        (or trusted, see `check_socket_dir()`), or closed the connection without responding.
+
+    Raises:
+        DaemonCommandError if the command failed in the daemon.
+    """
+    request = {
+        'command': command, 'kwargs': kwargs, 'cwd': os.getcwd(),
+        'log_level': logging.getLogger().getEffectiveLevel(),
+    }
+    try:
+        response = send_request(request, socket_path=socket_path)
+    except OSError as exc:
+        # Not running (or a stale socket file), not accessible, or the daemon died while handling the request:
+        logger.debug("Not forwarding %r to the daemon (%r); running it in-process.", command, exc)
+        return False, None
+    sys.stdout.write(response.get('stdout', ''))
+    sys.stdout.flush()
+    for name, levelno, message in response.get('logs', ()):
+        logging.getLogger(name).log(levelno, "%s", message)
+    if not response['ok']:
+        raise DaemonCommandError(f"{command} failed in the daemon:\n{response['error']}")
+    return True, response.get('result')
+
+
+def forward_to_daemon(command, callback):
+    """ Wrap a CLI callback, so it is run by the daemon when it is running, see `try_forward()`. """
+    @functools.wraps(callback)
+    def wrapper(**kwargs):
+        # Long-running watch mode is always run in-process:
+        if forwarding_enabled() and not kwargs.get('watch'):
+            forwarded, result = try_forward(command, kwargs)
+            if forwarded:
+                return result
+        return callback(**kwargs)
+    return wrapper
+
+
+# Server:
+
+class _CaptureLogs(logging.Handler):
+    """ Collect formatted log records as (logger name, levelno, message) tuples, to send back to the client. """
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        try:
+            self.records.append((record.name, record.levelno, record.getMessage()))
+        except Exception:  # Don't let a bad log call fail the command.
+            self.handleError(record)
+
+
+class ElnDaemon:
+    """ The daemon server. See module docstring.
+
+    Args:
+        socket_path: The Unix socket to listen on (default: `get_socket_path()`).
+        idle_timeout: Exit after this many seconds without requests (None to never exit).
+    """
+
+    def __init__(self, socket_path=None, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.socket_path = socket_path or get_socket_path()
+        self.idle_timeout = idle_timeout
+        self.started = time.time()
+        self.stats = {'requests': 0, 'errors': 0}
+        self._functions = {}
+        self._index_pool = None
+        self._stop = False
+
+    def get_function(self, command):
+        func = self._functions.get(command)
+        if func is None:
+            module_name, func_name = DAEMON_COMMANDS[command].split(':')
+            func = self._functions[command] = getattr(importlib.import_module(module_name), func_name)
+        return func
+
+    def warm_up(self):
+        """ Import all command modules, create the (cached) Markdown instance for the default extensions, and keep
+        metadata index connections open between requests. """
+        for command in DAEMON_COMMANDS:
+            self.get_function(command)
+        from zepto_eln.md_utils.markdown_compilation import get_markdown_converter
+        get_markdown_converter()
+        import jinja2  # noqa: F401
+        from zepto_eln.md_utils.metadata_index import keep_indexes_open
+        self._index_pool = keep_indexes_open()
+
+    def status(self):
+        open_indexes = len(self._index_pool.connections) if self._index_pool is not None else 0
+        return {'pid': os.getpid(), 'socket': self.socket_path, 'uptime_s': time.time() - self.started,
+                'open_indexes': open_indexes, **self.stats}
+
+    def handle(self, request):
+        """ Run a single request, returning the response dict. """
+        command = request.get('command')
+        if command == _PING:
+            return {'ok': True, 'result': self.status()}
+        if command == _SHUTDOWN:
+            self._stop = True
+            return {'ok': True, 'result': self.status()}
+        self.stats['requests'] += 1
+        capture = _CaptureLogs()
+        root = logging.getLogger()
+        saved_handlers, saved_level = root.handlers[:], root.level
+        root.handlers[:] = [capture]
+        root.setLevel(request.get('log_level', logging.INFO))
+        stdout = io.StringIO()
+        saved_cwd = os.getcwd()
+        try:
+            os.chdir(request.get('cwd') or saved_cwd)
+            with contextlib.redirect_stdout(stdout):
+                result = self.get_function(command)(**request.get('kwargs', {}))
+            response = {'ok': True, 'result': result}
+        except Exception:
+            self.stats['errors'] += 1
+            response = {'ok': False, 'error': traceback.format_exc()}
+        finally:
+            os.chdir(saved_cwd)
+            root.handlers[:] = saved_handlers
+            root.setLevel(saved_level)
+        response.update(stdout=stdout.getvalue(), logs=capture.records)
+        return response
+
+    def serve(self):
+        """ Listen for requests until stopped (or idle for `idle_timeout` seconds). """
+        if ping(self.socket_path) is not None:
+            raise RuntimeError(f"A daemon is already listening on {self.socket_path!r}.")
+        ensure_socket_dir(self.socket_path)
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.socket_path)  # Stale socket from a daemon that didn't exit cleanly.
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o177)  # Only the current user can connect.
+        try:
+            server.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        server.listen()
+        server.settimeout(self.idle_timeout)
+        self.warm_up()
+        logger.info("ELN daemon (pid %s) listening on %s", os.getpid(), self.socket_path)
+        try:
+            while not self._stop:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    logger.info("ELN daemon idle for %s s; exiting.", self.idle_timeout)
+                    break
+                with conn:
+                    conn.settimeout(None)
+                    with conn.makefile('rb') as fd:
+                        line = fd.readline()
+                    try:
+                        response = self.handle(json.loads(line))
+                    except ValueError as exc:
+                        response = {'ok': False, 'error': f"Invalid request: {exc}"}
+                    with contextlib.suppress(OSError):  # E.g. the client was interrupted.
+                        conn.sendall(json.dumps(response, default=str).encode('utf-8') + b'\n')
+        finally:
+            server.close()
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.socket_path)
+            if self._index_pool is not None:
+                from zepto_eln.md_utils.metadata_index import close_kept_indexes
+                close_kept_indexes()
+                self._index_pool = None
+
+
+def start_daemon(socket_path=None, idle_timeout=DEFAULT_IDLE_TIMEOUT, wait=10.0):
+    """ Start the daemon as a background process, and wait until it is ready.
+
+    The daemon's output is written to `zepto-eln-daemon.log` next to the socket.
+
+    Returns:
+        The daemon's status dict.
+    """
+    socket_path = socket_path or get_socket_path()
+    status = ping(socket_path)
+    if status is not None:
+        logger.info("ELN daemon is already running (pid %s).", status['pid'])
+        return status
+    socket_dir = ensure_socket_dir(socket_path)
+    with open(os.path.join(socket_dir, 'zepto-eln-daemon.log'), 'ab') as log:
+        subprocess.Popen(
+            [sys.executable, '-m', __name__, '--socket', socket_path, '--idle-timeout', str(idle_timeout)],
+            stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True, close_fds=True)
+    deadline = time.time() + wait
+    while time.time() < deadline:
+        status = ping(socket_path)
+        if status is not None:
+            logger.info("ELN daemon started (pid %s), listening on %s", status['pid'], socket_path)
+            return status
+        time.sleep(0.05)
+    raise RuntimeError(f"The ELN daemon did not start within {wait} s; see {socket_dir}/zepto-eln-daemon.log.")
+
+
+def stop_daemon(socket_path=None):
+    """ Stop the daemon, if it is running. Returns the daemon's final status dict, or None. """
+    try:
+        status = send_request({'command': _SHUTDOWN}, socket_path=socket_path)['result']
+    except (OSError, ValueError):
+        logger.info("ELN daemon is not running.")
+        return None
+    logger.info("ELN daemon (pid %s) stopped after %s requests.", status['pid'], status['requests'])
+    return status
+
+
+def daemon_command(action='status', socket_path=None, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    """ Start, stop, or check the status of the ELN daemon, or run it in the foreground ('run').
+
+    When the daemon is running, the ELN commands (eln-md-to-html, eln-query, the reports, etc.) are run by the
+    daemon, which keeps imports, Markdown instances and templates warm, instead of in a new Python process.
+    Set ZEPTO_ELN_DAEMON=0 to disable this.
+    """
+    if not is_supported():
+        raise RuntimeError("The ELN daemon requires Unix domain sockets, which are not available on this platform.")
+    if action == 'start':
+        return start_daemon(socket_path=socket_path, idle_timeout=idle_timeout)
+    if action == 'stop':
+        return stop_daemon(socket_path=socket_path)
+    if action == 'run':
+        return ElnDaemon(socket_path=socket_path, idle_timeout=idle_timeout).serve()
+    status = ping(socket_path)
+    if status is None:
+        print("ELN daemon is not running.")
+    else:
+        print(", ".join(f"{key}: {value:.1f}" if isinstance(value, float) else f"{key}: {value}"
+                        for key, value in status.items()))
+    return status
+
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description="Run the ELN daemon in the foreground.")
+    ap.add_argument('--socket', default=None)
+    ap.add_argument('--idle-timeout', type=float, default=DEFAULT_IDLE_TIMEOUT)
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    ElnDaemon(socket_path=args.socket, idle_timeout=args.idle_timeout).serve()
+
+
+if __name__ == '__main__':
+    main()
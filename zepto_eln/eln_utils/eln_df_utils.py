@@ -1,27 +1,267 @@
 # Copyright 2018 Rasmus Scholer Sorensen, <rasmusscholer@gmail.com>
 
+"""
+
+Module with Pandas DataFrame versions of the metadata functions (if you prefer the convenience of DataFrames).
+
+The journal metadata is stored as a columnar snapshot, by default `<basedir>/.zepto-eln/metadata-snapshot.feather`
+(uncompressed Feather/Arrow IPC, so it can be memory-mapped), with explicit dtypes:
+
+* status, author: Categoricals.
+* startdate, enddate: Datetimes (invalid dates are NaT).
+* Other columns with mixed values (e.g. lists, nested mappings): Strings.
+
+The snapshot is refreshed incrementally from the persistent metadata index (see `metadata_index.MetadataIndex`):
+only rows for new/changed files are rebuilt, and the snapshot is only rewritten if something has changed.
+The snapshot requires pyarrow; without it, the DataFrame is built from the metadata dicts on every call. The same
+is done (with a warning) if the index or snapshot can't be used, e.g. if the `.zepto-eln` directory is read-only.
+
+"""
+
+import os
+import json
+import sqlite3
+import logging
+
 import pandas as pd
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.feather
+except ImportError:
+    logging.getLogger(__name__).debug("`pyarrow` package not available; metadata snapshots are disabled.")
+    pyarrow = None
+
+from zepto_eln.md_utils.document_io import load_all_documents_metadata, get_fileinfo
+from zepto_eln.md_utils.metadata_index import MetadataIndex, INDEX_DIRNAME
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILENAME = 'metadata-snapshot.feather'
+SNAPSHOT_SCHEMA_VERSION = 1
+CATEGORICAL_COLUMNS = ('status', 'author')
+DATETIME_COLUMNS = ('startdate', 'enddate')
+# Bookkeeping columns, used to refresh the snapshot incrementally:
+_PATH_COLUMN, _MTIME_COLUMN, _SIZE_COLUMN = '_path', '_mtime_ns', '_size'
+_STAT_COLUMNS = (_PATH_COLUMN, _MTIME_COLUMN, _SIZE_COLUMN)
+_FILEINFO_COLUMNS = tuple(get_fileinfo('.'))
+_SCHEMA_METADATA_KEY = b'zepto_eln'
+# Arrow-compatible object columns, as given by `pd.api.types.infer_dtype()`:
+_PLAIN_DTYPES = ('empty', 'string', 'boolean', 'integer', 'floating', 'mixed-integer-float')
+
+
+def get_default_snapshot_path(basedir='.'):
+    """ Return the default metadata snapshot file path for the given notebook base directory. """
+    return os.path.join(basedir, INDEX_DIRNAME, SNAPSHOT_FILENAME)
+
+
+def _to_str(value):
+    """ Convert a metadata value (e.g. a list or mapping) to a string, for columns with mixed values. """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (list, tuple)) and all(not isinstance(item, (list, tuple, dict)) for item in value):
+        return ", ".join(str(item) for item in value)
+    return json.dumps(value, default=str)
+
+
+def _to_datetime(series):
+    try:
+        return pd.to_datetime(series, errors='coerce')
+    except (ValueError, TypeError):
+        # E.g. a mix of timezone-aware and naive datetimes.
+        return pd.to_datetime(series.map(_to_str), errors='coerce')
+
+
+def apply_metadata_dtypes(df):
+    """ Apply the snapshot dtypes to a metadata DataFrame (in place), see module docstring.
+
+    Returns:
+        The DataFrame.
+    """
+    for column in df.columns:
+        if column in CATEGORICAL_COLUMNS:
+            df[column] = df[column].map(_to_str).astype('category')
+        elif column in DATETIME_COLUMNS:
+            df[column] = _to_datetime(df[column])
+        elif df[column].dtype == object:
+            kind = pd.api.types.infer_dtype(df[column], skipna=True)
+            if kind in ('date', 'datetime', 'datetime64'):
+                df[column] = _to_datetime(df[column])
+            elif kind not in _PLAIN_DTYPES:
+                df[column] = df[column].map(_to_str)
+    return df
+
+
+def _metadata_df(records):
+    """ Build a DataFrame with snapshot dtypes from a list of metadata dicts (with bookkeeping columns). """
+    df = pd.DataFrame.from_records(records) if records else pd.DataFrame(columns=list(_STAT_COLUMNS))
+    return apply_metadata_dtypes(df)
+
+
+def _get_snapshot_info(table):
+    """ Return the zepto_eln info dict stored in the snapshot's Arrow schema metadata. """
+    metadata = table.schema.metadata or {}
+    try:
+        return json.loads(metadata.get(_SCHEMA_METADATA_KEY, b'{}'))
+    except ValueError:
+        return {}
+
+
+def _read_snapshot(snapshot_path, columns=None):
+    """ Read the snapshot as an Arrow Table, memory-mapped, or return None if it doesn't exist or is unreadable. """
+    try:
+        return pyarrow.feather.read_table(snapshot_path, columns=columns, memory_map=True)
+    except FileNotFoundError:
+        return None
+    except (pyarrow.ArrowException, OSError, KeyError) as exc:
+        logger.warning("Unable to read metadata snapshot %r (%r); rebuilding it.", snapshot_path, exc)
+        return None
+
+
+def _write_snapshot(df, snapshot_path, info):
+    """ Write the snapshot atomically (write to a temporary file, then replace). """
+    table = pyarrow.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata(
+        {**(table.schema.metadata or {}), _SCHEMA_METADATA_KEY: json.dumps(info).encode()})
+    tmp_path = snapshot_path + '.tmp'
+    pyarrow.feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, snapshot_path)
+
+
+def update_metadata_snapshot(basedir='.', snapshot_path=None, index_path=None, rebuild=False, refresh_index=True,
+                             workers=None):
+    """ Bring the columnar metadata snapshot up-to-date with the metadata index, only rebuilding changed rows.
+
+    Args:
+        basedir: The notebook base directory.
+        snapshot_path: The snapshot file (default: `<basedir>/.zepto-eln/metadata-snapshot.feather`).
+        index_path: The metadata index file (default: `<basedir>/.zepto-eln/metadata-index.sqlite`).
+        rebuild: Discard the existing snapshot and rebuild it from the index.
+        refresh_index: Update the metadata index first (only new/changed files are parsed).
+        workers: Parse new/changed files using a pool of this many worker processes.
+
+    Returns:
+        Dict with the number of 'kept', 'updated', and 'removed' rows.
+
+    Raises:
+        ImportError, if pyarrow is not available.
+        OSError or sqlite3.Error, if the metadata index or the snapshot can't be opened or written.
+    """
+    if pyarrow is None:
+        raise ImportError("Metadata snapshots require the `pyarrow` package.")
+    snapshot_path = snapshot_path or get_default_snapshot_path(basedir)
+    info = {'schema_version': SNAPSHOT_SCHEMA_VERSION, 'basedir': basedir}
+    old_table = None if rebuild else _read_snapshot(snapshot_path)
+    if old_table is not None and _get_snapshot_info(old_table) != info:
+        old_table = None  # Different snapshot version, or fileinfo for a different basedir.
+    old_stats = {}
+    if old_table is not None:
+        old_stats = dict(zip(old_table.column(_PATH_COLUMN).to_pylist(), zip(
+            old_table.column(_MTIME_COLUMN).to_pylist(), old_table.column(_SIZE_COLUMN).to_pylist())))
+
+    with MetadataIndex(basedir=basedir, index_path=index_path) as index:
+        if refresh_index:
+            index.refresh(workers=workers)
+        stats = {key: (mtime_ns, size) for key, mtime_ns, size in index.connection.execute(
+            "SELECT path, mtime_ns, size FROM documents WHERE meta IS NOT NULL")}
+        changed = [key for key, stat in stats.items() if old_stats.get(key) != stat]
+        removed = set(old_stats) - set(stats)
+        result = {'kept': len(stats) - len(changed), 'updated': len(changed), 'removed': len(removed)}
+        if old_table is not None and not changed and not removed:
+            return result
+        records = []
+        for key in changed:
+            meta = index.load_meta(index.connection.execute(
+                "SELECT meta FROM documents WHERE path = ?", (key,)).fetchone()[0])
+            if not isinstance(meta, dict):
+                continue
+            record = dict(meta, **get_fileinfo(index.get_filepath(key)))
+            record.update(zip(_STAT_COLUMNS, (key, *stats[key])))
+            records.append(record)
+
+    df = _metadata_df(records)
+    if old_table is not None:
+        old_df = old_table.to_pandas()
+        old_df = old_df.loc[~old_df[_PATH_COLUMN].isin(removed.union(changed)), :]
+        df = apply_metadata_dtypes(pd.concat([old_df, df], ignore_index=True))
+    df = df.sort_values(_PATH_COLUMN, ignore_index=True)
+    os.makedirs(os.path.dirname(snapshot_path) or '.', exist_ok=True)
+    _write_snapshot(df, snapshot_path, info)
+    logger.debug("Metadata snapshot %r updated: %s", snapshot_path, result)
+    return result
+
+
+def load_metadata_snapshot(basedir='.', columns=None, add_fileinfo_to_meta=True, snapshot_path=None,
+                           update=True, workers=None):
+    """ Load journal metadata from the columnar snapshot (memory-mapped) as a Pandas DataFrame.
 
-from zepto_eln.md_utils.document_io import load_all_documents_metadata
+    Args:
+        basedir: The notebook base directory.
+        columns: Only load these columns (faster for wide notebooks). Default: all columns.
+        add_fileinfo_to_meta: Include the fileinfo columns (filename, dirname, etc).
+        snapshot_path: The snapshot file (default: `<basedir>/.zepto-eln/metadata-snapshot.feather`).
+        update: Bring the snapshot up-to-date first, see `update_metadata_snapshot()`.
+        workers: Parse new/changed files using a pool of this many worker processes.
+    """
+    snapshot_path = snapshot_path or get_default_snapshot_path(basedir)
+    if update:
+        update_metadata_snapshot(basedir=basedir, snapshot_path=snapshot_path, workers=workers)
+    if pyarrow is None:
+        raise ImportError("Metadata snapshots require the `pyarrow` package.")
+    if columns is not None:
+        with pyarrow.memory_map(snapshot_path) as source:
+            available = set(pyarrow.ipc.open_file(source).schema.names)
+        columns = [column for column in columns if column in available]
+    table = _read_snapshot(snapshot_path, columns=columns)
+    if table is None:
+        raise FileNotFoundError(f"Metadata snapshot {snapshot_path!r} not found; run update_metadata_snapshot().")
+    df = table.to_pandas()
+    drop = [column for column in df.columns if column in _STAT_COLUMNS
+            or (not add_fileinfo_to_meta and column in _FILEINFO_COLUMNS)]
+    return df.drop(columns=drop)
 
 
-# Pandas DataFrame versions of the functions from document_io (if you prefer the convenience of DataFrames):
+def get_journals_metadata_df(basedir='.', add_fileinfo_to_meta=True, use_snapshot=True, columns=None, workers=None):
+    """ Get journal metadata as a Pandas DataFrame.
 
-def get_journals_metadata_df(basedir='.', add_fileinfo_to_meta=True):
-    """ Get journal metadata as a Pandas DataFrame. """
-    metadata = load_all_documents_metadata(basedir=basedir, add_fileinfo_to_meta=add_fileinfo_to_meta)
-    df = pd.DataFrame(metadata)
+    Args:
+        basedir: The notebook base directory.
+        add_fileinfo_to_meta: Include fileinfo (filename, dirname, etc).
+        use_snapshot: Load the metadata from the (incrementally updated, memory-mapped) columnar snapshot,
+            see `load_metadata_snapshot()`. Falls back to loading all metadata if pyarrow is not available,
+            or if the snapshot (or the metadata index) can't be read or updated.
+        columns: Only include these columns. Default: all columns.
+        workers: Parse new/changed files using a pool of this many worker processes.
+    """
+    if use_snapshot and pyarrow is not None:
+        try:
+            return load_metadata_snapshot(
+                basedir=basedir, columns=columns, add_fileinfo_to_meta=add_fileinfo_to_meta, workers=workers)
+        except (OSError, sqlite3.Error, pyarrow.ArrowException) as exc:
+            logger.warning("Unable to use the metadata snapshot (%r); loading metadata without the snapshot.", exc)
+    elif use_snapshot:
+        logger.warning("`pyarrow` is not available; loading metadata without the snapshot.")
+    metadata = load_all_documents_metadata(
+        basedir=basedir, add_fileinfo_to_meta=add_fileinfo_to_meta, use_index=use_snapshot, workers=workers)
+    df = apply_metadata_dtypes(pd.DataFrame(metadata))
+    if columns is not None:
+        df = df.loc[:, [column for column in columns if column in df.columns]]
     return df
 
 
-def get_started_exps_df(basedir='.', add_fileinfo_to_meta=True):
+def get_started_exps_df(basedir='.', add_fileinfo_to_meta=True, columns=None, use_snapshot=True):
     """ Get metadata DataFrame with journals where status='started'. """
-    df = get_journals_metadata_df(basedir=basedir, add_fileinfo_to_meta=add_fileinfo_to_meta)
+    if columns is not None and 'status' not in columns:
+        columns = ['status', *columns]
+    df = get_journals_metadata_df(
+        basedir=basedir, add_fileinfo_to_meta=add_fileinfo_to_meta, columns=columns, use_snapshot=use_snapshot)
     df = df.loc[df['status'] == 'started', :]
     return df
 
 
 def print_started_exps_df(basedir='.', cols=('expid', 'titledesc')):
     """ Print metadata DataFrame with journals where status='started'. """
-    df = get_started_exps_df(basedir=basedir)
-    print(df.loc[:, cols])
\ No newline at end of file
+    df = get_started_exps_df(basedir=basedir, columns=list(cols))
+    print(df.loc[:, list(cols)])
@@ -1,50 +1,123 @@
 # Copyright 2018 Rasmus Scholer Sorensen, <rasmusscholer@gmail.com>
 
-from zepto_eln.md_utils.document_io import load_all_documents_metadata
+import json
+import logging
+import itertools
+
+from zepto_eln.md_utils.document_io import iter_metadata
+from zepto_eln.md_utils.query import iter_query_metadata
 
 from zepto_eln.eln_utils.eln_md_pico import REQUIRED_KEYS
 
+logger = logging.getLogger(__name__)
+
+
+def iter_started_exps(basedir='.', add_fileinfo_to_meta=True, use_index=False, workers=None):
+    """ Yield metadata for journals with status='started', as they are found. """
+    if use_index:
+        return iter_query_metadata(
+            basedir=basedir, conditions=['status=started'], add_fileinfo_to_meta=add_fileinfo_to_meta, workers=workers)
+    all_meta = iter_metadata(
+        basedir=basedir, add_fileinfo_to_meta=add_fileinfo_to_meta, exclude_if_missing_yfm=True,
+        use_index=use_index, workers=workers)
+    return (m for m in all_meta if m['status'] == 'started')
+
 
-def get_started_exps(basedir='.', add_fileinfo_to_meta=True):
+def get_started_exps(basedir='.', add_fileinfo_to_meta=True, use_index=False, workers=None, limit=None):
     """ Get metadata for journals with status='started'. """
-    all_meta = load_all_documents_metadata(
-        basedir=basedir, add_fileinfo_to_meta=add_fileinfo_to_meta, exclude_if_missing_yfm=True)
-    started = [m for m in all_meta if m['status'] == 'started']
-    return started
+    started = iter_started_exps(
+        basedir=basedir, add_fileinfo_to_meta=add_fileinfo_to_meta, use_index=use_index, workers=workers)
+    return list(itertools.islice(started, limit))
 
 
-def get_unfinished_exps(basedir='.', add_fileinfo_to_meta=True):
+def iter_unfinished_exps(basedir='.', add_fileinfo_to_meta=True, use_index=False, workers=None):
     """ Journals where either status is not ('completed' or 'cancelled') or 'complete' but enddate is None.
     Edit: This is just where enddate is None and 'status' is not 'cancelled'.
     """
-    all_meta = load_all_documents_metadata(
-        basedir=basedir, add_fileinfo_to_meta=add_fileinfo_to_meta, exclude_if_missing_yfm=True)
-    started = [
+    if use_index:
+        return iter_query_metadata(
+            basedir=basedir, conditions=['enddate=null', 'status!=cancelled'],
+            add_fileinfo_to_meta=add_fileinfo_to_meta, workers=workers)
+    all_meta = iter_metadata(
+        basedir=basedir, add_fileinfo_to_meta=add_fileinfo_to_meta, exclude_if_missing_yfm=True,
+        use_index=use_index, workers=workers)
+    return (
         m for m in all_meta
         # if m.get('status') != 'cancelled' and (m.get('status') != 'completed' and m.get('enddate') is not None)
         # if not (m.get('status') == 'cancelled' or (m.get('status') == 'completed' and m.get('enddate') is not None))
         if m.get('enddate') is None and m.get('status') != 'cancelled'
-    ]
-    return started
+    )
 
 
-def print_started_exps(basedir='.', rowfmt="{expid:<10} {titledesc}"):
+def get_unfinished_exps(basedir='.', add_fileinfo_to_meta=True, use_index=False, workers=None, limit=None):
+    """ Get metadata for unfinished journals, see `iter_unfinished_exps()`. """
+    unfinished = iter_unfinished_exps(
+        basedir=basedir, add_fileinfo_to_meta=add_fileinfo_to_meta, use_index=use_index, workers=workers)
+    return list(itertools.islice(unfinished, limit))
+
+
+def print_started_exps(basedir='.', rowfmt="{expid:<10} {titledesc}", use_index=False, workers=None, limit=None):
     """ Print journals with status='started'. """
-    started = get_started_exps(basedir=basedir)
-    print("\n".join(rowfmt.format(**meta) for meta in started))
+    started = iter_started_exps(basedir=basedir, use_index=use_index, workers=workers)
+    # Print each row as soon as it is found:
+    for meta in itertools.islice(started, limit):
+        print(rowfmt.format(**meta))
 
 
-def print_unfinished_exps(basedir='.', rowfmt="{expid:<10} {titledesc}", print_header=True):
+def print_unfinished_exps(
+        basedir='.', rowfmt="{expid:<10} {titledesc}", print_header=True, use_index=False, workers=None, limit=None):
     """ Print journals with status not 'completed'. """
-    unfinished = get_unfinished_exps(basedir=basedir)
+    unfinished = iter_unfinished_exps(basedir=basedir, use_index=use_index, workers=workers)
     # print("\n".join(rowfmt.format(**meta) for meta in unfinished))
     if print_header:
         keys_titlecased = [k.title() for k in REQUIRED_KEYS]
         hdr_str = rowfmt.format(**dict(zip(REQUIRED_KEYS, keys_titlecased)))
         print(hdr_str)
         print("-"*(len(hdr_str)+8*hdr_str.count("\t")))
-    for meta in unfinished:
+    for meta in itertools.islice(unfinished, limit):
         try:
             print(rowfmt.format(**meta))
         except KeyError as exc:
             print("{}: {}, for file {} - keys: {}".format(exc.__class__.__name__, exc, meta['filename'], meta.keys()))
+
+
+QUERY_DEFAULT_FIELDS = ('expid', 'status', 'startdate', 'enddate', 'titledesc')
+
+
+def _format_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        return ', '.join(_format_value(item) for item in value)
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def print_query(expressions=(), basedir='.', sort=None, fields=None, limit=None, output_format='table',
+                refresh=True, workers=None):
+    """ Query journal metadata and print the matching journals.
+
+    Expressions are `<field><op><value>` conditions, e.g. `status=started enddate<2026-01-01 author~jane`.
+    Operators are = != < <= > >= and ~ (contains); use `null` to match missing values, e.g. `enddate=null`.
+    Conditions and sorting on status, expid, author, startdate and enddate use the metadata index' secondary
+    indexes; other fields are evaluated on the metadata of the journals matching the indexed conditions.
+    """
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    fields = list(fields or QUERY_DEFAULT_FIELDS)
+    results = iter_query_metadata(
+        basedir=basedir, conditions=expressions, sort=sort, fields=fields, limit=limit,
+        refresh=refresh, workers=workers)
+    if output_format == 'json':
+        print(json.dumps(list(results), indent=1, default=_format_value))
+    elif output_format == 'tsv':
+        print("\t".join(fields))
+        for result in results:
+            print("\t".join(_format_value(result[field]) for field in fields))
+    else:
+        rows = [[_format_value(result[field]) for field in fields] for result in results]
+        widths = [max([len(field)] + [len(row[i]) for row in rows]) for i, field in enumerate(fields)]
+        print("  ".join(field.title().ljust(width) for field, width in zip(fields, widths)).rstrip())
+        print("  ".join("-" * width for width in widths))
+        for row in rows:
+            print("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+        logger.info("%s journals.", len(rows))
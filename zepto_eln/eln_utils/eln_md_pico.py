@@ -103,126 +103,75 @@ Other:
 
 """
 
-import os
-import glob
-import re
+import logging
+import sqlite3
 import yaml
 import yaml.scanner
-from collections import defaultdict
-import pathlib
 from pprint import pprint
 
 from zepto_eln.md_utils.document_io import load_all_documents_metadata, load_document, DocumentYfmError
+from zepto_eln.md_utils.metadata_index import MetadataIndex
+from zepto_eln.md_utils.parallel import process_map
+from zepto_eln.md_utils.scanner import scan_files
+# Pico %variable% substitution functions, available here for backwards compatibility:
+from zepto_eln.md_utils.pico_utils import (
+    pico_find_variable_placeholders, get_attrs_string_value, substitute_pico_variables)
 
 REQUIRED_PICO_KEYS = ('title', 'description', 'author', )
 REQUIRED_EXP_KEYS = ('expid', 'titledesc', 'status', 'startdate', 'enddate', 'result')
 REQUIRED_KEYS = REQUIRED_PICO_KEYS + REQUIRED_EXP_KEYS
 NODEFAULT = object()
 
+logger = logging.getLogger(__name__)
+
 
 def find_md_files(basedir='.', pattern=r'*.md', pattern_type='glob'):
     # return list(find_files(start_points=[basedir], include_patterns=[pattern]))
     # Alternative, using glob:
-    return glob.glob(os.path.join(basedir, '**/*.md'))
-
-
-def pico_find_variable_placeholders(content, pat=r"%[\w\.]+%"):
-    if isinstance(pat, str):
-        pat = re.compile(pat)
-    print("type(content):", type(content))
-    res = pat.findall(content)
-    print("type(res):", type(res))
-    return set(res)  # Set to remove duplicates
-
-
-def get_attrs_string_value(dct, attrs, default=NODEFAULT):
-    """ Get attribute from object string: dict.key1.subkey2.subsubkey
-
-    Args:
-        dct:
-        attrs: A string 'attr0.attr1.attr2' or list ['attr0', 'attr1', 'attr2']
-        default: A default value if the given attrs string wasn't found.
-            If no default is given, a KeyError is raised.
+    # return glob.glob(os.path.join(basedir, '**/*.md'))
+    return [path for path, stat in scan_files(basedir, patterns=(pattern,))]
 
-    Returns:
-        The value given by attrs.
 
-    Examples:
-        >>> a = {'h': {'e': {'j': 'word'}}}
-        >>> get_attrs_string_value(a, 'h.e.j')
-        'word'
-
-    """
-    if isinstance(attrs, str):
-        attrs = attrs.split('.')
-    key, *rest = attrs
+def _load_document_meta_or_error(file):
+    """ Load document metadata, returning (meta, None) on success or (None, exc) on failure. """
     try:
-        val = dct[key]
-    except TypeError:
-        val = getattr(dct, key)
-    except KeyError as exc:
-        if default is not NODEFAULT:
-            return default
-        else:
-            raise exc
-    if rest:
-        return get_attrs_string_value(val, attrs=rest, default=default)
-    else:
-        return val
-
-
-def substitute_pico_variables(content, template_vars, errors='pass', varfmt="{sub}"):
-    """ Perform Pico-style %variable% substitution. """
-    # variable members are available as %variable.attribute%
-    # Two approaches:
-    #   a. Extract variables from document and substitute them. [we use this one]
-    #   b. Generate all possible variable placeholder strings and do str.replace(placeholder, value).
-    placeholders = pico_find_variable_placeholders(content)
-    if isinstance(varfmt, str):
-        _varfmt = varfmt
-        varfmt = defaultdict(lambda: _varfmt)
-    for placeholder in placeholders:
-        # Note: We probably shouldn't do replacements inside comments, but whatever.
-        varname = placeholder.strip('%')
-        try:
-            sub = get_attrs_string_value(template_vars, varname)
-        except KeyError as exc:
-            # E.g. if you have a comment explaining %meta.variable%:
-            if errors == 'raise':
-                raise exc
-            elif errors == 'print':
-                print(f"{exc.__class__.__name__}: {exc}")
-            elif errors == 'pass':
-                pass
-            else:
-                raise ValueError(f"Value {errors!r} for parameter `errors` not recognized.")
-        else:
-            print(f"Replacing {placeholder!r} -> {sub!r}")
-            # sub can be e.g. lists or dicts; the format string can be customized for each variable.
-            content = content.replace(placeholder, varfmt[varname].format(sub, var=sub, sub=sub))
-    return content
+        doc = load_document(
+            file, add_fileinfo_to_meta=True, yfm_parsing=True, yfm_errors='raise', header_only=True)
+    except (DocumentYfmError, IOError) as exc:
+        return None, exc
+    return doc['meta'], None
 
 
 def print_document_yfm_issues(
         basedir='.',
         required_keys=REQUIRED_KEYS,
+        use_index=False,
+        workers=None,
 ):
     """ Print journals that have YFM issues, e.g. missing YFM keys. """
     required_keys = set(required_keys)
     # files = glob.glob(os.path.join(basedir, '**/*.md'))
-    files = pathlib.Path(basedir).glob('**/*.md')
-    for file in files:
-        # print("Parsing file:", file)
+    entries = None
+    if use_index:
         try:
-            doc = load_document(file, add_fileinfo_to_meta=True, yfm_parsing=True, yfm_errors='raise')
-        except (DocumentYfmError, IOError) as exc:
+            with MetadataIndex(basedir=basedir) as index:
+                entries = index.update(workers=workers)
+        except (sqlite3.Error, OSError) as exc:
+            logger.warning("Unable to use metadata index (%r); loading all documents.", exc)
+    if entries is not None:
+        files = [file for file, meta, error in entries]
+        results = [
+            (meta, None if error is None else DocumentYfmError(file=file, causing_exception=error))
+            for file, meta, error in entries]
+    else:
+        files = find_md_files(basedir)
+        results = process_map(_load_document_meta_or_error, files, workers=workers)
+    for file, (meta, exc) in zip(files, results):
+        # print("Parsing file:", file)
+        if exc is not None:
             print(f"Failed to load file {file}: {exc!r}")
             continue
-        # doc.pop('raw_content')
-        # pprint(doc)
-        # pprint(doc.keys())
-        meta = doc['meta']
         missing = required_keys.difference(meta.keys())
         if missing:
-            print("FILE:", meta['filename'])
+            print("FILE:", file)
             print(" - MISSING KEYS:", missing)
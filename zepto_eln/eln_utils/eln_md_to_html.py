@@ -47,64 +47,263 @@ Note regarding image resizing:
 import os
 import glob
 import sys
+import inspect
 import pathlib
-import webbrowser
-import yaml
-import requests
-import click
-from collections import OrderedDict
-from pprint import pprint
+import logging
+import functools
 # import markdown  # https://pypi.org/project/markdown/
 # import frontmatter  # https://pypi.org/project/python-frontmatter/
 
 from zepto_eln.md_utils.document_io import load_document
 from zepto_eln.md_utils.markdown_compilation import compile_markdown_to_html
+from zepto_eln.md_utils.templating import apply_template, get_jinja_environment, find_template_dependencies
+from zepto_eln.md_utils.github_markdown import github_markdown, GITHUB_API_URL, DEFAULT_MAX_CONCURRENCY
+from zepto_eln.md_utils.parallel import process_map, thread_map
+from zepto_eln.md_utils.build_manifest import BuildManifest, get_config_hash, get_mtime_ns
+from zepto_eln.md_utils.instrumentation import stage, BuildProfile, profile_call, DEFAULT_CPROFILE_DIR
 
 from .eln_md_pico import substitute_pico_variables
 
-GITHUB_API_URL = 'https://api.github.com'
+logger = logging.getLogger(__name__)
 
 
 
-def github_markdown(markdown, verbose=None):
-    """ Takes raw markdown, returns html result from GitHub api """
-    endpoint = GITHUB_API_URL + "/markdown/raw"
-    headers = {'content-type': 'text/plain', 'charset': 'utf-8'}
-    res = requests.post(endpoint, data=markdown.encode('utf-8'), headers=headers)
-    res.raise_for_status()
-    return res.text
-
-
-def substitute_template_variables(template, template_type, template_vars):
-    if isinstance(template, pathlib.Path):
-        template = open(template, encoding='utf-8').read()
+def substitute_template_variables(template, template_type, template_vars, bytecode_cache_dir=None):
     if template_type is None:
         template_type = 'jinja2'
     if template_type.startswith('jinja'):
-        import jinja2
-        print("template length:", len(template))
-        template = jinja2.Template(template)
-        html = template.render(**template_vars)
-    elif template_type == 'pico':
-        html = substitute_pico_variables(content=template, template_vars=template_vars)
+        # Jinja templates are compiled once and reused, see `templating.get_jinja_environment()`.
+        return apply_template(
+            template, template_vars=template_vars, template_type=template_type, bytecode_cache_dir=bytecode_cache_dir)
+    if isinstance(template, pathlib.Path):
+        template = open(template, encoding='utf-8').read()
+    if template_type == 'pico':
+        # The template is HTML, not markdown, so backticks are not code spans:
+        html = substitute_pico_variables(content=template, template_vars=template_vars, skip_code=False)
     else:
         raise ValueError(f"Value {template_type!r} for `template_type` not recognized.")
     return html
 
 
+def find_template_files(template_dir, glob_patterns=('*.twig',)):
+    """ Return a list of the template files in template_dir matching glob_patterns. """
+    return [fn for pat in glob_patterns for fn in sorted(glob.iglob(os.path.join(template_dir, pat)))]
+
+
 def get_templates_in_dir(template_dir, glob_patterns=('*.twig',)):
 
-    files = [fn for pat in glob_patterns for fn in sorted(glob.iglob(os.path.join(template_dir, pat)))]
-    print(f"\nTemplate files in {template_dir!r}:", file=sys.stderr)
-    print("\n".join(f" - {fn!r}" for fn in files), file=sys.stderr)
+    files = find_template_files(template_dir, glob_patterns)
+    logger.debug("Template files in %r: %s", template_dir, files)
 
     templates_by_name = {os.path.splitext(os.path.basename(fn))[0]: fn for fn in files}
     templates_by_name.update({fn: fn for fn in files})
-    pprint(templates_by_name)
 
     return templates_by_name
 
 
+class ConversionContext:
+    """ Options and state for converting a batch of markdown files to HTML, see `convert_md_file_to_html()`.
+
+    Everything that doesn't depend on the individual file is resolved once, when the context is created (or, for
+    unpicklable state, on first use in each process): the options, the template directory listing and the template
+    selection, the Jinja environment, and the Markdown converter. `convert(inputfn)` then only does the per-file
+    work: reading and parsing the file, pico substitution, markdown conversion, rendering, and writing.
+
+    The context can be sent to worker processes (e.g. `process_map(context.convert, inputfns)`);
+    Jinja environments and Markdown instances are not pickled, but re-created (once) in each process.
+
+    Args:
+        See `convert_md_file_to_html()` (the defaults are the same). Pass `open_webbrowser=False` for batch
+        conversions that shouldn't open each generated file in the web browser.
+
+    Attributes:
+        options: Dict with all the conversion options (e.g. to compute a config hash for incremental builds).
+        templates: Dict with {template name or filename: template file} for the templates in template_dir.
+    """
+
+    def __init__(
+            self, outputfn='{inputfn}.html', overwrite=None, open_webbrowser=True,
+            parser='python-markdown', extensions=None,
+            template=None, template_type='jinja2', template_dir=None, apply_template=None,
+            default_template_name='index', template_bytecode_cache=None,
+            config=None, default_config=None,
+    ):
+        self.options = dict(
+            outputfn=outputfn, overwrite=overwrite, open_webbrowser=open_webbrowser, parser=parser,
+            extensions=extensions, template=template, template_type=template_type, template_dir=template_dir,
+            apply_template=apply_template, default_template_name=default_template_name,
+            template_bytecode_cache=template_bytecode_cache, config=config, default_config=default_config)
+        self.outputfn = outputfn or '{inputfn}.html'
+        self.open_webbrowser = open_webbrowser
+        self.parser = parser
+        # compile_markdown_to_html() uses the default extensions for None; an empty list/tuple also means default:
+        self.extensions = tuple(extensions) if extensions else None
+        self.template = template
+        self.template_type = template_type or 'jinja2'
+        self.template_dir = template_dir
+        self.apply_template = apply_template
+        self.default_template_name = default_template_name
+        self.template_bytecode_cache = template_bytecode_cache
+        self.templates = {}
+        self.refresh_templates()
+        self._jinja_environments = {}
+        self._template_dependencies = {}
+
+    @classmethod
+    def from_app_config(cls, **kwargs):
+        """ Create a context, taking options that are None (or empty) from the combined app config. """
+        from .eln_config import get_combined_app_config
+        sysconfig = get_combined_app_config()
+        for key in inspect.signature(cls).parameters:
+            if kwargs.get(key) is None or kwargs.get(key) == ():
+                if key in sysconfig:
+                    kwargs[key] = sysconfig[key]
+        return cls(**kwargs)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_jinja_environments'] = {}  # Jinja environments can't be pickled (and are re-created on first use).
+        return state
+
+    def refresh_templates(self):
+        """ Re-read the template directory listing, e.g. after templates have been added or removed. """
+        if self.template_dir is not None and (self.template is None or not os.path.isfile(self.template)):
+            with stage('template_lookup'):
+                self.templates = get_templates_in_dir(self.template_dir)
+
+    def get_template_file(self, document):
+        """ Return the template file to use for the document, or None if no template should be applied. """
+        if self.apply_template is False:
+            return None
+        template = self.template
+        if (template is None or not os.path.isfile(template)) and self.template_dir is not None:
+            if template is None:
+                template_name = document['meta'].get('template', self.default_template_name)
+                logger.debug("No template given, using template name from YFM (or default): %r.", template_name)
+            else:
+                template_name = template
+            try:
+                template = self.templates[template_name]
+            except KeyError:
+                logger.warning("Template directory %r does not contain any templates matching %r (case sensitive).",
+                               self.template_dir, template_name)
+            else:
+                logger.debug("Using template %r from template directory %r.", template_name, self.template_dir)
+        return template
+
+    def render_template(self, template_file, template_vars):
+        """ Render the template file with template_vars, using the (cached) Jinja environment for its directory. """
+        if not self.template_type.startswith('jinja'):
+            return substitute_template_variables(
+                template=pathlib.Path(template_file), template_type=self.template_type, template_vars=template_vars)
+        dirname, name = os.path.split(os.path.abspath(template_file))
+        try:
+            env = self._jinja_environments[dirname]
+        except KeyError:
+            env = self._jinja_environments[dirname] = get_jinja_environment(
+                dirname, bytecode_cache_dir=self.template_bytecode_cache)
+        # The environment checks the template file's mtime, so modified templates are re-compiled (e.g. in watch mode):
+        return env.get_template(name).render(**template_vars)
+
+    def get_build_dependencies(self, template_file):
+        """ Return the files (and directories) that a document rendered with template_file depends on.
+
+        These are the template file, the Jinja templates it extends or includes, and the template directory
+        (whose listing determines which template a document resolves to). Used for incremental builds.
+        """
+        dependencies = [self.template_dir] if self.template_dir is not None and self.apply_template is not False else []
+        if not template_file:
+            return dependencies
+        if not self.template_type.startswith('jinja'):
+            return [str(template_file)] + dependencies
+        # The dependencies are only re-parsed if one of the template files has been modified:
+        cached = self._template_dependencies.get(template_file)
+        if cached is None or any(get_mtime_ns(fn) != mtime_ns for fn, mtime_ns in cached):
+            cached = self._template_dependencies[template_file] = [
+                (fn, get_mtime_ns(fn))
+                for fn in find_template_dependencies(template_file, bytecode_cache_dir=self.template_bytecode_cache)]
+        return [fn for fn, _ in cached] + dependencies
+
+    def get_outputfn(self, inputfn, document, outputfn=None):
+        """ Return the output filename for inputfn, by formatting the outputfn format string. """
+        dirname = os.path.dirname(inputfn)  # e.g. '/path/to/Document.md'
+        filepath_root, fnext = os.path.splitext(inputfn)  # e.g. '/path/to/Document', '.md'
+        filename = os.path.basename(inputfn)  # e.g. 'Document.md'  (using 'basename' was a terrible choice, by the way)
+        filename_noext = os.path.splitext(filename)[0]  # e.g. 'Document'
+        return (outputfn or self.outputfn).format(
+            inputfn=inputfn, dirname=dirname,
+            # filename=filename,  # already included in `journal` dict.
+            filebasename=filename_noext, filename_noext=filename_noext,
+            fnroot=filepath_root, filepath_root=filepath_root,
+            fnext=fnext.split('.'), filename_ext=fnext.split('.'),
+            **document
+        )
+
+    def convert(self, inputfn, outputfn=None, build_info=None):
+        """ Convert a single markdown file to HTML.
+
+        Args:
+            inputfn: Input markdown file name/path.
+            outputfn: Output HTML filename (format string), if different from the context's outputfn.
+            build_info: Optional dict, which is updated with 'outputfn', 'template' (the resolved template file),
+                and 'dependencies' (see `get_build_dependencies()`).
+
+        Returns:
+            Outputfn, the filename of the generated HTML file (str).
+        """
+        logger.debug("Converting inputfn %r ...", inputfn)
+        document = load_document(inputfn, add_fileinfo_to_meta=True, yfm_parsing=True, yfm_errors='raise')
+        # returns journal dict with keys 'content', 'meta', 'fileinfo', etc.
+
+        # Pico %variable.attribute% substitution:
+        pico_vars = document.copy()
+        pico_vars.update(document['fileinfo'])  # has 'dirname', 'basename', etc.
+        pico_vars.update({
+            'template_filename': self.template,
+            'template_dir': os.path.dirname(self.template) if self.template else None,
+            'assets_url': None,
+            'theme_url': None,
+        })
+        with stage('pico', document['content']) as st:
+            document['content'] = st.data_out = substitute_pico_variables(
+                document['content'], template_vars=pico_vars, errors='print')
+
+        # Markdown to HTML conversion (the Markdown instance is cached, see `get_markdown_converter()`):
+        with stage('markdown', document['content']) as st:
+            html_content = st.data_out = compile_markdown_to_html(
+                document['content'], parser=self.parser, extensions=self.extensions)
+        pico_vars['content'] = html_content
+
+        # Twig/Jinja template interpolation:
+        template = self.get_template_file(document)
+        if template:
+            with stage('template', html_content) as st:
+                html = st.data_out = self.render_template(template, pico_vars)
+        else:
+            html = html_content
+
+        # Write to output filename:
+        outputfn = self.get_outputfn(inputfn, document, outputfn)
+        if outputfn == "-":
+            logger.debug("Writing %s characters to stdout...", len(html))
+            print(html, file=sys.stdout)
+        else:
+            with stage('write', html), open(outputfn, 'w', encoding='utf-8') as fd:
+                logger.debug("Writing %s characters to file: %r", len(html), outputfn)
+                fd.write(html)
+
+        if build_info is not None:
+            build_info.update(outputfn=outputfn, template=str(template) if template else None,
+                              dependencies=self.get_build_dependencies(template))
+
+        # Post processes:
+        if self.open_webbrowser:
+            import webbrowser
+            webbrowser.open(outputfn)
+
+        return outputfn
+
+
 # You can control rewrapping of the help text either by adding a single \b escape character above each section,
 # or using the 'context_settings' dict argument, setting the 'max_content_width' item to e.g. 400,
 # c.f. https://github.com/pallets/click/issues/441
@@ -126,8 +325,8 @@ def convert_md_file_to_html(
         inputfn, outputfn='{inputfn}.html', overwrite=None, open_webbrowser=True,
         parser='python-markdown', extensions=None,
         template=None, template_type='jinja2', template_dir=None, apply_template=None,
-        default_template_name='index',
-        config=None, default_config=None
+        default_template_name='index', template_bytecode_cache=None,
+        config=None, default_config=None, build_info=None,
 ):
     """ ELN: Convert markdown journal/document file (.md) to HTML (.html).
 
@@ -150,11 +349,14 @@ def convert_md_file_to_html(
             and each file can then select from the list of templates within this directory.
         apply_template: Can be used to disable template application on a run-by-run basis.
             Useful if a template_dir has been specified in the default config, and you want to disable that.
+        template_bytecode_cache: A directory where compiled Jinja templates are cached between runs (optional).
         config: A config (dict or file) containing options for each run.
             Note: The config takes precedence over any given arguments!
         default_config: A config (dict or file) containing default options (global config merged with local config).
             Note: Neither config or default_config has been implemented yet.
             Edit: This was actually added so I could enable/disable loading the system-wide default config. ¯\_(ツ)_/¯
+        build_info: Optional dict, which is updated with info about the build: 'outputfn' and 'template' (the
+            resolved template file, or None). Used for incremental builds, see `convert_md_files_to_html()`.
 
     \b
     Returns:
@@ -193,102 +395,142 @@ def convert_md_file_to_html(
             Whereas if we don't inject default values, we can let:
                 command line arguments > run-config > default-config.
     """
-    print(f"\nconvert_md_file_to_html started, inputfn {inputfn!r}, outputfn {outputfn!r} ...", file=sys.stderr)
-    document = load_document(inputfn, add_fileinfo_to_meta=True, yfm_parsing=True, yfm_errors='raise')
-    # returns journal dict with keys 'content', 'meta', 'fileinfo', etc.
-
-    # Pico %variable.attribute% substitution:
-    pico_vars = document.copy()
-    pico_vars.update(document['fileinfo'])  # has 'dirname', 'basename', etc.
-    pico_vars.update({
-        'template_filename': template,
-        'template_dir': os.path.dirname(template) if template else None,
-        'assets_url': None,
-        'theme_url': None,
-    })
-    document['content'] = substitute_pico_variables(document['content'], template_vars=pico_vars, errors='print')
-
-    # Markdown to HTML conversion:
-    html_content = compile_markdown_to_html(document['content'], parser=parser, extensions=extensions)
-    pico_vars['content'] = html_content
-
-    if (template is None or not os.path.isfile(template)) and template_dir is not None:
-        print("\n(template is None or not os.path.isfile(template)) and template_dir is not None.\n", file=sys.stderr)
-        if template is None:
-            template_name = document['meta'].get('template', default_template_name)
-            print(f"No template given, using template name from YFM (or default): {template_name!r}.", file=sys.stderr)
-        else:
-            template_name = template
-        template_selection = get_templates_in_dir(template_dir)
-        try:
-            template = template_selection[template_name]
-        except KeyError:
-            print(f"WARNING: Template directory does not contain any templates matching"
-                  f" {template_name!r} (case sensitive).", file=sys.stderr)
-        else:
-            print(f"Using template {template_name!r} from template directory {template_dir!r}.", file=sys.stderr)
+    context = ConversionContext(
+        outputfn=outputfn, overwrite=overwrite, open_webbrowser=open_webbrowser, parser=parser, extensions=extensions,
+        template=template, template_type=template_type, template_dir=template_dir, apply_template=apply_template,
+        default_template_name=default_template_name, template_bytecode_cache=template_bytecode_cache,
+        config=config, default_config=default_config)
+    return context.convert(inputfn, build_info=build_info)
 
-    # Twig/Jinja template interpolation:
-    if template:
-        print("Performing template variable subsubstitution...", file=sys.stderr)
-        html = substitute_template_variables(
-            template=pathlib.Path(template), template_type=template_type, template_vars=pico_vars
-        )
-    else:
-        html = html_content
-
-    # Write to output filename:
-    dirname = os.path.dirname(inputfn)  # e.g. '/path/to/Document.md'
-    filepath_root, fnext = os.path.splitext(inputfn)  # e.g. '/path/to/Document', '.md'
-    filename = os.path.basename(inputfn)  # e.g. 'Document.md'  (using 'basename' was a terrible choice, by the way)
-    filename_noext = filebasename = os.path.basename(filepath_root)  # e.g. 'Document'
-    filename_noext = filename_root = os.path.splitext(filename)[0]  # e.g. 'Document', alternative
-    print("")
-    outputfn = outputfn.format(
-        inputfn=inputfn, dirname=dirname,
-        # filename=filename,  # already included in `journal` dict.
-        filebasename=filename_noext, filename_noext=filename_noext,
-        fnroot=filepath_root, filepath_root=filepath_root,
-        fnext=fnext.split('.'), filename_ext=fnext.split('.'),
-        **document
-    )
-    if outputfn == "-":
-        print(f"\nWriting {len(html)} characters to stdout...\n\n", file=sys.stderr)
-        print(html, file=sys.stdout)
-    else:
-        with open(outputfn, 'w', encoding='utf-8') as fd:
-            print(f"\nWriting {len(html)} characters to file: {outputfn!r}\n", file=sys.stderr)
-            fd.write(html)
 
-    # Post processes:
-    if open_webbrowser:
-        webbrowser.open(outputfn)
+def _build_md_file(inputfn, context):
+    """ Convert a single file for `convert_md_files_to_html()` in incremental mode.
 
-    return outputfn
+    This is a module-level function, so it can be sent to worker processes.
 
+    Args:
+        inputfn: The markdown file to convert.
+        context: The `ConversionContext` to convert the file with.
 
-def convert_md_files_to_html(inputfns, **kwargs):
+    Returns:
+        (build_info, error) 2-tuple, where error is None if the file was converted successfully.
+    """
+    build_info = {}
+    try:
+        context.convert(inputfn, build_info=build_info)
+    except Exception as exc:
+        logger.error("%s: %s while converting file %r.", exc.__class__.__name__, exc, inputfn)
+        return build_info, f"{exc.__class__.__name__}: {exc}"
+    return build_info, None
+
+
+def convert_md_files_to_html(
+        inputfns, workers=None, incremental=False, manifest=None, watch=False, poll_interval=1.0,
+        profile=False, profile_json=None, cprofile_slowest=0, cprofile_dir=DEFAULT_CPROFILE_DIR, context=None,
+        **kwargs):
     """ Wrapper around `convert_md_file_to_html` for multi-file input.
     This also supports expansion of glob patterns, particularly useful on Windows.
 
     Args:
         inputfns:
-        **kwargs: All other arguments are passed directly to `convert_md_file_to_html`.
+        workers: Convert files using a pool of this many worker processes (0 = one per CPU core).
+            Default (None) is to convert files one after another in the current process.
+        incremental: Only convert files whose outputs are out of date, using a build manifest to keep track of
+            each file's source hash, template, parser, extensions, and config, see `build_manifest.BuildManifest`.
+            Files that fail to convert are reported and skipped, rather than aborting the whole batch.
+        manifest: The build manifest file to use in incremental mode (default: .zepto-eln/build-manifest.json).
+        watch: Convert all files, then keep watching the input files, templates, and config files,
+            re-converting the affected documents when they change. See `eln_watch.watch_md_files()`.
+        poll_interval: The polling interval (seconds) in watch mode, if file system notifications are not available.
+        profile: Time each stage of the conversion (YFM parsing, pico substitution, markdown, templating, writing),
+            and print a summary table when done. See `instrumentation.BuildProfile`.
+        profile_json: Write the profile summary as JSON to this file (implies `profile`).
+        cprofile_slowest: Run each file under cProfile, and write pstats files for this many of the slowest files
+            to `cprofile_dir` (implies `profile`).
+        cprofile_dir: The directory to write cProfile pstats files to.
+        context: The `ConversionContext` to convert the files with. The options, templates, Jinja environment, and
+            Markdown converter are resolved once for the whole batch.
+        **kwargs: If no context is given, a context is created with these options, see `convert_md_file_to_html`.
 
     Returns:
-        None
+        None, or, in incremental mode, a dict with 'built', 'skipped', and 'failed' counts.
     """
 
+    if context is None:
+        context = ConversionContext(**kwargs)
+    if watch:
+        from .eln_watch import watch_md_files  # eln_watch imports this module.
+        return watch_md_files(inputfns, poll_interval=poll_interval, **context.options)
+
     # Expand glob symbols:
     inputfns = [
         f for inputfn in inputfns
         for f in (glob.glob(inputfn, recursive=True) if '*' in inputfn else [inputfn])
     ]
-    print("inputfns:", inputfns, file=sys.stderr)
-    for inputfn in inputfns:
-        convert_md_file_to_html(inputfn, **kwargs)
-
-
-
-
-
+    logger.debug("inputfns: %s", inputfns)
+    parallel_map = process_map
+    if context.parser in ('github', 'ghmarkdown'):
+        # Conversion is limited by the GitHub API round-trips, not CPU, so just use a (bounded) thread pool:
+        parallel_map = thread_map
+        if workers is None:
+            workers = DEFAULT_MAX_CONCURRENCY
+    build_profile = None
+    if profile or profile_json or cprofile_slowest:
+        build_profile = BuildProfile(cprofile_slowest=cprofile_slowest)
+
+    def run(func, items):
+        """ Like `parallel_map(func, items)`, but collecting per-file profiles, if profiling is enabled. """
+        if build_profile is None:
+            yield from parallel_map(func, items, workers=workers)
+            return
+        # The profiles are collected in each worker process, and merged here:
+        profiled = functools.partial(profile_call, func, cprofile_slowest=cprofile_slowest)
+        for result, profile_state in parallel_map(profiled, items, workers=workers):
+            build_profile.merge(profile_state)
+            yield result
+
+    if not incremental:
+        for _ in run(context.convert, inputfns):
+            pass
+        _report_profile(build_profile, profile_json, cprofile_dir)
+        return
+
+    manifest = BuildManifest(manifest)
+    parser, extensions = context.options['parser'], context.options['extensions']
+    # Options that don't affect the generated output are not included in the config hash:
+    config_hash = get_config_hash({
+        k: v for k, v in context.options.items()
+        if k not in ('open_webbrowser', 'overwrite', 'config', 'default_config', 'template_bytecode_cache')})
+    build_params = dict(parser=parser, extensions=extensions, config_hash=config_hash)
+    outdated = [inputfn for inputfn in inputfns if not manifest.is_up_to_date(inputfn, **build_params)]
+    counts = {'built': 0, 'skipped': len(inputfns) - len(outdated), 'failed': 0}
+    build = functools.partial(_build_md_file, context=context)
+    try:
+        for inputfn, (build_info, error) in zip(outdated, run(build, outdated)):
+            if error is None:
+                manifest.record(inputfn, outputs=[build_info['outputfn']], template=build_info['template'],
+                                dependencies=build_info['dependencies'], **build_params)
+                counts['built'] += 1
+            else:
+                manifest.remove(inputfn)
+                counts['failed'] += 1
+    finally:
+        manifest.save()
+    logger.info("%s built, %s skipped (up to date), %s failed.", counts['built'], counts['skipped'], counts['failed'])
+    _report_profile(build_profile, profile_json, cprofile_dir)
+    return counts
+
+
+def _report_profile(build_profile, profile_json=None, cprofile_dir=DEFAULT_CPROFILE_DIR):
+    """ Print the profile summary table, and write the JSON and cProfile output files (if requested). """
+    if build_profile is None:
+        return
+    # The profile summary is the requested output, so it is printed regardless of the log level:
+    print("\n" + build_profile.summary_table(), file=sys.stderr)
+    if profile_json:
+        build_profile.write_json(profile_json)
+        logger.info("Profile written to %r.", profile_json)
+    if build_profile.cprofiles:
+        written = build_profile.dump_cprofiles(cprofile_dir)
+        logger.info("cProfile stats for the %s slowest files written to %r (inspect with `python -m pstats <file>`).",
+                    len(written), cprofile_dir)
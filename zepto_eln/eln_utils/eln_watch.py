@@ -0,0 +1,316 @@
+"""
+
+Module for watch mode: keep converting markdown files to HTML as they are edited, see `watch_md_files()`.
+
+Watch mode runs in a single, warm process: imports, Jinja template environments, and Markdown instances
+are loaded once and reused for every re-build, so a re-build after saving a journal only costs the conversion itself.
+
+The watcher monitors:
+
+* The input files (glob patterns are re-expanded, so new files matching a pattern are picked up).
+* The template file, or all templates in the template directory.
+* The templates that the documents' templates extend, include, or import
+    (see `ConversionContext.get_build_dependencies()`).
+* The global and local config files (and the `--config` file, if given).
+
+Changes are debounced, i.e. a burst of changes (e.g. an editor's "save all", or a save done as write + rename)
+results in a single re-build, once the files have been quiet for `debounce` seconds.
+Only the affected documents are re-built:
+
+* A changed input file is re-built.
+* A changed template only re-builds the documents that were rendered with that template, or with a template that
+    extends, includes, or imports it (e.g. a base layout).
+* Adding or removing a template re-builds all documents, since this may change which template a document resolves to.
+* A changed config file is re-loaded, and all documents are re-built.
+
+If the `watchdog` package is installed, file system notifications (inotify on Linux, FSEvents on macOS,
+ReadDirectoryChangesW on Windows) are used to wake up the watcher. Otherwise, the watched files are polled
+using `os.stat` every `poll_interval` seconds. Polling only stats the watched files (and lists the template
+directory), not the whole directory tree, so it is cheap even for a short interval.
+
+
+"""
+
+import os
+import glob
+import time
+import queue
+import logging
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = FileSystemEventHandler = None
+
+from .eln_config import get_app_config_filepaths, get_combined_app_config
+from .eln_md_to_html import _build_md_file, find_template_files, ConversionContext
+
+logger = logging.getLogger(__name__)
+
+
+def _expand_inputfns(inputfns):
+    """ Expand glob patterns in inputfns (like `convert_md_files_to_html()`), returning a list of absolute paths. """
+    return [
+        os.path.abspath(f) for inputfn in inputfns
+        for f in (sorted(glob.glob(inputfn, recursive=True)) if '*' in inputfn else [inputfn])
+    ]
+
+
+def _stat_key(path):
+    """ Return a (mtime_ns, size) key for path, or None if the file does not exist. """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class ChangeWatcher:
+    """ Watch a set of files for changes, using file system notifications if available, otherwise stat polling.
+
+    The watched files are given as a function returning the current sets of files (by category), so that
+    new files (e.g. new inputs matching a glob pattern) are picked up.
+    Changes are always determined by comparing (mtime, size) snapshots of the watched files;
+    file system notifications are only used to wake up the watcher, instead of polling.
+
+    Args:
+        get_watched_files: Function returning a dict with {category: set of absolute file paths}.
+        watch_dirs: Function returning the directories to monitor for notifications.
+        poll_interval: Polling interval, in seconds (only used when polling).
+        debounce: Wait until there has been no changes for this many seconds before reporting changes.
+        use_notifications: Use file system notifications if available (requires the `watchdog` package).
+    """
+
+    def __init__(self, get_watched_files, watch_dirs, poll_interval=1.0, debounce=0.3, use_notifications=True):
+        self.get_watched_files = get_watched_files
+        self.watch_dirs = watch_dirs
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.use_notifications = use_notifications and Observer is not None
+        self.snapshot = self.take_snapshot()
+        self._events = queue.Queue()
+        self._observer = None
+        self._observed_dirs = set()
+
+    def take_snapshot(self):
+        """ Return {category: {path: (mtime_ns, size)}} for all watched files. """
+        return {
+            category: {path: _stat_key(path) for path in paths}
+            for category, paths in self.get_watched_files().items()
+        }
+
+    @staticmethod
+    def diff(old, new):
+        """ Return {category: (changed, added, removed)} for categories with changes between two snapshots. """
+        changes = {}
+        for category in set(old) | set(new):
+            old_files, new_files = old.get(category, {}), new.get(category, {})
+            old_existing = {path for path, key in old_files.items() if key is not None}
+            new_existing = {path for path, key in new_files.items() if key is not None}
+            added = new_existing - old_existing
+            removed = old_existing - new_existing
+            changed = {path for path in old_existing & new_existing if old_files[path] != new_files[path]}
+            if changed or added or removed:
+                changes[category] = (changed, added, removed)
+        return changes
+
+    def start(self):
+        if not self.use_notifications:
+            logger.info("Watching for changes (polling every %s s)...", self.poll_interval)
+            return
+        handler = FileSystemEventHandler()
+        handler.on_any_event = lambda event: self._events.put(event)
+        self._observer = Observer()
+        self._handler = handler
+        self._schedule_dirs()
+        self._observer.start()
+        logger.info("Watching for changes (file system notifications)...")
+
+    def _schedule_dirs(self):
+        for dirpath in set(self.watch_dirs()) - self._observed_dirs:
+            if os.path.isdir(dirpath):
+                self._observer.schedule(self._handler, dirpath, recursive=False)
+                self._observed_dirs.add(dirpath)
+
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+            self._observed_dirs = set()
+
+    def _wait_for_activity(self, timeout):
+        """ Wait for a file system event (or just sleep, if polling). Returns True if there was an event. """
+        if not self.use_notifications:
+            time.sleep(timeout)
+            return False
+        try:
+            self._events.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        # Drain the queue; we only need to know that *something* happened:
+        while not self._events.empty():
+            self._events.get_nowait()
+        return True
+
+    def resync(self, category):
+        """ Update the snapshot of a category to the currently watched files, e.g. after a build found new files to
+        watch, without reporting the new files as added. Changes to files that were already watched are still
+        reported by the next `wait_for_changes()`. """
+        old = self.snapshot.get(category, {})
+        self.snapshot[category] = {
+            path: old[path] if path in old else _stat_key(path) for path in self.get_watched_files()[category]}
+        if self._observer is not None:
+            self._schedule_dirs()
+
+    def wait_for_changes(self):
+        """ Block until some of the watched files have changed (and have been quiet for `debounce` seconds).
+
+        Returns:
+            {category: (changed, added, removed)} dict, see `diff()`.
+        """
+        while True:
+            # When using notifications, we still check for changes occasionally, in case an event was missed
+            # (e.g. files on network drives, or a new directory that wasn't scheduled yet).
+            self._wait_for_activity(self.poll_interval if not self.use_notifications else max(self.poll_interval, 5))
+            new_snapshot = self.take_snapshot()
+            if not self.diff(self.snapshot, new_snapshot):
+                continue
+            # Debounce: Wait until the watched files have stopped changing.
+            while True:
+                time.sleep(self.debounce)
+                if self.use_notifications:
+                    self._wait_for_activity(0)
+                latest = self.take_snapshot()
+                if latest == new_snapshot:
+                    break
+                new_snapshot = latest
+            changes = self.diff(self.snapshot, new_snapshot)
+            self.snapshot = new_snapshot
+            if self.use_notifications:
+                self._schedule_dirs()
+            if changes:
+                return changes
+
+
+def watch_md_files(
+        inputfns, template=None, template_dir=None, config=None, poll_interval=1.0, debounce=0.3,
+        use_notifications=True, max_rebuilds=None, **kwargs
+):
+    """ Convert markdown files to HTML, then watch the files and re-convert documents when they change.
+
+    Runs until interrupted (Ctrl+C), or until `max_rebuilds` re-builds have been done.
+
+    Args:
+        inputfns: Input markdown files (or glob patterns).
+        template: The template file, passed to `convert_md_file_to_html()`.
+        template_dir: The template directory, passed to `convert_md_file_to_html()`.
+        config: A config file, passed to `convert_md_file_to_html()` (and watched for changes).
+        poll_interval: Polling interval, in seconds.
+        debounce: Wait until files have been quiet for this many seconds before re-building.
+        use_notifications: Use file system notifications if the `watchdog` package is available.
+        max_rebuilds: Stop after this many re-builds (mostly for testing).
+        **kwargs: All other arguments are passed to `convert_md_file_to_html()`.
+
+    Returns:
+        Dict with 'built' and 'failed' counts.
+    """
+    kwargs.update(template=template, template_dir=template_dir, config=config)
+    # The "resolved" config, so we can tell which options came from the config files when they change:
+    app_config = get_combined_app_config()
+    # {input file: the template files it was rendered with, i.e. its template and the templates it extends/includes}:
+    doc_dependencies = {}
+    counts = {'built': 0, 'failed': 0}
+
+    def get_template_files():
+        if template and os.path.isfile(template):
+            return {os.path.abspath(template)}
+        if template_dir and os.path.isdir(template_dir):
+            return {os.path.abspath(fn) for fn in find_template_files(template_dir)}
+        return set()
+
+    def get_config_files():
+        paths = {path for path in get_app_config_filepaths().values() if path is not None}
+        if isinstance(config, str):
+            paths.add(config)
+        return {os.path.abspath(os.path.expanduser(path)) for path in paths}
+
+    def get_watched_files():
+        return {'inputs': set(_expand_inputfns(inputfns)), 'templates': get_template_files(),
+                'dependencies': set().union(*doc_dependencies.values()), 'configs': get_config_files()}
+
+    def watch_dirs():
+        return {os.path.dirname(path) for paths in get_watched_files().values() for path in paths} | (
+            {os.path.abspath(template_dir)} if template_dir else set())
+
+    # The context (options, templates, Jinja environment, Markdown converter) is re-used for all builds,
+    # and only re-created when the config changes:
+    context = ConversionContext(**kwargs)
+
+    def build(inputfn):
+        build_info, error = _build_md_file(inputfn, context=context)
+        if error is None:
+            doc_dependencies[inputfn] = {
+                os.path.abspath(fn) for fn in build_info['dependencies'] if not os.path.isdir(fn)}
+            counts['built'] += 1
+        else:
+            doc_dependencies.pop(inputfn, None)
+            counts['failed'] += 1
+
+    watcher = ChangeWatcher(
+        get_watched_files, watch_dirs, poll_interval=poll_interval, debounce=debounce,
+        use_notifications=use_notifications)
+    for inputfn in sorted(watcher.snapshot['inputs']):
+        build(inputfn)
+    watcher.resync('dependencies')
+    # Don't open a new browser window/tab for every re-build:
+    kwargs['open_webbrowser'] = context.open_webbrowser = False
+
+    n_rebuilds = 0
+    watcher.start()
+    try:
+        while max_rebuilds is None or n_rebuilds < max_rebuilds:
+            changes = watcher.wait_for_changes()
+            inputs = watcher.snapshot['inputs']
+            to_build = set()
+            if 'configs' in changes:
+                logger.info("Config file changed; reloading config and re-building all documents.")
+                new_app_config = get_combined_app_config()
+                # Update the options that were taken from the old config (i.e. not overridden on the command line):
+                for key, value in kwargs.items():
+                    if key in app_config and value == app_config[key] and key in new_app_config:
+                        kwargs[key] = new_app_config[key]
+                app_config = new_app_config
+                context = ConversionContext(**kwargs)
+                to_build |= {path for path, key in inputs.items() if key is not None}
+            changed_templates = set()
+            if 'templates' in changes:
+                changed, added, removed = changes['templates']
+                changed_templates |= changed
+                if added or removed:
+                    logger.info("Templates added/removed; re-building all documents.")
+                    context.refresh_templates()
+                    to_build |= {path for path, key in inputs.items() if key is not None}
+            if 'dependencies' in changes:
+                changed, added, removed = changes['dependencies']
+                changed_templates |= changed | added | removed
+            if changed_templates:
+                logger.info("Template(s) changed: %s", sorted(changed_templates))
+                to_build |= {inputfn for inputfn, dependencies in doc_dependencies.items()
+                             if not dependencies.isdisjoint(changed_templates)}
+            if 'inputs' in changes:
+                changed, added, removed = changes['inputs']
+                to_build |= changed | added
+                for inputfn in removed:
+                    doc_dependencies.pop(inputfn, None)
+            for inputfn in sorted(to_build):
+                build(inputfn)
+            watcher.resync('dependencies')
+            logger.info("Re-built %s document(s). Watching for changes...", len(to_build))
+            n_rebuilds += 1
+    except KeyboardInterrupt:
+        logger.info("Stopped watching.")
+    finally:
+        watcher.stop()
+    return counts
@@ -0,0 +1,238 @@
+"""
+
+Module with asyncio counterparts of the document loading and compilation functions, e.g. for use in a web server.
+
+The blocking functions (`load_document()`, `compile_markdown_document()`) are run in executors, so they don't stall
+the event loop:
+
+* File I/O and YAML parsing (`aload_document()`, `aiter_documents()`) run in a thread pool.
+* Markdown compilation and templating (`acompile_markdown_document()`) are CPU-bound, and run in a process pool
+    by default (or a thread pool, which has less overhead per call, but is limited by the GIL).
+
+Each executor has a bounded number of calls in flight (`max_concurrency`); further requests wait (asynchronously)
+for a free slot, rather than piling up in the executor's queue. The executors are managed by an `AsyncRunner`;
+a default runner is created on first use, or can be configured with `set_default_runner()`:
+
+    >>> set_default_runner(AsyncRunner(cpu_executor='process', cpu_workers=4))
+    >>> document = await acompile_markdown_document('2019/RS123.md', outputfn=None, template_dir='templates')
+    >>> async for document in aiter_documents('.', header_only=True):
+    ...     print(document['meta'].get('title'))
+
+All functions are safe to call concurrently, from any number of tasks (and event loops).
+
+"""
+
+import os
+import asyncio
+import weakref
+import functools
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .document_io import load_document, iter_md_files, _load_document_or_skip
+from .markdown_compilation import compile_markdown_document
+
+CPU_EXECUTORS = ('process', 'thread')
+
+
+class AsyncRunner:
+    """ Runs blocking functions in thread/process pools, with bounded concurrency, for the async API.
+
+    Args:
+        io_workers: The number of threads for file I/O (default: min(32, CPU cores + 4), as ThreadPoolExecutor).
+        cpu_workers: The number of workers for CPU-bound work (default: one per CPU core).
+        cpu_executor: 'process' (default) or 'thread'.
+        max_io_concurrency: The maximum number of I/O calls in flight (default: 2 x io_workers).
+        max_cpu_concurrency: The maximum number of CPU-bound calls in flight (default: 2 x cpu_workers).
+
+    The pools are created on first use. Call `shutdown()` (or use the runner as a context manager) to stop them.
+    """
+
+    def __init__(self, io_workers=None, cpu_workers=None, cpu_executor='process',
+                 max_io_concurrency=None, max_cpu_concurrency=None):
+        if cpu_executor not in CPU_EXECUTORS:
+            raise ValueError(f"cpu_executor={cpu_executor!r} - must be one of {CPU_EXECUTORS}.")
+        self.io_workers = io_workers or min(32, (os.cpu_count() or 1) + 4)
+        self.cpu_workers = cpu_workers or os.cpu_count() or 1
+        self.cpu_executor = cpu_executor
+        self.max_io_concurrency = max_io_concurrency or 2 * self.io_workers
+        self.max_cpu_concurrency = max_cpu_concurrency or 2 * self.cpu_workers
+        self._io_pool = None
+        self._cpu_pool = None
+        self._pool_lock = threading.Lock()
+        # asyncio.Semaphores can only be used within one event loop, so we keep one pair for each loop:
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def __repr__(self):
+        return (f"AsyncRunner(io_workers={self.io_workers}, cpu_workers={self.cpu_workers}, "
+                f"cpu_executor={self.cpu_executor!r})")
+
+    def _get_pool(self, kind):
+        with self._pool_lock:
+            if kind == 'io':
+                if self._io_pool is None:
+                    self._io_pool = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix='eln-io')
+                return self._io_pool
+            if self._cpu_pool is None:
+                if self.cpu_executor == 'process':
+                    from concurrent.futures import ProcessPoolExecutor
+                    self._cpu_pool = ProcessPoolExecutor(max_workers=self.cpu_workers)
+                else:
+                    self._cpu_pool = ThreadPoolExecutor(max_workers=self.cpu_workers, thread_name_prefix='eln-cpu')
+            return self._cpu_pool
+
+    def _get_semaphore(self, kind):
+        loop = asyncio.get_running_loop()
+        with self._pool_lock:
+            try:
+                semaphores = self._semaphores[loop]
+            except KeyError:
+                semaphores = self._semaphores[loop] = {
+                    'io': asyncio.Semaphore(self.max_io_concurrency),
+                    'cpu': asyncio.Semaphore(self.max_cpu_concurrency)}
+        return semaphores[kind]
+
+    async def _run(self, kind, func, *args, **kwargs):
+        async with self._get_semaphore(kind):
+            return await asyncio.get_running_loop().run_in_executor(
+                self._get_pool(kind), functools.partial(func, *args, **kwargs))
+
+    async def run_io(self, func, *args, **kwargs):
+        """ Run func(*args, **kwargs) in the I/O thread pool, and return the result. """
+        return await self._run('io', func, *args, **kwargs)
+
+    async def run_cpu(self, func, *args, **kwargs):
+        """ Run func(*args, **kwargs) in the CPU executor, and return the result.
+
+        With the process executor, func, its arguments, and the result must be picklable.
+        """
+        return await self._run('cpu', func, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        """ Shut down the thread/process pools (they are re-created if the runner is used again). """
+        with self._pool_lock:
+            pools, self._io_pool, self._cpu_pool = (self._io_pool, self._cpu_pool), None, None
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown(wait=wait)
+
+
+_default_runner = None
+_default_runner_lock = threading.Lock()
+
+
+def get_default_runner():
+    """ Return the default `AsyncRunner`, creating it (with default settings) on first use. """
+    global _default_runner
+    with _default_runner_lock:
+        if _default_runner is None:
+            _default_runner = AsyncRunner()
+        return _default_runner
+
+
+def set_default_runner(runner):
+    """ Set the default `AsyncRunner` (the previous default runner is shut down). Returns the previous runner. """
+    global _default_runner
+    with _default_runner_lock:
+        previous, _default_runner = _default_runner, runner
+    if previous is not None and previous is not runner:
+        previous.shutdown(wait=False)
+    return previous
+
+
+async def aload_document(filepath, runner=None, **kwargs):
+    """ Async version of `document_io.load_document()`, reading and parsing the file in the I/O thread pool.
+
+    Args:
+        filepath: The document file to read.
+        runner: The `AsyncRunner` to use (default: `get_default_runner()`).
+        **kwargs: Passed to `load_document()`. Note: lazy=True returns a `Document` that reads the content on first
+            access, which blocks; use the default, lazy=False, in async code.
+
+    Returns:
+        document dict.
+    """
+    runner = runner or get_default_runner()
+    return await runner.run_io(load_document, filepath, **kwargs)
+
+
+async def acompile_markdown_document(path, runner=None, **kwargs):
+    """ Async version of `markdown_compilation.compile_markdown_document()`, run in the CPU executor.
+
+    Args:
+        path: Filepath to the markdown file.
+        runner: The `AsyncRunner` to use (default: `get_default_runner()`).
+        **kwargs: Passed to `compile_markdown_document()`. Note that, as for `compile_markdown_document()`, the HTML
+            is also written to a file unless outputfn=None is given.
+
+    Returns:
+        Document dict, with 'html' entry storing the compiled HTML.
+    """
+    runner = runner or get_default_runner()
+    return await runner.run_cpu(compile_markdown_document, path, **kwargs)
+
+
+def _take(iterator, n):
+    """ Return a list of the next (up to) n items from iterator. """
+    return list(itertools.islice(iterator, n))
+
+
+async def aiter_documents(
+        basedir='.', add_fileinfo_to_meta=True, exclude_if_missing_yfm=True, yfm_parsing=True, yfm_errors='skip-file',
+        header_only=False, runner=None, window=None):
+    """ Async version of `document_io.iter_documents()`: find and load the documents in basedir.
+
+    Documents are loaded concurrently in the I/O thread pool, but yielded in the same order as the files were found.
+    The file paths are streamed from the scanner (`document_io.iter_md_files()`), which also runs in the I/O pool,
+    and at most `window` paths are scanned and documents loaded ahead of the consumer, so memory use does not grow
+    with the size of the notebook, and the first documents are yielded before the whole tree has been scanned.
+
+    Args:
+        basedir: The directory to look for ELN documents/journals in.
+        add_fileinfo_to_meta, exclude_if_missing_yfm, yfm_parsing, yfm_errors, header_only: See `iter_documents()`.
+        runner: The `AsyncRunner` to use (default: `get_default_runner()`).
+        window: The maximum number of documents loaded ahead (default: the runner's max_io_concurrency).
+
+    Yields:
+        Document dicts.
+    """
+    runner = runner or get_default_runner()
+    window = window or runner.max_io_concurrency
+    files = iter_md_files(basedir)  # Generator; the directory tree is scanned as paths are taken from it.
+    load = functools.partial(
+        _load_document_or_skip, add_fileinfo_to_meta=add_fileinfo_to_meta, yfm_parsing=yfm_parsing,
+        yfm_errors=yfm_errors, header_only=header_only)
+    paths = deque()
+    scanned_all = False
+    pending = deque()
+    try:
+        while True:
+            while len(pending) < window:
+                if not paths and not scanned_all:
+                    # The scanner's os.scandir/stat calls block, so take the next batch of paths in the I/O pool:
+                    batch = await runner.run_io(_take, files, window)
+                    scanned_all = len(batch) < window
+                    paths.extend(batch)
+                if not paths:
+                    break
+                pending.append(asyncio.ensure_future(runner.run_io(load, paths.popleft())))
+            if not pending:
+                return
+            document = await pending.popleft()
+            if yfm_errors == 'skip-file':
+                if document is not None:
+                    yield document
+            elif document['meta'] is not None or not exclude_if_missing_yfm:
+                yield document
+    finally:
+        # E.g. if the consumer stopped iterating, or an error was raised:
+        for task in pending:
+            task.cancel()
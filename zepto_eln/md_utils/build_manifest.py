@@ -0,0 +1,163 @@
+"""
+
+Module for incremental builds: A build manifest records the inputs and outputs of each document conversion,
+so unchanged documents can be skipped the next time.
+
+For each source file, the manifest records:
+
+* The source file's content hash (sha1), mtime and size.
+* The output file(s).
+* The mtimes of the build's dependencies: the resolved template file (if a template was applied), the templates
+    it extends or includes, and the template directory (whose mtime changes when templates are added or removed,
+    which can change which template a document resolves to).
+* The Markdown parser and extensions.
+* A hash of all other build options (the "config hash").
+
+A document is up-to-date if all of these are unchanged and all outputs still exist.
+If a source file has a new mtime but the same content hash (e.g. it was just touched), it is still up-to-date.
+
+"""
+
+import os
+import json
+import logging
+import hashlib
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MANIFEST_PATH = os.path.join('.zepto-eln', 'build-manifest.json')
+MANIFEST_VERSION = 2
+
+
+def file_sha1(filepath):
+    """ Return sha1 hexdigest of the file's (binary) content. """
+    with open(filepath, 'rb') as fd:
+        return hashlib.sha1(fd.read()).hexdigest()
+
+
+def get_mtime_ns(path):
+    """ Return the mtime (ns) of a file or directory, or None if it doesn't exist. """
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_config_hash(options):
+    """ Return a hash of a dict of build options. Values that are not JSON-serializable are hashed by str(). """
+    return hashlib.sha1(json.dumps(options, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class BuildManifest:
+    """ Build manifest, stored as a JSON file, recording the inputs and outputs of each built document.
+
+    Args:
+        path: The manifest file. Defaults to `.zepto-eln/build-manifest.json` in the current directory.
+
+    Usage:
+        >>> manifest = BuildManifest()
+        >>> if not manifest.is_up_to_date(inputfn, parser=parser, extensions=extensions, config_hash=config_hash):
+        ...     outputfn = ...  # build
+        ...     manifest.record(inputfn, outputs=[outputfn], template=template, dependencies=[template_dir], ...)
+        >>> manifest.save()
+
+    """
+
+    def __init__(self, path=None):
+        self.path = path or DEFAULT_MANIFEST_PATH
+        self.entries = {}
+        self.modified = False
+        self.load()
+
+    @staticmethod
+    def _key(source):
+        return os.path.abspath(source)
+
+    def load(self):
+        try:
+            with open(self.path, encoding='utf-8') as fd:
+                data = json.load(fd)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            logger.warning("Could not read build manifest %r; rebuilding all files.", self.path)
+            return
+        if data.get('version') == MANIFEST_VERSION:
+            self.entries = data.get('entries', {})
+
+    def save(self):
+        """ Save the manifest (if it has been modified), replacing the old manifest file atomically. """
+        if not self.modified:
+            return
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fd:
+            json.dump({'version': MANIFEST_VERSION, 'entries': self.entries}, fd, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self.modified = False
+
+    def is_up_to_date(self, source, parser=None, extensions=None, config_hash=None):
+        """ Return True if the outputs recorded for source are up-to-date, i.e. the file does not need to be rebuilt.
+
+        Args:
+            source: The source (markdown) file.
+            parser: The Markdown parser to use for the new build.
+            extensions: The Markdown extensions to use for the new build.
+            config_hash: Hash of all other build options, see `get_config_hash()`.
+        """
+        entry = self.entries.get(self._key(source))
+        if entry is None:
+            return False
+        if (entry['parser'], entry['extensions'], entry['config_hash']) != (
+                parser, list(extensions) if extensions is not None else None, config_hash):
+            return False
+        if not all(os.path.isfile(output) for output in entry['outputs']):
+            return False
+        if any(get_mtime_ns(path) != mtime_ns for path, mtime_ns in entry['dependencies'].items()):
+            return False
+        try:
+            stat = os.stat(source)
+        except FileNotFoundError:
+            return False
+        if (stat.st_mtime_ns, stat.st_size) == (entry['source_mtime_ns'], entry['source_size']):
+            return True
+        # The file has been touched; check if the content has actually changed:
+        if stat.st_size != entry['source_size'] or file_sha1(source) != entry['source_hash']:
+            return False
+        entry['source_mtime_ns'] = stat.st_mtime_ns
+        self.modified = True
+        return True
+
+    def record(self, source, outputs, template=None, dependencies=(), parser=None, extensions=None, config_hash=None):
+        """ Record a successful build of source.
+
+        Args:
+            source: The source (markdown) file.
+            outputs: The output files.
+            template: The template file applied (if any).
+            dependencies: Other files (or directories) the build depends on, e.g. the templates included by
+                the template, and the template directory. The build is out of date if any of their mtimes change
+                (or if a missing dependency is created).
+            parser, extensions, config_hash: See `is_up_to_date()`.
+        """
+        stat = os.stat(source)
+        dependencies = ([template] if template else []) + list(dependencies)
+        self.entries[self._key(source)] = {
+            'source_hash': file_sha1(source),
+            'source_mtime_ns': stat.st_mtime_ns,
+            'source_size': stat.st_size,
+            'outputs': [os.path.abspath(output) for output in outputs],
+            'template': os.path.abspath(template) if template else None,
+            'dependencies': {os.path.abspath(path): get_mtime_ns(path) for path in dependencies},
+            'parser': parser,
+            'extensions': list(extensions) if extensions is not None else None,
+            'config_hash': config_hash,
+        }
+        self.modified = True
+
+    def remove(self, source):
+        """ Remove the entry for source, e.g. if the build failed. """
+        if self.entries.pop(self._key(source), None) is not None:
+            self.modified = True
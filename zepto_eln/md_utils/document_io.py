@@ -10,14 +10,23 @@ Module for loading markdown documents, including parsing of optional YAML frontm
 """
 
 
+import io
 import os
-import glob
+import logging
+import sqlite3
+import functools
 import yaml
 import yaml.scanner
 from collections import defaultdict
+from collections.abc import MutableMapping
 from pprint import pprint
 
-from .yfm import parse_yfm
+from .yfm import parse_yfm, parse_yfm_header, YFM_HEADER_MAX_BYTES
+from .parallel import process_map
+from .scanner import scan_md_files, DEFAULT_PRUNE_DIRS
+from .instrumentation import stage
+
+logger = logging.getLogger(__name__)
 
 WARN_MISSING_YFM = False
 WARN_YAML_SCANNER_ERROR = True
@@ -36,14 +45,170 @@ class DocumentYfmError(Exception):
         return (f"Error while parsing document YFM "
                 f"(msg: {self.msg}, file: '{self.file}', causing_exception: {self.causing_exception!r})")
 
+    def __reduce__(self):
+        # Make sure all attributes survive pickling, e.g. when raised in a worker process.
+        return self.__class__, (self.msg, self.file, self.causing_exception)
+
+
+class Document(MutableMapping):
+    """ Compact document object with eagerly parsed metadata and lazily loaded content.
+
+    Instead of keeping the whole file content in memory (twice, as 'raw_content' and 'content'),
+    a Document only stores the file path, the parsed metadata, and the byte offset of the main content within
+    the file. The content is read from the file on first access (and then cached).
+    Note: If the file is modified after the document is loaded, the content offset may no longer be valid.
+
+    Documents support dict-style access with the same keys as the document dicts returned by `load_document()`,
+    i.e. 'filename', 'fileinfo', 'raw_content', 'content', and 'meta'. Other keys can be added as needed,
+    e.g. document['html'] = html. `document.copy()` returns a regular dict.
+
+    Attributes:
+        filename: The document file path.
+        meta: The YFM metadata (or None).
+        content_offset: The byte offset of the main (markdown) content within the file.
+
+    """
+
+    __slots__ = ('filename', 'meta', 'content_offset', '_content', '_raw_content', '_extra')
+
+    _KEYS = ('filename', 'fileinfo', 'raw_content', 'content', 'meta')
+
+    def __init__(self, filename, meta=None, content_offset=0):
+        self.filename = filename
+        self.meta = meta
+        self.content_offset = content_offset
+        self._content = None
+        self._raw_content = None
+        self._extra = None  # Dict with additional keys, created when needed.
+
+    def _read_text(self, offset=0):
+        with open(self.filename, 'rb') as fd:
+            fd.seek(offset)
+            # TextIOWrapper gives the same universal-newline translation as open(filepath, 'r').
+            return io.TextIOWrapper(fd, encoding='utf-8').read()
+
+    @property
+    def fileinfo(self):
+        return get_fileinfo(self.filename)
+
+    @property
+    def raw_content(self):
+        """ The whole file content (read on first access). """
+        if self._raw_content is None:
+            self._raw_content = self._read_text()
+        return self._raw_content
+
+    @property
+    def content(self):
+        """ The markdown content part of the file (read on first access). """
+        if self._content is None:
+            self._content = self._read_text(self.content_offset)
+        return self._content
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+
+    def __getitem__(self, key):
+        if key in self._KEYS:
+            return getattr(self, key)
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in ('filename', 'meta', 'content'):
+            setattr(self, key, value)
+        elif key == 'raw_content':
+            self._raw_content = value
+        elif key == 'fileinfo':
+            raise TypeError("Document 'fileinfo' is derived from the filename and cannot be set.")
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._KEYS:
+            raise TypeError(f"Document key {key!r} cannot be deleted.")
+        if self._extra is None:
+            raise KeyError(key)
+        del self._extra[key]
+
+    def __iter__(self):
+        yield from self._KEYS
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return len(self._KEYS) + len(self._extra or ())
+
+    def __contains__(self, key):
+        # Don't use the default Mapping.__contains__, which would load the content.
+        return key in self._KEYS or (self._extra is not None and key in self._extra)
+
+    def copy(self):
+        """ Return a regular dict with all document entries (loads the content if not already loaded). """
+        return dict(self)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.filename!r}, meta={self.meta!r})"
+
+
+def iter_md_files(basedir='.', prune_dirs=DEFAULT_PRUNE_DIRS, concurrent=False):
+    """ Recursively find Markdown files in basedir (or a list of directories), yielding paths as they are found.
+
+    Directories in prune_dirs (e.g. '.git') and files/directories matched by `.elnignore` files are skipped,
+    see `scanner.scan_files()`.
+    """
+    return (path for path, stat in scan_md_files(basedir, prune_dirs=prune_dirs, concurrent=concurrent))
+
+
+def find_md_files(basedir='.', prune_dirs=DEFAULT_PRUNE_DIRS, concurrent=False):
+    """ Return a list of Markdown files found (recursively) in basedir, see `iter_md_files()`. """
+    return list(iter_md_files(basedir=basedir, prune_dirs=prune_dirs, concurrent=concurrent))
 
-def find_md_files(basedir='.'):
-    return glob.glob(os.path.join(basedir, '**/*.md'))
+
+def get_fileinfo(filepath):
+    """ Return a dict with file info (filename, dirname, basename, etc.) for the given filepath. """
+    dirname, basename = os.path.split(filepath)
+    fnroot, fnext = os.path.splitext(basename)
+    filepath_root, fnext = os.path.splitext(filepath)  # filepath_root
+    fileinfo = {
+        'filename': filepath,
+        'filepath': filepath,
+        'dirname': dirname,
+        'basename': basename,
+        'fnext': fnext,
+        'fnroot': fnroot, 'filename_noext': fnroot,  # alias
+        'filepath_root': filepath_root, 'filepath_noext': filepath_root,  # alias
+    }
+    return fileinfo
+
+
+def _handle_yfm_error(exc, filepath, yfm_errors='raise', meta_if_no_yfm=None):
+    """ Warn and/or raise DocumentYfmError for YFM parsing error `exc`, depending on yfm_errors.
+
+    Returns:
+        meta_if_no_yfm, if the error should not be raised.
+    """
+    # Hmm, I'm not really sure about this approach of "tell the inner function which errors to ignore".
+    # There is at least 4 known errors that may arise when trying to parse_yfm of content from a text file.
+    # It is probably better to catch this in the outer function.
+    # Or maybe have a "require_yfm" or "raise_if_no_yfm" or "raise_yfm_errors" or "missing_yfm_behavior"?
+    # Maybe check the behavior of the "frontmatter" package to make it consistent.
+    if 'warn' in yfm_errors or 'report' in yfm_errors:
+        logger.warning("%r while parsing YFM of file %s.", exc, filepath)
+    if 'raise' in yfm_errors:
+        raise DocumentYfmError(msg="", file=filepath, causing_exception=exc)
+    # else, e.g. yfm_errors='ignore':
+    return meta_if_no_yfm
 
 
 def load_document(
         filepath, add_fileinfo_to_meta=True,
         yfm_parsing=True, yfm_errors='raise', meta_if_no_yfm=None,
+        header_only=False, max_header_bytes=YFM_HEADER_MAX_BYTES, lazy=False,
 ):
     """ Reads a document file and extracts the metadata / YAML front matter and the main content.
 
@@ -53,7 +218,14 @@ def load_document(
             Adding file info like this may clutter/override metadata from the YFM.
         yfm_parsing: Attempt to parse YAML front-matter (YFM) from file.
         yfm_errors: What to do if an error is encountered during YFM parsing,
-            e.g. 'raise' to raise an exception or 'warn' to print a warning to sys.stderr.
+            e.g. 'raise' to raise an exception or 'warn' to log a warning.
+        meta_if_no_yfm: The metadata to use if the YFM could not be parsed (and yfm_errors is not 'raise').
+        header_only: Only read the YFM header at the start of the file, not the main content.
+            The returned document will not have 'raw_content' or 'content' entries.
+            Useful for metadata scans, where we don't need the (potentially large) document content.
+        max_header_bytes: In header-only mode, give up if the YFM closing marker is not found within this many bytes.
+        lazy: Return a compact `Document` object, which only reads the YFM header when loaded,
+            and reads the content from the file on first access.
 
     Returns:
         document dict, with keys:
@@ -62,40 +234,36 @@ def load_document(
             raw_content: The whole file content.
             content: The markdown content part of the file.
             meta: The YFM metadata.
+        If `lazy` is True, a `Document` object with the same keys is returned instead of a dict.
 
     """
-    dirname, basename = os.path.split(filepath)
-    fnroot, fnext = os.path.splitext(basename)
-    filepath_root, fnext = os.path.splitext(filepath)  # filepath_root
-    fileinfo = {
-        'filename': filepath,
-        'filepath': filepath,
-        'dirname': dirname,
-        'basename': basename,
-        'fnext': fnext,
-        'fnroot': fnroot, 'filename_noext': fnroot,  # alias
-        'filepath_root': filepath_root, 'filepath_noext': filepath_root,  # alias
-    }
+    fileinfo = get_fileinfo(filepath)
     # print("fileinfo:")
     # pprint(fileinfo)
 
-    with open(filepath, 'r', encoding='utf-8') as fd:
-        raw_content = fd.read()
+    if header_only or lazy:
+        # Only read the YFM header; the rest of the (potentially multi-megabyte) file is not read (yet).
+        yfm, content_offset = None, 0
+        if yfm_parsing:
+            with stage('yfm'), open(filepath, 'rb') as fd:
+                try:
+                    yfm, content_offset = parse_yfm_header(fd, max_bytes=max_header_bytes)
+                except (yaml.error.YAMLError, ValueError, AssertionError) as exc:
+                    yfm = _handle_yfm_error(exc, filepath, yfm_errors=yfm_errors, meta_if_no_yfm=meta_if_no_yfm)
+        if add_fileinfo_to_meta and yfm is not None:
+            yfm.update(fileinfo)
+        if lazy:
+            return Document(filepath, meta=yfm, content_offset=content_offset)
+        return {'filename': filepath, 'fileinfo': fileinfo, 'meta': yfm}
+
+    with stage('read') as st, open(filepath, 'r', encoding='utf-8') as fd:
+        raw_content = st.data_out = fd.read()
     if yfm_parsing:
         try:
-            yfm, md_content = parse_yfm(raw_content)
+            with stage('yfm', raw_content):
+                yfm, md_content = parse_yfm(raw_content)
         except (yaml.error.YAMLError, ValueError, AssertionError) as exc:
-            # Hmm, I'm not really sure about this approach of "tell the inner function which errors to ignore".
-            # There is at least 4 known errors that may arise when trying to parse_yfm of content from a text file.
-            # It is probably better to catch this in the outer function.
-            # Or maybe have a "require_yfm" or "raise_if_no_yfm" or "raise_yfm_errors" or "missing_yfm_behavior"?
-            # Maybe check the behavior of the "frontmatter" package to make it consistent.
-            if 'warn' in yfm_errors or 'report' in yfm_errors:
-                print(f"WARNING: {exc!r} while parsing YFM of file {filepath}.")
-            if 'raise' in yfm_errors:
-                raise DocumentYfmError(msg="", file=filepath, causing_exception=exc)
-            # else, e.g. yfm_errors='ignore':
-            yfm = meta_if_no_yfm
+            yfm = _handle_yfm_error(exc, filepath, yfm_errors=yfm_errors, meta_if_no_yfm=meta_if_no_yfm)
             md_content = raw_content
     else:
         yfm, md_content = None, raw_content
@@ -116,58 +284,132 @@ def load_document(
     return document
 
 
-def load_all_documents(
-        basedir='.', add_fileinfo_to_meta=True, exclude_if_missing_yfm=True, yfm_parsing=True, yfm_errors='skip-file'):
-    """ Find all Markdown documents/journals (recursively) within a given base directory.
+def _load_document_or_skip(filepath, yfm_errors='skip-file', **kwargs):
+    """ Wrapper around `load_document()` used by `load_all_documents()`.
+
+    Returns None if yfm_errors is 'skip-file' and the document's YFM could not be parsed.
+    This is a module-level function (rather than a closure), so it can be sent to worker processes.
+    """
+    if yfm_errors == 'skip-file':
+        try:
+            return load_document(filepath, **kwargs)
+        except DocumentYfmError:
+            return None
+    return load_document(filepath, yfm_errors=yfm_errors, **kwargs)
+
+
+def iter_documents(
+        basedir='.', add_fileinfo_to_meta=True, exclude_if_missing_yfm=True, yfm_parsing=True, yfm_errors='skip-file',
+        workers=None, chunksize=None, header_only=False, lazy=False):
+    """ Find Markdown documents/journals (recursively) within a given base directory, and yield them one by one.
+
+    Documents are yielded as soon as they are found and loaded, so callers can start processing (or printing)
+    results immediately, and can stop early, without loading all documents first.
 
     Args:
         basedir: The directory to look for ELN documents/journals in.
         add_fileinfo_to_meta: Whether to add fileinfo to the document's metadata (the parsed YFM).
         exclude_if_missing_yfm: Exclude pages if they don't have YAML front-matter.
+        yfm_parsing: Attempt to parse YAML front-matter (YFM) from the files.
+        yfm_errors: What to do if an error is encountered during YFM parsing, see `load_document()`.
+            Default, 'skip-file', is to just skip files with YFM errors.
+        workers: Load documents using a pool of this many worker processes.
+            None or 1 loads documents serially in the current process; 0 uses one worker per CPU core.
+        chunksize: The number of files to submit to each worker process at a time (default: automatic).
+        header_only: Only read the YFM header of each file, see `load_document()`.
+        lazy: Yield compact `Document` objects that load the content on first access, see `load_document()`,
+            instead of regular document dicts. This greatly reduces memory usage for large notebooks.
+
+    Yields:
+        Documents (`Document` objects or dicts), in the same order as the files were found, regardless of `workers`.
+
+    """
+    files = iter_md_files(basedir=basedir)
+    load = functools.partial(
+        _load_document_or_skip, add_fileinfo_to_meta=add_fileinfo_to_meta, yfm_parsing=yfm_parsing,
+        yfm_errors=yfm_errors, header_only=header_only, lazy=lazy)
+    for document in process_map(load, files, workers=workers, chunksize=chunksize):
+        if yfm_errors == 'skip-file':
+            if document is not None:
+                yield document
+        elif document['meta'] is not None or not exclude_if_missing_yfm:
+            yield document
+
+
+def load_all_documents(
+        basedir='.', add_fileinfo_to_meta=True, exclude_if_missing_yfm=True, yfm_parsing=True, yfm_errors='skip-file',
+        workers=None, chunksize=None, header_only=False, lazy=False):
+    """ Find all Markdown documents/journals (recursively) within a given base directory.
+
+    Args:
+        See `iter_documents()`.
 
     Returns:
-        List of documents (dicts).
+        List of documents (`Document` objects or dicts), in the same order as the files were found,
+        regardless of `workers`.
 
     """
-    files = find_md_files(basedir=basedir)  # glob.glob(os.path.join(basedir, '**/*.md'))
-    documents = []
-    for fn in files:
-        if yfm_errors == 'skip-file':
-            try:
-                document = load_document(fn, add_fileinfo_to_meta=add_fileinfo_to_meta, yfm_parsing=yfm_parsing)
-            except DocumentYfmError:
-                pass
-            else:
-                documents.append(document)
-        else:
-            document = load_document(
-                fn, add_fileinfo_to_meta=add_fileinfo_to_meta, yfm_parsing=yfm_parsing, yfm_errors=yfm_errors
-            )
-            if document['meta'] is not None or not exclude_if_missing_yfm:
-                documents.append(document)
-    return documents
+    return list(iter_documents(
+        basedir=basedir, add_fileinfo_to_meta=add_fileinfo_to_meta, exclude_if_missing_yfm=exclude_if_missing_yfm,
+        yfm_parsing=yfm_parsing, yfm_errors=yfm_errors, workers=workers, chunksize=chunksize,
+        header_only=header_only, lazy=lazy))
 
 
-def load_all_documents_metadata(
+def iter_metadata(
         basedir='.', add_fileinfo_to_meta=True, yfm_parsing=True, yfm_errors='skip-file',
-        exclude_if_missing_yfm=True):
-    """ Find and load Markdown documents and extract YFM metadata.
+        exclude_if_missing_yfm=True, use_index=False, index_path=None, workers=None):
+    """ Find Markdown documents and yield their YFM metadata one by one.
+
+    Only the YFM header of each file is read.
 
     Args:
         basedir: The directory to find journals in.
         add_fileinfo_to_meta: Whether to add fileinfo (e.g. filename, directory, etc).
+        yfm_parsing: Attempt to parse YAML front-matter (YFM) from the files.
+        yfm_errors: What to do if an error is encountered during YFM parsing, see `iter_documents()`.
         exclude_if_missing_yfm: Exclude journals/files if they don't have any YAML front-matter.
+        use_index: Use the persistent metadata index, only re-parsing files that have changed since last run.
+            See `metadata_index.MetadataIndex`.
+        index_path: The metadata index file to use (default: `<basedir>/.zepto-eln/metadata-index.sqlite`).
+        workers: Parse documents using a pool of this many worker processes, see `iter_documents()`.
 
-    Returns:
-        List of metadata dicts (as read from the document YFM).
+    Yields:
+        Metadata dicts (as read from the document YFM).
     """
-    documents = load_all_documents(
+    if use_index and yfm_parsing:
+        from .metadata_index import MetadataIndex
+        try:
+            index = MetadataIndex(basedir=basedir, index_path=index_path).open()
+        except (sqlite3.Error, OSError) as exc:
+            logger.warning("Unable to use metadata index (%r); loading all documents.", exc)
+        else:
+            with index:
+                yield from index.iter_metadata(
+                    add_fileinfo_to_meta=add_fileinfo_to_meta, yfm_errors=yfm_errors,
+                    exclude_if_missing_yfm=exclude_if_missing_yfm, workers=workers)
+            return
+    documents = iter_documents(
         basedir=basedir, add_fileinfo_to_meta=add_fileinfo_to_meta,
         yfm_parsing=yfm_parsing, yfm_errors=yfm_errors,
-        exclude_if_missing_yfm=exclude_if_missing_yfm
+        exclude_if_missing_yfm=exclude_if_missing_yfm, workers=workers,
+        header_only=True, lazy=False,  # We only need the metadata, not the document content.
     )
     # print("\n".join("{}: {}".format(j['filename'], type(j['meta'])) for j in journals))
-    metadata = [document['meta'] for document in documents]
-    return metadata
+    for document in documents:
+        yield document['meta']
+
+
+def load_all_documents_metadata(
+        basedir='.', add_fileinfo_to_meta=True, yfm_parsing=True, yfm_errors='skip-file',
+        exclude_if_missing_yfm=True, use_index=False, index_path=None, workers=None):
+    """ Find and load Markdown documents and extract YFM metadata.
 
+    Args:
+        See `iter_metadata()`.
 
+    Returns:
+        List of metadata dicts (as read from the document YFM).
+    """
+    return list(iter_metadata(
+        basedir=basedir, add_fileinfo_to_meta=add_fileinfo_to_meta, yfm_parsing=yfm_parsing, yfm_errors=yfm_errors,
+        exclude_if_missing_yfm=exclude_if_missing_yfm, use_index=use_index, index_path=index_path, workers=workers))
@@ -0,0 +1,141 @@
+"""
+
+Module for fast parsing of YAML front matter.
+
+YAML parsing is the single largest cost of metadata scans. Two things make it faster:
+
+* The libyaml-based `yaml.CSafeLoader` is used, when PyYAML has been built with libyaml.
+* Most journal headers are "flat", i.e. just `key: scalar` lines (expid, status, startdate, ...),
+    optionally with simple flow lists (`tags: [a, b, c]`). These are parsed line-by-line by `parse_flat_yaml()`,
+    without going through the full YAML parser.
+
+The fast path is deliberately conservative: Anything that isn't clearly a flat header (indentation, quotes,
+block scalars, anchors/tags, comments after values, flow mappings, non-printable characters, etc.)
+falls back to the full YAML loader. Scalars are resolved and constructed using PyYAML's own `Resolver` and
+`SafeConstructor`, so values (ints, floats, bools, nulls, dates, timestamps) are identical to what
+`yaml.SafeLoader` gives. See `benchmarks/bench_yaml.py` for the conformance check and benchmark.
+
+Note: For valid YAML, CSafeLoader and SafeLoader give identical results. For some invalid YAML, libyaml is more
+lenient than the pure-Python scanner (e.g. it accepts tabs inside plain scalars), or raises a different
+YAMLError subclass.
+
+"""
+
+import re
+import functools
+
+import yaml
+from yaml.resolver import Resolver
+from yaml.constructor import SafeConstructor
+
+# Use the (much faster) libyaml loader if available:
+YAML_SAFE_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Returned by parse_flat_yaml() if the text is not a flat header:
+NOT_FLAT = object()
+
+_KEY_VALUE_REGEX = re.compile(r'([A-Za-z_][A-Za-z0-9_\-]*):(?: +(.*))?')
+# Characters that cannot start a plain (unquoted) scalar, or start something that isn't a plain scalar:
+_INDICATORS = frozenset('-?:,[]{}#&*!|>\'"%@`')
+_FLOW_INDICATORS = frozenset(',[]{}#')
+
+_resolver = Resolver()
+_constructor = SafeConstructor()
+_implicit = (True, False)
+
+
+@functools.lru_cache(maxsize=4096)
+def _construct_plain_scalar(value):
+    """ Resolve and construct a plain scalar, exactly like yaml.SafeLoader does.
+
+    Returns NOT_FLAT if the scalar resolves to a tag the SafeConstructor cannot construct.
+    (The constructed values are all immutable, so they are safe to cache.)
+    """
+    tag = _resolver.resolve(yaml.ScalarNode, value, _implicit)
+    construct = SafeConstructor.yaml_constructors.get(tag)
+    if construct is None:
+        return NOT_FLAT
+    return construct(_constructor, yaml.ScalarNode(tag, value))
+
+
+def _is_plain(value, flow=False):
+    """ Return True if value (stripped, non-empty) is unambiguously a single-line plain scalar. """
+    if value[0] in _INDICATORS:
+        # '-' is allowed as the first character if not followed by a space, e.g. negative numbers:
+        if not (value[0] == '-' and len(value) > 1 and value[1] != ' ' and value[1] != '-'):
+            return False
+    if ': ' in value or value.endswith(':') or ' #' in value:
+        return False
+    if flow and (':' in value or any(c in _FLOW_INDICATORS for c in value)):
+        return False
+    return True
+
+
+def parse_flat_yaml(text):
+    """ Parse a flat YAML mapping of `key: scalar` (and `key: [scalar, ...]`) lines.
+
+    Args:
+        text: The YAML text.
+
+    Returns:
+        The parsed mapping (dict), or NOT_FLAT if text is not a flat mapping (or might not be parsed exactly
+        like yaml.SafeLoader would parse it), in which case the full YAML loader should be used.
+    """
+    result = {}
+    for line in text.split('\n'):
+        if line.endswith('\r'):
+            line = line[:-1]
+        if not line or line.isspace():
+            continue
+        if not line.isprintable() or line[0] == ' ':
+            return NOT_FLAT  # Tabs, indentation (nested structures, multi-line scalars), special characters.
+        if line[0] == '#':
+            continue
+        match = _KEY_VALUE_REGEX.fullmatch(line)
+        if match is None:
+            return NOT_FLAT
+        key = _construct_plain_scalar(match.group(1))
+        if key is NOT_FLAT:
+            return NOT_FLAT
+        value = (match.group(2) or '').strip()
+        if not value:
+            result[key] = None
+            continue
+        if value[0] == '[' and value[-1] == ']':
+            inner = value[1:-1].strip()
+            items = [item.strip() for item in inner.split(',')] if inner else []
+            if not all(item and _is_plain(item, flow=True) for item in items):
+                return NOT_FLAT
+            value = [_construct_plain_scalar(item) for item in items]
+            if any(item is NOT_FLAT for item in value):
+                return NOT_FLAT
+        elif _is_plain(value):
+            value = _construct_plain_scalar(value)
+            if value is NOT_FLAT:
+                return NOT_FLAT
+        else:
+            return NOT_FLAT
+        result[key] = value
+    if not result:
+        return NOT_FLAT  # Let the YAML loader decide what an empty document is.
+    return result
+
+
+def load_yaml(text, fast_path=True):
+    """ Parse YAML (front matter) text, like `yaml.load(text, Loader=yaml.SafeLoader)`, but faster.
+
+    Flat headers are parsed by `parse_flat_yaml()`; everything else uses `yaml.CSafeLoader` if available,
+    else `yaml.SafeLoader`.
+
+    Args:
+        text: The YAML text.
+        fast_path: Use the flat-header fast path when possible.
+
+    Raises:
+        yaml.error.YAMLError, if the text is not valid YAML.
+    """
+    if fast_path:
+        result = parse_flat_yaml(text)
+        if result is not NOT_FLAT:
+            return result
+    return yaml.load(text, Loader=YAML_SAFE_LOADER)
@@ -0,0 +1,195 @@
+"""
+
+Module for rendering Markdown to HTML using the GitHub Markdown API (the 'github' parser).
+
+The GitHub API is slow compared to local rendering, and is rate-limited
+(60 requests/hour for anonymous requests, 5000 requests/hour if authenticated with a token).
+The `GithubMarkdownClient` therefore:
+
+* Uses a pooled `requests.Session`, so connections are reused between documents.
+* Caches rendered HTML on disk, keyed by a hash of the markdown content, so unchanged markdown is never sent twice.
+* Tracks the `X-RateLimit-Remaining` and `X-RateLimit-Reset` response headers, and waits for the rate limit to reset
+    rather than sending requests that will be rejected. Rate-limited (403/429) and server errors (5xx) are retried
+    with exponential backoff.
+* Can render multiple documents concurrently, with a bounded number of simultaneous requests, see `render_many()`.
+
+Configuration (environment variables):
+
+* ZEPTO_ELN_GITHUB_API_URL: The API base URL (default: https://api.github.com).
+    Can be set to e.g. a local stand-in HTTP server for testing.
+* GITHUB_TOKEN: If set, requests are authenticated using this token (higher rate limit).
+
+
+"""
+
+import os
+import time
+import logging
+import hashlib
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+GITHUB_API_URL = 'https://api.github.com'
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'zepto-eln', 'github-markdown')
+# Max number of simultaneous requests, e.g. when converting multiple files:
+DEFAULT_MAX_CONCURRENCY = 4
+
+
+class GithubMarkdownClient:
+    """ Client for the GitHub Markdown API, with connection pooling, disk caching, and rate-limit handling.
+
+    Args:
+        base_url: The API base URL. Defaults to $ZEPTO_ELN_GITHUB_API_URL or 'https://api.github.com'.
+        token: GitHub API token. Defaults to $GITHUB_TOKEN (if set).
+        cache_dir: Directory for caching rendered HTML, or None to disable the cache.
+        timeout: Request timeout, in seconds.
+        max_retries: The maximum number of retries for rate-limited requests and server errors.
+        backoff: The initial retry delay, in seconds (doubled after each retry).
+        max_wait: Never wait more than this many seconds for the rate limit to reset; raise an error instead.
+        max_concurrency: The maximum number of simultaneous requests (also the connection pool size).
+
+    """
+
+    def __init__(
+            self, base_url=None, token=None, cache_dir=DEFAULT_CACHE_DIR,
+            timeout=30, max_retries=5, backoff=1.0, max_wait=3600, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+    ):
+        self.base_url = (base_url or os.environ.get('ZEPTO_ELN_GITHUB_API_URL') or GITHUB_API_URL).rstrip('/')
+        self.token = token if token is not None else os.environ.get('GITHUB_TOKEN')
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.max_concurrency = max_concurrency
+        self._session = None
+        self._lock = threading.Lock()
+        # Rate limit state, from the latest response headers:
+        self.ratelimit_remaining = None
+        self.ratelimit_reset = None  # Epoch time (seconds)
+        self.stats = {'requests': 0, 'cache_hits': 0, 'retries': 0}
+
+    @property
+    def session(self):
+        """ Pooled requests.Session (created on first use). """
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests  # Imported on first use; importing requests is slow.
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(
+                        pool_connections=1, pool_maxsize=self.max_concurrency)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    session.headers.update({'Content-Type': 'text/plain; charset=utf-8', 'Accept': 'text/html'})
+                    if self.token:
+                        session.headers['Authorization'] = f"token {self.token}"
+                    self._session = session
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def _cache_path(self, markdown):
+        key = hashlib.sha256(f"{self.base_url}\n{markdown}".encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + '.html')
+
+    def _cache_get(self, markdown):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._cache_path(markdown), encoding='utf-8') as fd:
+                return fd.read()
+        except FileNotFoundError:
+            return None
+
+    def _cache_put(self, markdown, html):
+        if self.cache_dir is None:
+            return
+        path = self._cache_path(markdown)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as fd:
+            fd.write(html)
+        os.replace(tmp_path, path)  # Atomic, so concurrent readers never see a partial file.
+
+    def _update_ratelimit(self, response):
+        headers = response.headers
+        with self._lock:
+            if 'X-RateLimit-Remaining' in headers:
+                self.ratelimit_remaining = int(headers['X-RateLimit-Remaining'])
+            if 'X-RateLimit-Reset' in headers:
+                self.ratelimit_reset = int(headers['X-RateLimit-Reset'])
+
+    def _wait_for_ratelimit(self):
+        """ If the rate limit has been exhausted, sleep until it resets. """
+        with self._lock:
+            if self.ratelimit_remaining is None or self.ratelimit_remaining > 0 or self.ratelimit_reset is None:
+                return
+            wait = self.ratelimit_reset - time.time() + 1
+        if wait <= 0:
+            return
+        if wait > self.max_wait:
+            raise RuntimeError(f"GitHub API rate limit exceeded; resets in {wait:.0f} s (max_wait={self.max_wait}).")
+        logger.warning("GitHub API rate limit exhausted; waiting %.0f s for it to reset...", wait)
+        time.sleep(wait)
+
+    def _post(self, markdown):
+        endpoint = self.base_url + "/markdown/raw"
+        delay = self.backoff
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_ratelimit()
+            response = self.session.post(endpoint, data=markdown.encode('utf-8'), timeout=self.timeout)
+            self.stats['requests'] += 1
+            self._update_ratelimit(response)
+            rate_limited = response.status_code == 429 or (
+                response.status_code == 403 and response.headers.get('X-RateLimit-Remaining') == '0')
+            if not (rate_limited or response.status_code >= 500) or attempt == self.max_retries:
+                break
+            self.stats['retries'] += 1
+            retry_after = response.headers.get('Retry-After')
+            if retry_after is not None and retry_after.isdigit():
+                time.sleep(min(int(retry_after), self.max_wait))
+            elif not rate_limited or self.ratelimit_reset is None:
+                time.sleep(delay)
+                delay *= 2
+            # else: _wait_for_ratelimit() waits for the rate limit reset before the next attempt.
+        response.raise_for_status()
+        return response.text
+
+    def render(self, markdown):
+        """ Render markdown to HTML using the GitHub API (or the cache, if this markdown has been rendered before). """
+        html = self._cache_get(markdown)
+        if html is not None:
+            self.stats['cache_hits'] += 1
+            return html
+        html = self._post(markdown)
+        self._cache_put(markdown, html)
+        return html
+
+    def render_many(self, markdowns, max_workers=None):
+        """ Render multiple markdown documents, using up to `max_workers` (default: max_concurrency) simultaneous
+        requests.
+
+        Returns:
+            List of HTML strings, in the same order as markdowns.
+        """
+        max_workers = min(max_workers or self.max_concurrency, self.max_concurrency)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.render, markdowns))
+
+
+@functools.lru_cache(maxsize=None)
+def get_github_markdown_client():
+    """ Return the shared default GithubMarkdownClient, so connections and rate-limit state are shared. """
+    return GithubMarkdownClient()
+
+
+def github_markdown(markdown, verbose=None):
+    """ Takes raw markdown, returns html result from GitHub api """
+    return get_github_markdown_client().render(markdown)
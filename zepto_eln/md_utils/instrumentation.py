@@ -0,0 +1,279 @@
+"""
+
+Module for lightweight per-stage timing and profiling of the compile pipeline.
+
+The pipeline functions (`load_document`, `compile_markdown_document`, `convert_md_file_to_html`) wrap each stage
+in a `stage()` context:
+
+    >>> with stage('markdown', content) as st:
+    ...     html = compile_markdown_to_html(content)
+    ...     st.data_out = html
+
+When profiling is not enabled (the default), `stage()` returns a shared no-op context,
+so the overhead is a context variable lookup and a function call per stage.
+Byte counts are only computed when profiling is enabled.
+
+To profile a batch, activate a `BuildProfile`:
+
+    >>> profile = BuildProfile(cprofile_slowest=5)
+    >>> with profile.activate():
+    ...     for inputfn in inputfns:
+    ...         with profile.file(inputfn):
+    ...             convert_md_file_to_html(inputfn)
+    >>> print(profile.summary_table())
+    >>> profile.write_json('profile.json')
+
+Profiles from worker processes are collected with `profile_call()` and combined with `BuildProfile.merge()`.
+The active profile is stored in a context variable, so each thread (e.g. the workers of `parallel.thread_map()`)
+and each asyncio task has its own active profile.
+
+
+"""
+
+import os
+import time
+import json
+import heapq
+import cProfile
+import threading
+import contextlib
+import contextvars
+
+# The active BuildProfile, or None if profiling is disabled:
+_active_profile = contextvars.ContextVar('active_build_profile', default=None)
+# Default directory for the cProfile pstats files of the slowest files:
+DEFAULT_CPROFILE_DIR = os.path.join('.zepto-eln', 'profile')
+
+
+def _nbytes(data):
+    """ Return the size of data (str or bytes) in bytes, or 0 if data is None. """
+    if data is None:
+        return 0
+    if isinstance(data, str):
+        return len(data.encode('utf-8', errors='replace'))
+    return len(data)
+
+
+class _NullStage:
+    """ No-op stage context, used when profiling is disabled. """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def __setattr__(self, key, value):
+        pass  # Ignore `st.data_out = ...`
+
+
+NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    """ Timing context for a single stage, see `stage()`. """
+    __slots__ = ('profile', 'name', 'data_in', 'data_out', 'start')
+
+    def __init__(self, profile, name, data_in=None):
+        self.profile = profile
+        self.name = name
+        self.data_in = data_in
+        self.data_out = None
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        self.profile.add(self.name, elapsed, _nbytes(self.data_in), _nbytes(self.data_out))
+        return False
+
+
+def stage(name, data_in=None):
+    """ Return a context that times the named stage, if profiling is enabled.
+
+    Args:
+        name: The stage name, e.g. 'yfm', 'pico', 'markdown', 'template', 'write'.
+        data_in: The stage's input data (str or bytes), for counting bytes in.
+            Set `data_out` on the returned context object to count bytes out.
+    """
+    profile = _active_profile.get()
+    if profile is None:
+        return NULL_STAGE
+    return _Stage(profile, name, data_in)
+
+
+def get_active_profile():
+    """ Return the active BuildProfile, or None if profiling is disabled. """
+    return _active_profile.get()
+
+
+class BuildProfile:
+    """ Collects per-stage timings (and bytes in/out) across a batch of documents.
+
+    Args:
+        cprofile_slowest: Run each file under cProfile, and keep the profile stats for this many of the
+            slowest files (0 to disable cProfile, which has a significant overhead).
+    """
+
+    def __init__(self, cprofile_slowest=0):
+        self.cprofile_slowest = cprofile_slowest
+        self.stages = {}  # {name: [count, total_s, max_s, bytes_in, bytes_out]}
+        self.files = []  # [(total_s, filename, {stage: total_s})]
+        self.cprofiles = []  # Heap of (total_s, filename, stats_dict), for the slowest files.
+        self._file_stages = None
+        self._lock = threading.Lock()
+
+    def add(self, name, elapsed, bytes_in=0, bytes_out=0):
+        with self._lock:
+            totals = self.stages.get(name)
+            if totals is None:
+                totals = self.stages[name] = [0, 0.0, 0.0, 0, 0]
+            totals[0] += 1
+            totals[1] += elapsed
+            totals[2] = max(totals[2], elapsed)
+            totals[3] += bytes_in
+            totals[4] += bytes_out
+            if self._file_stages is not None:
+                self._file_stages[name] = self._file_stages.get(name, 0.0) + elapsed
+
+    @contextlib.contextmanager
+    def activate(self):
+        """ Make this the active profile (for the current thread or asyncio task) within the context. """
+        token = _active_profile.set(self)
+        try:
+            yield self
+        finally:
+            _active_profile.reset(token)
+
+    @contextlib.contextmanager
+    def file(self, filename):
+        """ Time the processing of a single file (optionally under cProfile). """
+        self._file_stages = {}
+        profiler = cProfile.Profile() if self.cprofile_slowest else None
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                profiler.enable()
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            elapsed = time.perf_counter() - start
+            self.files.append((elapsed, filename, self._file_stages))
+            self._file_stages = None
+            if profiler is not None:
+                profiler.create_stats()
+                self._keep_cprofile((elapsed, filename, profiler.stats))
+
+    def _keep_cprofile(self, item):
+        if len(self.cprofiles) < self.cprofile_slowest:
+            heapq.heappush(self.cprofiles, item)
+        elif item[0] > self.cprofiles[0][0]:
+            heapq.heapreplace(self.cprofiles, item)
+
+    def get_state(self):
+        """ Return the collected data as a (picklable) dict, e.g. to send it from a worker process. """
+        return {'stages': self.stages, 'files': self.files, 'cprofiles': self.cprofiles}
+
+    def merge(self, state):
+        """ Merge collected data from another profile, see `get_state()`. """
+        for name, (count, total, max_s, bytes_in, bytes_out) in state['stages'].items():
+            totals = self.stages.setdefault(name, [0, 0.0, 0.0, 0, 0])
+            totals[0] += count
+            totals[1] += total
+            totals[2] = max(totals[2], max_s)
+            totals[3] += bytes_in
+            totals[4] += bytes_out
+        self.files.extend(state['files'])
+        for item in state['cprofiles']:
+            self._keep_cprofile(item)
+
+    def slowest_files(self, n=10):
+        return sorted(self.files, key=lambda item: item[0], reverse=True)[:n]
+
+    def to_dict(self, n_slowest=10):
+        total = sum(item[0] for item in self.files)
+        return {
+            'n_files': len(self.files),
+            'total_s': total,
+            'stages': {
+                name: {'count': count, 'total_s': total_s, 'mean_s': total_s / count if count else None,
+                       'max_s': max_s, 'bytes_in': bytes_in, 'bytes_out': bytes_out}
+                for name, (count, total_s, max_s, bytes_in, bytes_out) in self.stages.items()
+            },
+            'slowest_files': [
+                {'filename': filename, 'total_s': elapsed, 'stages': file_stages}
+                for elapsed, filename, file_stages in self.slowest_files(n_slowest)
+            ],
+        }
+
+    def summary_table(self, n_slowest=5):
+        """ Return a summary table (str) of the time spent in each stage, and the slowest files. """
+        data = self.to_dict(n_slowest=n_slowest)
+        total = data['total_s']
+        lines = [
+            f"{'Stage':<16} {'Count':>7} {'Total (s)':>10} {'%':>6} {'Mean (ms)':>10} {'Max (ms)':>9}"
+            f" {'In (kB)':>10} {'Out (kB)':>10}",
+            "-" * 84,
+        ]
+        for name, s in sorted(data['stages'].items(), key=lambda item: item[1]['total_s'], reverse=True):
+            lines.append(
+                f"{name:<16} {s['count']:>7} {s['total_s']:>10.3f} {100 * s['total_s'] / total if total else 0:>6.1f}"
+                f" {s['mean_s'] * 1e3:>10.2f} {s['max_s'] * 1e3:>9.2f}"
+                f" {s['bytes_in'] / 1e3:>10.1f} {s['bytes_out'] / 1e3:>10.1f}")
+        lines.append("-" * 84)
+        lines.append(f"{data['n_files']} files in {total:.3f} s (sum of per-file times).")
+        if data['slowest_files']:
+            lines.append("\nSlowest files:")
+            lines += [f"  {item['total_s'] * 1e3:9.2f} ms  {item['filename']}" for item in data['slowest_files']]
+        return "\n".join(lines)
+
+    def write_json(self, path, n_slowest=10):
+        with open(path, 'w', encoding='utf-8') as fd:
+            json.dump(self.to_dict(n_slowest=n_slowest), fd, indent=1)
+
+    def dump_cprofiles(self, outdir):
+        """ Write a .pstats file for each of the slowest cProfile'd files to outdir.
+
+        The files can be inspected with e.g. `python -m pstats <file>` or snakeviz.
+
+        Returns:
+            List of the written files.
+        """
+        import pstats
+        os.makedirs(outdir, exist_ok=True)
+        written = []
+        for rank, (elapsed, filename, stats) in enumerate(sorted(self.cprofiles, reverse=True), start=1):
+            holder = _StatsHolder(stats)
+            path = os.path.join(outdir, f"{rank:02}_{os.path.splitext(os.path.basename(filename))[0]}.pstats")
+            pstats.Stats(holder).dump_stats(path)
+            written.append(path)
+        return written
+
+
+class _StatsHolder:
+    """ Minimal stand-in for a cProfile.Profile, so pstats.Stats can load stats collected in another process. """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def profile_call(func, filename, *args, cprofile_slowest=0, **kwargs):
+    """ Call `func(filename, *args, **kwargs)` with a fresh BuildProfile active.
+
+    This is a module-level function, so it can be used with worker processes.
+
+    Returns:
+        (result, profile_state) 2-tuple, see `BuildProfile.get_state()` and `BuildProfile.merge()`.
+    """
+    profile = BuildProfile(cprofile_slowest=cprofile_slowest)
+    with profile.activate(), profile.file(filename):
+        result = func(filename, *args, **kwargs)
+    return result, profile.get_state()
@@ -36,23 +36,55 @@ Python-Markdown extensions: https://python-markdown.github.io/extensions/
 """
 
 import sys
-import requests
-import markdown
+import logging
+import threading
 
 from .document_io import load_document
 from .pico_utils import substitute_pico_variables
 from .templating import apply_template_file_to_document
+from .instrumentation import stage
+# The GitHub markdown backend (pooled session, disk cache, rate-limit handling):
+from .github_markdown import github_markdown, GITHUB_API_URL
 
-GITHUB_API_URL = 'https://api.github.com'
+logger = logging.getLogger(__name__)
 
+DEFAULT_MARKDOWN_EXTENSIONS = (
+    'markdown.extensions.fenced_code',
+    'markdown.extensions.attr_list',
+    'markdown.extensions.tables',
+    'markdown.extensions.sane_lists',
+    # 'markdown.extensions.toc',
+)
 
-def github_markdown(markdown, verbose=None):
-    """ Takes raw markdown, returns html result from GitHub api """
-    endpoint = GITHUB_API_URL + "/markdown/raw"
-    headers = {'content-type': 'text/plain', 'charset': 'utf-8'}
-    res = requests.post(endpoint, data=markdown.encode('utf-8'), headers=headers)
-    res.raise_for_status()
-    return res.text
+# Thread-local cache of markdown.Markdown instances, keyed by the extensions:
+_markdown_instances = threading.local()
+
+
+def get_markdown_converter(extensions=DEFAULT_MARKDOWN_EXTENSIONS):
+    """ Return a configured `markdown.Markdown` instance for the given extensions.
+
+    Creating a Markdown instance imports and registers all extensions, which for small documents takes longer than
+    the conversion itself. Instances are therefore cached and reused, keyed by the extensions.
+    The cache is thread-local, so each thread gets its own instances and concurrent rendering is safe.
+    Remember to call `.reset()` before converting a new document (as `compile_markdown_to_html()` does).
+
+    Args:
+        extensions: A list of extensions (names or markdown.Extension instances).
+
+    Returns:
+        markdown.Markdown instance.
+    """
+    key = tuple(extensions)
+    try:
+        instances = _markdown_instances.instances
+    except AttributeError:
+        instances = _markdown_instances.instances = {}
+    try:
+        return instances[key]
+    except KeyError:
+        import markdown  # Imported on first use, to keep CLI startup fast.
+        md = instances[key] = markdown.Markdown(extensions=list(extensions))
+        return md
 
 
 def compile_markdown_to_html(content, parser='python-markdown', extensions=None, template=None, template_type='jinja'):
@@ -76,15 +108,10 @@ def compile_markdown_to_html(content, parser='python-markdown', extensions=None,
         parser = 'python-markdown'
     if parser == 'python-markdown':
         if extensions is None:
-            extensions = [
-                'markdown.extensions.fenced_code',
-                'markdown.extensions.attr_list',
-                'markdown.extensions.tables',
-                'markdown.extensions.sane_lists',
-                # 'markdown.extensions.toc',
-            ]
-        print("\nExtensions:", extensions)
-        html_content = markdown.markdown(content, extensions=extensions)
+            extensions = DEFAULT_MARKDOWN_EXTENSIONS
+        logger.debug("Extensions: %s", extensions)
+        # Equivalent to `markdown.markdown(content, extensions=extensions)`, but reusing the Markdown instance:
+        html_content = get_markdown_converter(extensions).reset().convert(content)
     elif parser in ('github', 'ghmarkdown'):
         try:
             # Try to use the `ghmarkdown` package, and fall back to a primitive github api call
@@ -104,7 +131,7 @@ def compile_markdown_document(
         yfm_parsing=True, yfm_errors='ignore',
         do_pico_substitution=True, do_apply_template=True,
         template_type='jinja2', template=None, template_dir=None, default_template_name='index',
-        template_vars=None,
+        template_vars=None, template_bytecode_cache=None,
 ):
     """ Compile a single markdown file and apply template, return compiled HTML, optionally save HTML output to a file.
 
@@ -122,6 +149,8 @@ def compile_markdown_document(
         template: The template (name or filename) to apply.
         template_dir: The directory to look for, if template is a name (rather than a file).
         default_template_name: The default template (name) to apply.
+        template_vars: Additional template variables.
+        template_bytecode_cache: A directory where compiled Jinja templates are cached between runs (optional).
 
     Returns:
         HTML-compiled markdown.
@@ -139,9 +168,12 @@ def compile_markdown_document(
         # Perform %pico_variable% substitution:
         pico_vars = document.copy()
         pico_vars.update(document['fileinfo'])  # has 'dirname', 'basename', etc.
-        document['content'] = substitute_pico_variables(document['content'], template_vars=pico_vars, errors='print')
+        with stage('pico', document['content']) as st:
+            document['content'] = st.data_out = substitute_pico_variables(
+                document['content'], template_vars=pico_vars, errors='print')
 
-    html_content = compile_markdown_to_html(document['content'], parser=parser, extensions=extensions)
+    with stage('markdown', document['content']) as st:
+        html_content = st.data_out = compile_markdown_to_html(document['content'], parser=parser, extensions=extensions)
     document['html_content_raw'] = html_content
     document['html_content'] = html_content
     document['html_body'] = html_content
@@ -149,9 +181,11 @@ def compile_markdown_document(
 
     if do_apply_template:
         # apply_template_file_to_document updates document['html']
-        html = apply_template_file_to_document(
-            document, template_type=template_type, template=template, template_dir=template_dir,
-            default_template_name=default_template_name, template_vars=template_vars)
+        with stage('template', html_content) as st:
+            html = st.data_out = apply_template_file_to_document(
+                document, template_type=template_type, template=template, template_dir=template_dir,
+                default_template_name=default_template_name, template_vars=template_vars,
+                bytecode_cache_dir=template_bytecode_cache)
     else:
         html = document['html'] = html_content
 
@@ -162,8 +196,8 @@ def compile_markdown_document(
             fmt_params = document['fileinfo'].copy()
             fmt_params.update(document['meta'])
             outputfn = outputfn.format(**fmt_params)
-            with open(outputfn, mode='w', encoding='utf-8') as fd:
-                print("Writing HTML to file:", outputfn)
+            with stage('write', html), open(outputfn, mode='w', encoding='utf-8') as fd:
+                logger.debug("Writing HTML to file: %s", outputfn)
                 fd.write(html)
 
     return document
@@ -0,0 +1,546 @@
+"""
+
+Module for a persistent, on-disk index of document metadata (the parsed YAML front matter).
+
+Reading and parsing the YFM of every journal on every report run is slow for large notebooks.
+The metadata index stores the parsed YFM in a SQLite database, by default
+`<basedir>/.zepto-eln/metadata-index.sqlite`, keyed by file path, mtime and size (and optionally a content hash).
+Unchanged files are served from the index; only new or changed files are read and parsed.
+
+Usage:
+
+    >>> with MetadataIndex(basedir='.') as index:
+    ...     metadata = index.load_all_metadata()
+
+Or just `load_all_documents_metadata(basedir, use_index=True)`.
+
+Notes:
+    * The fields in INDEXED_FIELDS (status, expid, author, startdate, enddate) are also stored in separate,
+        indexed columns, so they can be queried (filtered and sorted) in SQL; see `query.query_metadata()`.
+        The values are also stored in the `field_values` table, with one row per item for list values
+        (e.g. `author: [Jane Doe, Kim Larsen]`), which is used to filter documents in SQL. Numeric values are
+        also stored in the `num` column, so they can be compared numerically, as in Python.
+    * The index only caches the YFM as parsed from the file; fileinfo is added when loading from the index.
+    * YFM parsing errors are also recorded, so files with broken YFM are not re-parsed on every run.
+    * The metadata is stored as JSON, with dates, datetimes, sets, binary values and dicts with non-string keys
+        stored as tagged JSON objects, e.g. `{"$date": "2019-08-05"}`, see `encode_meta()` and `decode_meta()`.
+        Loading an index never executes code, so index files can be shared/synced with the notebook.
+    * Long-running processes (e.g. the daemon, see `eln_daemon`) can call `keep_indexes_open()`, so the database
+        connection of each index is kept open (with a warm page cache) between uses, instead of being re-opened
+        for every command.
+
+"""
+
+import os
+import json
+import base64
+import logging
+import sqlite3
+import hashlib
+import datetime
+import threading
+import yaml
+
+from .yfm import parse_yfm_header
+from .document_io import get_fileinfo, DocumentYfmError
+from .parallel import process_map, get_worker_count
+from .scanner import scan_md_files
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIRNAME = '.zepto-eln'
+INDEX_FILENAME = 'metadata-index.sqlite'
+INDEX_SCHEMA_VERSION = 5
+NODEFAULT = object()
+# YFM fields that are stored in separate, indexed columns, so they can be queried without loading the metadata:
+INDEXED_FIELDS = ('status', 'expid', 'author', 'startdate', 'enddate')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT,
+    meta TEXT,
+    error TEXT,
+    {columns}
+);
+{indexes}
+CREATE TABLE IF NOT EXISTS field_values (
+    path TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    num REAL
+);
+CREATE INDEX IF NOT EXISTS field_values_field_value ON field_values (field, value);
+CREATE INDEX IF NOT EXISTS field_values_field_num ON field_values (field, num);
+CREATE INDEX IF NOT EXISTS field_values_path ON field_values (path);
+""".format(
+    columns=",\n    ".join(f"{field} TEXT" for field in INDEXED_FIELDS),
+    indexes="\n".join(
+        f"CREATE INDEX IF NOT EXISTS documents_{field} ON documents ({field});" for field in INDEXED_FIELDS),
+)
+
+
+def get_default_index_path(basedir='.'):
+    """ Return the default metadata index file path for the given notebook base directory. """
+    return os.path.join(basedir, INDEX_DIRNAME, INDEX_FILENAME)
+
+
+def index_value(value):
+    """ Return the value stored in an indexed column for a YFM value.
+
+    Dates and datetimes are stored as ISO 8601 strings, so they sort and compare correctly as text.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def index_number(value):
+    """ Return the value stored in the `num` column of the `field_values` table: the value, if it is a number
+    (but not a bool), otherwise None. """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return None
+
+
+def index_items(value):
+    """ Return the (value, num) rows stored in the `field_values` table for a YFM value: one per item for list
+    values. See `index_value()` and `index_number()`. """
+    items = value if isinstance(value, (list, tuple, set)) else [value]
+    return [(index_value(item), index_number(item)) for item in items if item is not None]
+
+
+def _to_json(value):
+    """ Return a JSON-serializable version of a YFM value, with tagged objects for non-JSON types. """
+    if isinstance(value, dict):
+        if all(isinstance(key, str) for key in value) and not (len(value) == 1 and next(iter(value)) in _JSON_TAGS):
+            return {key: _to_json(item) for key, item in value.items()}
+        return {'$dict': [[_to_json(key), _to_json(item)] for key, item in value.items()]}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    if isinstance(value, datetime.datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'$date': value.isoformat()}
+    if isinstance(value, (set, frozenset)):
+        return {'$set': [_to_json(item) for item in value]}
+    if isinstance(value, bytes):
+        return {'$bytes': base64.b64encode(value).decode('ascii')}
+    return value
+
+
+_JSON_TAGS = {
+    '$date': datetime.date.fromisoformat,
+    '$datetime': datetime.datetime.fromisoformat,
+    '$set': set,
+    '$bytes': base64.b64decode,
+    '$dict': dict,
+}
+
+
+def _from_json_object(obj):
+    if len(obj) == 1:
+        key, value = next(iter(obj.items()))
+        if key in _JSON_TAGS:
+            return _JSON_TAGS[key](value)
+    return obj
+
+
+def encode_meta(yfm):
+    """ Encode a metadata (YFM) value as a JSON string, for storing in the index. See `decode_meta()`.
+
+    Dates, datetimes, sets, and binary values, which are produced by `yaml.safe_load()` but can't be represented
+    in JSON, are stored as single-key tagged objects, e.g. `{"$date": "2019-08-05"}`. Dicts with non-string keys
+    (or a single key that looks like a tag) are stored as `{"$dict": [[key, value], ...]}`.
+    """
+    return json.dumps(_to_json(yfm), ensure_ascii=False, separators=(',', ':'))
+
+
+def decode_meta(meta):
+    """ Decode a JSON metadata string created by `encode_meta()`. """
+    return json.loads(meta, object_hook=_from_json_object)
+
+
+def file_content_hash(filepath):
+    """ Return sha1 hexdigest of the file's (binary) content. """
+    with open(filepath, 'rb') as fd:
+        return hashlib.sha1(fd.read()).hexdigest()
+
+
+def parse_document_yfm(filepath):
+    """ Read the YFM header of a document file and parse it, returning (yfm, error) 2-tuple.
+
+    `error` is None if the YFM was parsed successfully, otherwise it is a string describing the exception.
+    """
+    with open(filepath, 'rb') as fd:
+        try:
+            yfm, _ = parse_yfm_header(fd)
+        except (yaml.error.YAMLError, ValueError, AssertionError) as exc:
+            return None, f"{exc.__class__.__name__}: {exc}"
+    return yfm, None
+
+
+class _ConnectionPool:
+    """ Open index connections, kept for re-use after `MetadataIndex.close()`, see `keep_indexes_open()`.
+
+    Connections are keyed by the index file path and the thread (SQLite connections can only be used in the thread
+    that created them). A connection is only re-used if the index file is still the same file, i.e. it hasn't been
+    deleted or replaced since the connection was opened.
+    """
+
+    def __init__(self):
+        self.connections = {}  # {(abs index path, thread id): (connection, (st_dev, st_ino))}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(index_path):
+        return os.path.abspath(index_path), threading.get_ident()
+
+    @staticmethod
+    def _file_id(index_path):
+        try:
+            st = os.stat(index_path)
+        except OSError:
+            return None
+        return st.st_dev, st.st_ino
+
+    def get(self, index_path):
+        """ Return a kept connection for index_path (removing it from the pool), or None. """
+        with self._lock:
+            entry = self.connections.pop(self._key(index_path), None)
+        if entry is None:
+            return None
+        connection, file_id = entry
+        if self._file_id(index_path) != file_id:
+            connection.close()
+            return None
+        return connection
+
+    def put(self, index_path, connection):
+        """ Keep connection for re-use. Returns False if it can't be kept (and should just be closed). """
+        file_id = self._file_id(index_path)
+        if file_id is None:
+            return False
+        with self._lock:
+            return self.connections.setdefault(self._key(index_path), (connection, file_id))[0] is connection
+
+    def close_all(self):
+        with self._lock:
+            entries, self.connections = list(self.connections.values()), {}
+        for connection, _ in entries:
+            connection.close()
+
+
+# The pool of kept index connections, or None (the default) to close connections after use:
+_connection_pool = None
+
+
+def keep_indexes_open():
+    """ Keep index connections open after `MetadataIndex.close()`, and re-use them when the same index is opened
+    again (e.g. for the next command in the daemon), instead of re-connecting and checking the schema every time.
+
+    Returns:
+        The connection pool. Call `close_kept_indexes()` to close the kept connections.
+    """
+    global _connection_pool
+    if _connection_pool is None:
+        _connection_pool = _ConnectionPool()
+    return _connection_pool
+
+
+def close_kept_indexes():
+    """ Close all kept index connections, and stop keeping connections open. See `keep_indexes_open()`. """
+    global _connection_pool
+    pool, _connection_pool = _connection_pool, None
+    if pool is not None:
+        pool.close_all()
+
+
+class MetadataIndex:
+    """ Persistent SQLite index of document YFM metadata, keyed by path, mtime, size and (optionally) hash.
+
+    Args:
+        basedir: The notebook base directory. Index keys are file paths relative to this directory.
+        index_path: The index database file. Defaults to `<basedir>/.zepto-eln/metadata-index.sqlite`.
+        use_hash: If True, also store a sha1 hash of each file's content. If a file's mtime/size has changed
+            but the content hash is unchanged, the file is not re-parsed.
+    """
+
+    def __init__(self, basedir='.', index_path=None, use_hash=False):
+        self.basedir = basedir
+        self.index_path = index_path or get_default_index_path(basedir)
+        self.use_hash = use_hash
+        self.connection = None
+        # Stats for the latest update:
+        self.stats = {'cached': 0, 'parsed': 0, 'removed': 0}
+
+    def open(self):
+        if _connection_pool is not None:
+            self.connection = _connection_pool.get(self.index_path)
+            if self.connection is not None:
+                return self
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+        self.connection = sqlite3.connect(self.index_path)
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != INDEX_SCHEMA_VERSION:
+            # Index created by a different version of this module; just start over.
+            self.connection.execute("DROP TABLE IF EXISTS documents")
+            self.connection.execute("DROP TABLE IF EXISTS field_values")
+            self.connection.execute(f"PRAGMA user_version = {INDEX_SCHEMA_VERSION:d}")
+        self.connection.executescript(_SCHEMA)
+        return self
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.commit()
+            if _connection_pool is None or not _connection_pool.put(self.index_path, self.connection):
+                self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _key(self, filepath):
+        # Fast path for paths below basedir, e.g. from the scanner (os.path.relpath is slow):
+        prefix = os.path.join(self.basedir, '')
+        if filepath.startswith(prefix):
+            key = filepath[len(prefix):]
+            if key and os.path.normpath(key) == key:
+                return key.replace(os.sep, '/')
+        return os.path.relpath(filepath, self.basedir).replace(os.sep, '/')
+
+    def get_filepath(self, key):
+        """ Return the file path for an index key (the path relative to basedir). """
+        return os.path.join(self.basedir, key)
+
+    @staticmethod
+    def load_meta(meta):
+        """ Return the metadata (YFM) from a JSON-encoded `meta` column value. """
+        return decode_meta(meta) if meta is not None else None
+
+    def clear(self):
+        """ Remove all entries from the index. """
+        self.connection.execute("DELETE FROM documents")
+        self.connection.execute("DELETE FROM field_values")
+
+    def _get_row(self, key):
+        return self.connection.execute(
+            "SELECT mtime_ns, size, hash, meta, error FROM documents WHERE path = ?", (key,)).fetchone()
+
+    def lookup(self, filepath, stat=None, row=NODEFAULT, load_meta=True):
+        """ Return (yfm, error) from the index for the given file, or None if the entry is missing or stale.
+
+        If `load_meta` is False, the metadata is not decoded, and yfm is returned as None.
+        """
+        if stat is None:
+            stat = os.stat(filepath)
+        if row is NODEFAULT:
+            row = self._get_row(self._key(filepath))
+        if row is None:
+            return None
+        mtime_ns, size, content_hash, meta, error = row
+        if (mtime_ns, size) != (stat.st_mtime_ns, stat.st_size):
+            if not (self.use_hash and content_hash and content_hash == file_content_hash(filepath)):
+                return None
+            # Touched, but not modified; just update the stat values.
+            self.connection.execute(
+                "UPDATE documents SET mtime_ns = ?, size = ? WHERE path = ?",
+                (stat.st_mtime_ns, stat.st_size, self._key(filepath)))
+        return (decode_meta(meta) if meta is not None and load_meta else None), error
+
+    def store(self, filepath, yfm, error=None, stat=None):
+        """ Add or replace the index entry for the given file. """
+        if stat is None:
+            stat = os.stat(filepath)
+        content_hash = file_content_hash(filepath) if self.use_hash else None
+        meta = encode_meta(yfm) if yfm is not None else None
+        values = [yfm.get(field) if isinstance(yfm, dict) else None for field in INDEXED_FIELDS]
+        key = self._key(filepath)
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO documents (path, mtime_ns, size, hash, meta, error, {', '.join(INDEXED_FIELDS)})"
+            f" VALUES (?, ?, ?, ?, ?, ?{', ?' * len(INDEXED_FIELDS)})",
+            (key, stat.st_mtime_ns, stat.st_size, content_hash, meta, error, *map(index_value, values)))
+        self.connection.execute("DELETE FROM field_values WHERE path = ?", (key,))
+        self.connection.executemany(
+            "INSERT INTO field_values (path, field, value, num) VALUES (?, ?, ?, ?)",
+            [(key, field, *item) for field, value in zip(INDEXED_FIELDS, values) for item in index_items(value)])
+
+    def get_yfm(self, filepath, stat=None, row=NODEFAULT, load_meta=True):
+        """ Return (yfm, error) for the given file, from the index if up-to-date, otherwise by parsing the file. """
+        if stat is None:
+            stat = os.stat(filepath)
+        entry = self.lookup(filepath, stat=stat, row=row, load_meta=load_meta)
+        if entry is not None:
+            self.stats['cached'] += 1
+            return entry
+        yfm, error = parse_document_yfm(filepath)
+        self.store(filepath, yfm, error=error, stat=stat)
+        self.stats['parsed'] += 1
+        return yfm, error
+
+    def iter_update(self, files=None, rebuild=False, workers=None, load_meta=True):
+        """ Bring the index up-to-date with the given files, yielding the index entry for each file as it goes.
+
+        If no files are given, all Markdown files in basedir are used,
+        and entries for files that no longer exist are removed (once all files have been processed).
+
+        Args:
+            files: The files to update the index for.
+            rebuild: Discard all existing entries and re-parse all files.
+            workers: Parse new/changed files using a pool of this many worker processes,
+                see `parallel.get_worker_count()`.
+            load_meta: If False, metadata for unchanged files is not decoded (yielded as None),
+                which is faster if the caller only needs the index to be up-to-date.
+
+        Yields:
+            (filepath, yfm, error) 3-tuples, one for each file, in the same order as files.
+        """
+        prune = files is None
+        if files is None:
+            # The scanner gives us the stat results, so we don't have to stat each file again:
+            files_stats = scan_md_files(self.basedir)
+        else:
+            files_stats = ((fn, None) for fn in files)
+        self.stats = {'cached': 0, 'parsed': 0, 'removed': 0}
+        if rebuild:
+            self.clear()
+        # Fetch all rows in one go; much faster than one query per file.
+        rows = {row[0]: row[1:] for row in self.connection.execute(
+            "SELECT path, mtime_ns, size, hash, meta, error FROM documents")}
+        try:
+            if get_worker_count(workers) == 1:
+                for fn, stat in files_stats:
+                    yield (fn, *self.get_yfm(fn, stat=stat, row=rows.pop(self._key(fn), None), load_meta=load_meta))
+            else:
+                # Look up all files first, then parse the new/changed files in a process pool.
+                files_stats = list(files_stats)
+                files = [fn for fn, stat in files_stats]
+                entries = [self.lookup(fn, stat=stat, row=rows.pop(self._key(fn), None), load_meta=load_meta)
+                           for fn, stat in files_stats]
+                changed = [fn for fn, entry in zip(files, entries) if entry is None]
+                parsed = process_map(parse_document_yfm, changed, workers=workers)
+                for fn, entry in zip(files, entries):
+                    if entry is None:
+                        entry = next(parsed)
+                        self.store(fn, *entry)
+                        self.stats['parsed'] += 1
+                    else:
+                        self.stats['cached'] += 1
+                    yield (fn, *entry)
+            if prune:
+                self.connection.executemany("DELETE FROM documents WHERE path = ?", [(key,) for key in rows])
+                self.connection.executemany("DELETE FROM field_values WHERE path = ?", [(key,) for key in rows])
+                self.stats['removed'] = len(rows)
+        finally:
+            self.connection.commit()
+
+    def update(self, files=None, rebuild=False, workers=None):
+        """ Bring the index up-to-date with the given files (default: all Markdown files in basedir).
+
+        Args:
+            See `iter_update()`.
+
+        Returns:
+            List of (filepath, yfm, error) 3-tuples, one for each file.
+        """
+        return list(self.iter_update(files=files, rebuild=rebuild, workers=workers))
+
+    def refresh(self, files=None, rebuild=False, workers=None):
+        """ Bring the index up-to-date, without loading the metadata. See `iter_update()`.
+
+        Returns:
+            The update stats dict, with the number of 'cached', 'parsed', and 'removed' files.
+        """
+        for _ in self.iter_update(files=files, rebuild=rebuild, workers=workers, load_meta=False):
+            pass
+        return self.stats
+
+    def verify(self):
+        """ Check all index entries against the files on disk (without modifying the index).
+
+        Returns:
+            dict with lists of file paths (keys relative to basedir) that are 'ok', 'stale' (file has changed),
+            'mismatched' (file is unchanged but the indexed YFM differs from the file), and 'missing' (file deleted).
+        """
+        report = {'ok': [], 'stale': [], 'mismatched': [], 'missing': []}
+        for key, mtime_ns, size, meta, error in self.connection.execute(
+                "SELECT path, mtime_ns, size, meta, error FROM documents ORDER BY path"):
+            filepath = self.get_filepath(key)
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                report['missing'].append(key)
+                continue
+            if (mtime_ns, size) != (stat.st_mtime_ns, stat.st_size):
+                report['stale'].append(key)
+                continue
+            yfm, parse_error = parse_document_yfm(filepath)
+            if (yfm, parse_error) != (self.load_meta(meta), error):
+                report['mismatched'].append(key)
+            else:
+                report['ok'].append(key)
+        return report
+
+    def iter_metadata(self, files=None, add_fileinfo_to_meta=True, yfm_errors='skip-file',
+                      exclude_if_missing_yfm=True, workers=None):
+        """ Update the index and yield metadata dicts, similar to `document_io.iter_metadata()`.
+
+        Args:
+            files: The files to load metadata for (default: all Markdown files in basedir).
+            add_fileinfo_to_meta: Whether to add fileinfo (e.g. filename, directory, etc).
+            yfm_errors: What to do with files with YFM errors, e.g. 'skip-file', 'raise', 'warn', or 'ignore'.
+            exclude_if_missing_yfm: Exclude files without YFM metadata.
+            workers: Parse new/changed files using a pool of this many worker processes.
+
+        Yields:
+            Metadata dicts.
+        """
+        for filepath, yfm, error in self.iter_update(files=files, workers=workers):
+            if error is not None:
+                if yfm_errors == 'skip-file':
+                    continue
+                if 'warn' in yfm_errors or 'report' in yfm_errors:
+                    logger.warning("%s while parsing YFM of file %s.", error, filepath)
+                if 'raise' in yfm_errors:
+                    raise DocumentYfmError(msg="", file=filepath, causing_exception=error)
+            if yfm is None:
+                if exclude_if_missing_yfm:
+                    continue
+            elif add_fileinfo_to_meta:
+                yfm.update(get_fileinfo(filepath))
+            yield yfm
+
+    def load_all_metadata(self, files=None, add_fileinfo_to_meta=True, yfm_errors='skip-file',
+                          exclude_if_missing_yfm=True, workers=None):
+        """ Update the index and return a list of metadata dicts, see `iter_metadata()`. """
+        return list(self.iter_metadata(
+            files=files, add_fileinfo_to_meta=add_fileinfo_to_meta, yfm_errors=yfm_errors,
+            exclude_if_missing_yfm=exclude_if_missing_yfm, workers=workers))
+
+
+def update_metadata_index(basedir='.', rebuild=False, verify=False, use_hash=False, workers=None):
+    """ Update (or rebuild/verify) the persistent metadata index for the journals in basedir. """
+    with MetadataIndex(basedir=basedir, use_hash=use_hash) as index:
+        if verify:
+            report = index.verify()
+            for key in ('stale', 'mismatched', 'missing'):
+                for path in report[key]:
+                    print(f"{key.upper():>10}: {path}")
+            print(", ".join(f"{len(paths)} {key}" for key, paths in report.items()))
+            if report['mismatched']:
+                logger.warning("The index is inconsistent with the files on disk; "
+                               "run with --rebuild to rebuild the index.")
+            return report
+        index.update(rebuild=rebuild, workers=workers)
+        logger.info("Metadata index %r updated: %s",
+                    index.index_path, ", ".join(f"{n} {key}" for key, n in index.stats.items()))
+        return index.stats
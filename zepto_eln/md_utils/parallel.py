@@ -0,0 +1,117 @@
+"""
+
+Module with helpers for running document processing functions in parallel over a process (or thread) pool.
+
+"""
+
+import os
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Chunksize used by process_map() when the number of items is not known in advance:
+DEFAULT_CHUNKSIZE = 16
+
+
+def get_worker_count(workers=None):
+    """ Return the number of worker processes to use.
+
+    Args:
+        workers: None or 1 for serial processing (no process pool), 0 to use all CPU cores, or the number of workers.
+    """
+    if workers is None:
+        return 1
+    if workers == 0:
+        return os.cpu_count() or 1
+    if workers < 0:
+        raise ValueError(f"workers={workers!r} - must be a non-negative integer or None.")
+    return workers
+
+
+def get_chunksize(n_items, workers, chunks_per_worker=4, max_chunksize=64):
+    """ Return a reasonable chunksize for submitting `n_items` to `workers` processes.
+
+    Items are submitted in chunks to reduce inter-process overhead, but we still want a few chunks per worker,
+    so a single slow chunk doesn't leave the other workers idle at the end.
+    """
+    return max(1, min(max_chunksize, n_items // (workers * chunks_per_worker)))
+
+
+def _apply_chunk(func, chunk):
+    return [func(item) for item in chunk]
+
+
+def _iter_chunks(items, chunksize):
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _bounded_map(executor, func, items, chunksize, max_pending):
+    """ Submit chunks of items to executor, with at most `max_pending` chunks in flight, yielding results in order.
+
+    Items are only consumed from the iterable as results are consumed, so results can be streamed, and the caller
+    can stop early. The executor is shut down (and chunks not yet started are cancelled) when the generator is
+    exhausted or closed.
+    """
+    pending = deque()
+    try:
+        for chunk in _iter_chunks(items, chunksize):
+            pending.append(executor.submit(_apply_chunk, func, chunk))
+            while len(pending) >= max_pending or (pending and pending[0].done()):
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def process_map(func, items, workers=None, chunksize=None):
+    """ Like `map(func, items)`, but using a process pool if `workers` > 1.
+
+    Results are yielded in the same order as items, regardless of the order in which they are completed.
+    Exceptions raised by func are re-raised in the calling process when the corresponding result is reached.
+    Only a bounded number of chunks (2 per worker) are submitted at a time, so items are consumed lazily,
+    results are yielded as they become available, and closing the generator cancels the remaining work.
+
+    Args:
+        func: The function to apply to each item. Must be picklable (i.e. a module-level function or a
+            functools.partial of one) if workers > 1.
+        items: The items to process.
+        workers: Number of worker processes, see `get_worker_count()`.
+        chunksize: The number of items to submit to each worker at a time (default: see `get_chunksize()`,
+            or DEFAULT_CHUNKSIZE if the number of items is not known, e.g. for a generator).
+
+    Returns:
+        Generator of results.
+    """
+    workers = get_worker_count(workers)
+    if workers == 1:
+        yield from map(func, items)
+        return
+    if hasattr(items, '__len__'):
+        if not items:
+            return
+        workers = min(workers, len(items))
+        if chunksize is None:
+            chunksize = get_chunksize(len(items), workers)
+    elif chunksize is None:
+        chunksize = DEFAULT_CHUNKSIZE
+    # Imported here, since importing multiprocessing adds noticeably to the startup time of the CLI commands:
+    from concurrent.futures import ProcessPoolExecutor
+    yield from _bounded_map(ProcessPoolExecutor(max_workers=workers), func, items, chunksize, 2 * workers)
+
+
+def thread_map(func, items, workers=None):
+    """ Like `process_map()`, but using a thread pool. Useful for I/O-bound functions, e.g. web API calls.
+
+    Results are yielded in the same order as items.
+    """
+    workers = get_worker_count(workers)
+    if workers == 1:
+        yield from map(func, items)
+        return
+    yield from _bounded_map(ThreadPoolExecutor(max_workers=workers), func, items, 1, 2 * workers)
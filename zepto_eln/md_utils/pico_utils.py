@@ -7,17 +7,19 @@ Module for dealing with `Pico` markdown stuff, mostly just %variable% substituti
 """
 
 import re
+import logging
+import functools
 from collections import defaultdict
 
+logger = logging.getLogger(__name__)
+
 NODEFAULT = object()
 
 
 def pico_find_variable_placeholders(content, pat=r"%[\w\.]+%"):
     if isinstance(pat, str):
         pat = re.compile(pat)
-    print("type(content):", type(content))
     res = pat.findall(content)
-    print("type(res):", type(res))
     return set(res)  # Set to remove duplicates
 
 
@@ -57,36 +59,96 @@ def get_attrs_string_value(dct, attrs, default=NODEFAULT):
         return val
 
 
-def substitute_pico_variables(content, template_vars, errors='pass', varfmt="{sub}"):
-    """ Perform Pico-style %variable% substitution. """
+# Single-pass substitution regex. Code blocks and code spans are matched first, so placeholders inside code
+# are left alone. Use `%%variable%%` to write a literal `%variable%` outside of code.
+PICO_SUBSTITUTION_REGEX = re.compile(
+    r"(?P<fence>^[ \t]*(?P<fchar>`{3,}|~{3,})[^\n]*\n.*?(?:^[ \t]*(?P=fchar)[`~]*[ \t]*$|\Z))"  # Fenced code block
+    r"|(?P<code>(?P<ticks>`+)[^\n]+?(?P=ticks))"  # Inline code span
+    r"|%%(?P<escaped>[\w\.]+)%%"  # Escaped placeholder
+    r"|%(?P<var>[\w\.]+)%",  # Placeholder
+    re.MULTILINE | re.DOTALL)
+# Same as above, but without skipping code:
+PICO_SUBSTITUTION_REGEX_NO_CODE_SKIP = re.compile(r"%%(?P<escaped>[\w\.]+)%%|%(?P<var>[\w\.]+)%")
+
+
+@functools.lru_cache(maxsize=1024)
+def get_attrs_path(attrs):
+    """ Split an attribute string 'attr0.attr1.attr2' into a tuple of keys (cached per attribute string). """
+    return tuple(attrs.split('.'))
+
+
+def get_attrs_path_value(obj, keys):
+    """ Non-recursive version of `get_attrs_string_value()`, taking a tuple of keys, e.g. from `get_attrs_path()`.
+
+    Raises:
+        KeyError, if a key is not found.
+    """
+    for key in keys:
+        try:
+            obj = obj[key]
+        except TypeError:
+            obj = getattr(obj, key)
+    return obj
+
+
+def substitute_pico_variables(content, template_vars, errors='pass', varfmt="{sub}", skip_code=True):
+    """ Perform Pico-style %variable% substitution.
+
+    All placeholders are substituted in a single pass over the content, and each distinct placeholder is only
+    looked up once, so the substitution runs in linear time, even for large documents with many placeholders.
+
+    Args:
+        content: The (markdown) text to perform substitution in.
+        template_vars: The variables (dict), e.g. with a 'meta' entry, so %meta.title% gives meta['title'].
+        errors: What to do if a variable cannot be found: 'raise', 'print' (log a warning), or 'pass'.
+            Placeholders for variables that are not found are left as-is.
+        varfmt: The format string used to insert the variable value into the content,
+            or a dict with format string for each variable name.
+        skip_code: Do not substitute placeholders inside fenced code blocks and inline code spans.
+
+    Returns:
+        The content, with placeholders substituted.
+
+    Notes:
+        `%%variable%%` can be used to write a literal `%variable%` in the text, outside of code.
+    """
     # variable members are available as %variable.attribute%
-    # Two approaches:
-    #   a. Extract variables from document and substitute them. [we use this one]
-    #   b. Generate all possible variable placeholder strings and do str.replace(placeholder, value).
-    placeholders = pico_find_variable_placeholders(content)
     if isinstance(varfmt, str):
         _varfmt = varfmt
         varfmt = defaultdict(lambda: _varfmt)
-    for placeholder in placeholders:
+    if errors not in ('raise', 'print', 'pass'):
+        raise ValueError(f"Value {errors!r} for parameter `errors` not recognized.")
+    substitutions = {}  # Cache of placeholder substitutions, so each placeholder is only looked up once.
+
+    def substitute(match):
+        varname = match.group('var')
+        if varname is None:
+            escaped = match.group('escaped')
+            return match.group(0) if escaped is None else f"%{escaped}%"
+        try:
+            return substitutions[varname]
+        except KeyError:
+            pass
+        placeholder = match.group(0)
         # Note: We probably shouldn't do replacements inside comments, but whatever.
-        varname = placeholder.strip('%')
         try:
-            sub = get_attrs_string_value(template_vars, varname)
-        except KeyError as exc:
+            sub = get_attrs_path_value(template_vars, get_attrs_path(varname))
+        except (LookupError, AttributeError) as exc:
             # E.g. if you have a comment explaining %meta.variable%:
             if errors == 'raise':
                 raise exc
             elif errors == 'print':
-                print(f"{exc.__class__.__name__}: {exc}")
-            elif errors == 'pass':
-                pass
-            else:
-                raise ValueError(f"Value {errors!r} for parameter `errors` not recognized.")
+                logger.warning("%s: %s (placeholder %r)", exc.__class__.__name__, exc, placeholder)
+            replacement = placeholder
         else:
-            print(f"Replacing {placeholder!r} -> {sub!r}")
+            logger.debug("Replacing %r -> %r", placeholder, sub)
             # sub can be e.g. lists or dicts; the format string can be customized for each variable.
-            content = content.replace(placeholder, varfmt[varname].format(sub, var=sub, sub=sub))
-    return content
+            replacement = varfmt[varname].format(sub, var=sub, sub=sub)
+        substitutions[varname] = replacement
+        return replacement
+
+    regex = PICO_SUBSTITUTION_REGEX if skip_code else PICO_SUBSTITUTION_REGEX_NO_CODE_SKIP
+    return regex.sub(substitute, content)
 
 
 def document_substitute_pico_vars(document):
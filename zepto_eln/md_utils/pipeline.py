@@ -0,0 +1,518 @@
+"""
+
+Module for streaming documents through a pipeline of processing stages, connected by bounded queues.
+
+A `Pipeline` takes a source (an iterable, e.g. a generator of file paths) and a list of `Stage`s.
+Each stage applies a function to one item at a time, and runs in its own thread, reading items from the previous
+stage's output queue and putting its results in its own output queue. All queues are bounded, so a fast stage
+blocks when the next stage falls behind (backpressure), and the number of items in flight (and thus the peak
+memory use) is bounded by the queue sizes and worker counts, regardless of how many documents are processed.
+
+Each stage has its own executor:
+
+* 'inline':  Call the function in the stage's thread (the default). Good for cheap stages.
+* 'thread':  Call the function in a pool of worker threads. Good for I/O-bound stages (e.g. reading, writing, or
+    GitHub API calls), or for functions that release the GIL.
+* 'process': Call the function in a pool of worker processes. Good for CPU-bound stages, e.g. markdown conversion.
+    The function must be picklable (a module-level function, or a functools.partial of one), as must the items.
+
+Items are yielded in the same order as they come from the source, regardless of the executors.
+A stage function can drop an item by returning None (e.g. a filter stage).
+
+The standard stages for converting markdown documents to HTML are provided as module-level functions:
+`load_stage`, `pico_stage`, `markdown_stage`, `template_stage`, and `write_stage`, and `markdown_pipeline()`
+puts them together. By default, the markdown conversion and the template are done in a single 'render' stage
+(`render_stage`), so each document is only sent to and from a worker process once. Custom stages can be inserted
+anywhere, e.g. a link rewriter before the template is applied (which needs separate 'markdown' and 'template'
+stages):
+
+    >>> pipeline = markdown_pipeline('.', template_dir='templates', executor='process', workers=4, fuse_render=False)
+    >>> pipeline.insert_stage(Stage(rewrite_md_links, name='links'), before='template')
+    >>> pipeline.run()
+
+"""
+
+import os
+import re
+import time
+import queue
+import logging
+import threading
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .document_io import iter_md_files, load_document
+from .pico_utils import substitute_pico_variables
+from .markdown_compilation import compile_markdown_to_html
+from .templating import apply_template_file_to_document
+from .parallel import get_worker_count
+from .instrumentation import stage
+
+logger = logging.getLogger(__name__)
+
+EXECUTORS = ('inline', 'thread', 'process')
+DEFAULT_QUEUE_SIZE = 16
+# How often (seconds) blocked queue operations check whether the pipeline has been stopped:
+_POLL_INTERVAL = 0.1
+_END = object()
+
+
+class PipelineStopped(Exception):
+    """ Raised inside the stage threads when the pipeline is stopped, e.g. because the consumer stopped iterating. """
+
+
+class _Failure:
+    """ Passed downstream in place of an item, when a stage fails (with errors='raise'). """
+    __slots__ = ('exc', 'stage_name')
+
+    def __init__(self, exc, stage_name):
+        self.exc = exc
+        self.stage_name = stage_name
+
+
+def _describe(item):
+    """ Return a short description of an item, for log messages. """
+    if isinstance(item, dict) and 'filename' in item:
+        return repr(item['filename'])
+    text = repr(item)
+    return text if len(text) < 100 else text[:97] + "..."
+
+
+def _apply_chunk(func, items, errors='raise'):
+    """ Apply func to each item in a chunk of items (in a worker thread or process).
+
+    Returns:
+        List of (ok, result) 2-tuples, where result is the error message (str) if ok is False.
+    """
+    results = []
+    for item in items:
+        try:
+            results.append((True, func(item)))
+        except Exception as exc:
+            if errors == 'raise':
+                raise
+            results.append((False, f"{exc.__class__.__name__}: {exc} (item: {_describe(item)})"))
+    return results
+
+
+def _chunks(items, chunksize):
+    """ Yield lists of up to chunksize items. """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Stage:
+    """ A pipeline stage, applying `func` to each item.
+
+    Args:
+        func: The function to apply to each item. It should return the processed item, or None to drop the item.
+        name: The stage name (default: the function's name). Stage names must be unique within a pipeline.
+        executor: Where to call the function: 'inline', 'thread', or 'process', see module docstring.
+        workers: The number of worker threads/processes for the 'thread' and 'process' executors
+            (0 = one per CPU core, None = 1).
+        chunksize: The number of items submitted to a worker at a time (larger chunks reduce the inter-process
+            overhead for cheap functions, at the cost of more items in flight).
+        queue_size: The size of this stage's output queue (default: the pipeline's queue_size).
+        errors: What to do if func raises an exception: 'raise' (stop the pipeline and re-raise the exception
+            to the consumer), or 'log' (log the error and drop the item).
+    """
+
+    def __init__(self, func, name=None, executor='inline', workers=None, chunksize=1, queue_size=None,
+                 errors='raise'):
+        if executor not in EXECUTORS:
+            raise ValueError(f"executor={executor!r} - must be one of {EXECUTORS}.")
+        if errors not in ('raise', 'log'):
+            raise ValueError(f"errors={errors!r} - must be 'raise' or 'log'.")
+        self.func = func
+        self.name = name or getattr(func, '__name__', None) or getattr(
+            getattr(func, 'func', None), '__name__', func.__class__.__name__)
+        self.executor = executor
+        self.workers = get_worker_count(workers)
+        self.chunksize = chunksize
+        self.queue_size = queue_size
+        self.errors = errors
+
+    def __repr__(self):
+        return f"Stage({self.name!r}, executor={self.executor!r}, workers={self.workers})"
+
+    def max_in_flight(self):
+        """ The maximum number of items being processed by this stage at any time. """
+        if self.executor == 'inline':
+            return 1
+        return 2 * self.workers * self.chunksize
+
+    def iter_results(self, items, stop):
+        """ Apply func to items, yielding (ok, result) 2-tuples in order. """
+        if self.executor == 'inline':
+            for item in items:
+                yield from _apply_chunk(self.func, [item], self.errors)
+            return
+        if self.executor == 'process':
+            # Imported here, since importing multiprocessing adds noticeably to the startup time of the CLI commands:
+            from concurrent.futures import ProcessPoolExecutor as executor_cls
+        else:
+            executor_cls = ThreadPoolExecutor
+        executor = executor_cls(max_workers=self.workers)
+        # Only a bounded number of chunks are submitted at a time, so the pool doesn't consume the whole input:
+        pending = deque()
+        try:
+            for chunk in _chunks(items, self.chunksize):
+                pending.append(executor.submit(_apply_chunk, self.func, chunk, self.errors))
+                while len(pending) >= 2 * self.workers or (pending and pending[0].done()):
+                    yield from pending.popleft().result()
+                if stop.is_set():
+                    return
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+class Pipeline:
+    """ Stream items from a source through a sequence of stages, see module docstring.
+
+    Iterate over the pipeline to get the output items, or use `run()` to just process all items.
+    A pipeline can be run more than once, if the source can be iterated more than once.
+
+    Args:
+        source: An iterable of items, e.g. a generator of file paths.
+        stages: A list of `Stage`s (or functions, which are wrapped in inline stages).
+        queue_size: The default maximum number of items in each queue between stages.
+
+    Attributes:
+        stats: Dict with {stage name: {'in': n, 'out': n, 'errors': n, 'wait_in_s': s, 'wait_out_s': s}} from the
+            last run. wait_in_s is the time the stage spent waiting for input (i.e. the previous stages are slower),
+            and wait_out_s the time spent waiting for the next stage to accept the output (backpressure).
+    """
+
+    def __init__(self, source, stages=(), queue_size=DEFAULT_QUEUE_SIZE):
+        self.source = source
+        self.queue_size = queue_size
+        self.stages = []
+        self.stats = {}
+        for st in stages:
+            self.add_stage(st)
+
+    def __repr__(self):
+        return f"Pipeline({' -> '.join(st.name for st in self.stages)})"
+
+    def _make_stage(self, st, **kwargs):
+        st = st if isinstance(st, Stage) else Stage(st, **kwargs)
+        if st.name in self.stage_names():
+            raise ValueError(f"The pipeline already has a stage named {st.name!r}.")
+        return st
+
+    def stage_names(self):
+        return [st.name for st in self.stages]
+
+    def get_stage(self, name):
+        """ Return the stage with the given name. """
+        try:
+            return self.stages[self.stage_names().index(name)]
+        except ValueError:
+            raise KeyError(f"No stage named {name!r} in {self!r}.") from None
+
+    def add_stage(self, st, **kwargs):
+        """ Append a stage (or a function, with kwargs passed to `Stage`) to the pipeline. Returns the pipeline. """
+        self.stages.append(self._make_stage(st, **kwargs))
+        return self
+
+    def insert_stage(self, st, before=None, after=None, **kwargs):
+        """ Insert a stage before or after the stage with the given name. Returns the pipeline. """
+        if (before is None) == (after is None):
+            raise ValueError("Specify exactly one of `before` or `after`.")
+        index = self.stages.index(self.get_stage(before if before is not None else after))
+        self.stages.insert(index if before is not None else index + 1, self._make_stage(st, **kwargs))
+        return self
+
+    def replace_stage(self, name, st, **kwargs):
+        """ Replace the stage with the given name. Returns the pipeline. """
+        index = self.stages.index(self.get_stage(name))
+        del self.stages[index]
+        self.stages.insert(index, self._make_stage(st, **kwargs))
+        return self
+
+    def remove_stage(self, name):
+        """ Remove the stage with the given name. Returns the pipeline. """
+        self.stages.remove(self.get_stage(name))
+        return self
+
+    def max_in_flight(self):
+        """ The maximum number of items held by the pipeline at any time (in queues or being processed). """
+        return sum((st.queue_size or self.queue_size) + st.max_in_flight() for st in self.stages) + self.queue_size
+
+    @staticmethod
+    def _put(q, item, stop):
+        """ Put item in queue q, blocking while the queue is full, unless the pipeline is stopped. """
+        while True:
+            if stop.is_set():
+                raise PipelineStopped()
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+                return
+            except queue.Full:
+                pass
+
+    @staticmethod
+    def _iter_queue(q, stop):
+        """ Yield items from queue q until the end marker; re-raise upstream failures. """
+        while True:
+            if stop.is_set():
+                raise PipelineStopped()
+            try:
+                item = q.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                continue
+            if item is _END:
+                return
+            if isinstance(item, _Failure):
+                raise item.exc
+            yield item
+
+    def _feed(self, out_queue, stop):
+        """ Thread target: Put the source items in the first queue. """
+        try:
+            for item in self.source:
+                self._put(out_queue, item, stop)
+        except PipelineStopped:
+            return
+        except BaseException as exc:
+            self._put_failure(out_queue, exc, 'source', stop)
+            return
+        self._put_end(out_queue, stop)
+
+    def _run_stage(self, st, in_queue, out_queue, stop):
+        """ Thread target: Apply a stage to the items from in_queue, putting the results in out_queue. """
+        stats = self.stats[st.name]
+
+        def counted(items):
+            """ Count the input items, and the time spent waiting for them. """
+            items = iter(items)
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                finally:
+                    stats['wait_in_s'] += time.perf_counter() - start
+                stats['in'] += 1
+                yield item
+
+        try:
+            for ok, result in st.iter_results(counted(self._iter_queue(in_queue, stop)), stop):
+                if not ok:
+                    stats['errors'] += 1
+                    logger.error("Stage %r: %s", st.name, result)
+                elif result is not None:
+                    stats['out'] += 1
+                    start = time.perf_counter()
+                    self._put(out_queue, result, stop)
+                    stats['wait_out_s'] += time.perf_counter() - start
+        except PipelineStopped:
+            return
+        except BaseException as exc:
+            self._put_failure(out_queue, exc, st.name, stop)
+            return
+        self._put_end(out_queue, stop)
+
+    def _put_failure(self, out_queue, exc, stage_name, stop):
+        try:
+            self._put(out_queue, _Failure(exc, stage_name), stop)
+        except PipelineStopped:
+            pass
+
+    def _put_end(self, out_queue, stop):
+        try:
+            self._put(out_queue, _END, stop)
+        except PipelineStopped:
+            pass
+
+    def __iter__(self):
+        """ Run the pipeline, yielding the output items of the last stage. """
+        self.stats = {
+            st.name: {'in': 0, 'out': 0, 'errors': 0, 'wait_in_s': 0.0, 'wait_out_s': 0.0} for st in self.stages}
+        stop = threading.Event()
+        queues = [queue.Queue(maxsize=self.queue_size)]
+        queues += [queue.Queue(maxsize=st.queue_size or self.queue_size) for st in self.stages]
+        threads = [threading.Thread(target=self._feed, args=(queues[0], stop), name="pipeline-source", daemon=True)]
+        threads += [
+            threading.Thread(target=self._run_stage, args=(st, queues[i], queues[i + 1], stop),
+                             name=f"pipeline-{st.name}", daemon=True)
+            for i, st in enumerate(self.stages)]
+        for thread in threads:
+            thread.start()
+        try:
+            yield from self._iter_queue(queues[-1], stop)
+        finally:
+            # Stop all stages (if we're finishing early, e.g. due to an error or the consumer breaking the loop):
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    def run(self):
+        """ Run the pipeline, discarding the output items.
+
+        Returns:
+            The number of output items.
+        """
+        n = 0
+        for _ in self:
+            n += 1
+        return n
+
+
+# Standard stages for markdown documents.
+# These are module-level functions (use functools.partial to set options), so they can run in worker processes.
+
+def load_stage(path, yfm_errors='raise', **kwargs):
+    """ Load the document file at path, see `document_io.load_document()`. """
+    return load_document(path, yfm_errors=yfm_errors, meta_if_no_yfm={}, **kwargs)
+
+
+def pico_stage(document):
+    """ Perform %pico_variable% substitution on the document's markdown content. """
+    pico_vars = document.copy()
+    pico_vars.update(document['fileinfo'])  # has 'dirname', 'basename', etc.
+    with stage('pico', document['content']) as st:
+        document['content'] = st.data_out = substitute_pico_variables(
+            document['content'], template_vars=pico_vars, errors='print')
+    return document
+
+
+def markdown_stage(document, parser='python-markdown', extensions=None):
+    """ Convert the document's markdown content to HTML, see `markdown_compilation.compile_markdown_to_html()`. """
+    with stage('markdown', document['content']) as st:
+        html_content = st.data_out = compile_markdown_to_html(document['content'], parser=parser, extensions=extensions)
+    document['html_content_raw'] = html_content
+    document['html_content'] = html_content
+    document['html_body'] = html_content
+    document['content'] = html_content
+    document['html'] = html_content  # Replaced by template_stage, if used.
+    return document
+
+
+def template_stage(document, template_type='jinja2', template=None, template_dir=None, default_template_name='index',
+                   template_vars=None, bytecode_cache_dir=None):
+    """ Apply a template to the document, see `templating.apply_template_file_to_document()`. """
+    with stage('template', document['content']) as st:
+        st.data_out = apply_template_file_to_document(
+            document, template_type=template_type, template=template, template_dir=template_dir,
+            default_template_name=default_template_name, template_vars=dict(template_vars or {}),
+            bytecode_cache_dir=bytecode_cache_dir)
+    return document
+
+
+def render_stage(document, markdown_kwargs=None, template_kwargs=None):
+    """ Convert the document's markdown content to HTML and apply a template, i.e. `markdown_stage()` followed by
+    `template_stage()` as a single stage.
+
+    Args:
+        document: The document dict.
+        markdown_kwargs: Keyword arguments for `markdown_stage()`.
+        template_kwargs: Keyword arguments for `template_stage()`. If None, no template is applied.
+    """
+    document = markdown_stage(document, **(markdown_kwargs or {}))
+    if template_kwargs is not None:
+        document = template_stage(document, **template_kwargs)
+    return document
+
+
+def write_stage(document, outputfn="{filepath_noext}.html"):
+    """ Write the document's HTML to outputfn (formatted with the document's fileinfo and metadata).
+
+    Returns:
+        The output filename (rather than the document, so the HTML can be garbage-collected straight away).
+    """
+    fmt_params = document['fileinfo'].copy()
+    fmt_params.update(document['meta'] or {})
+    outputfn = outputfn.format(**fmt_params)
+    dirname = os.path.dirname(outputfn)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    with stage('write', document['html']), open(outputfn, mode='w', encoding='utf-8') as fd:
+        fd.write(document['html'])
+    return outputfn
+
+
+_MD_LINK_REGEX = re.compile(r"""(\bhref\s*=\s*["'])(?![a-zA-Z][a-zA-Z0-9+.-]*:|/)([^"'#?]*)\.md([#?][^"']*)?(["'])""")
+
+
+def rewrite_md_links(document):
+    """ Example custom stage: Rewrite relative links to other markdown documents (`href="RS123.md"`) in the
+    document's compiled HTML, so they point to the corresponding HTML files (`href="RS123.html"`).
+
+    Insert after the 'markdown' stage and before the 'template' stage (see `markdown_pipeline(fuse_render=False)`),
+    or after the 'render' stage if no template is applied.
+    """
+    document['content'] = document['html_content'] = document['html'] = _MD_LINK_REGEX.sub(
+        r"\1\2.html\3\4", document['content'])
+    return document
+
+
+def markdown_pipeline(
+        basedir='.', outputfn="{filepath_noext}.html", source=None,
+        parser='python-markdown', extensions=None, do_pico_substitution=True,
+        do_apply_template=True, template_type='jinja2', template=None, template_dir=None,
+        default_template_name='index', template_vars=None, template_bytecode_cache=None,
+        executor='process', workers=0, chunksize=4, queue_size=DEFAULT_QUEUE_SIZE, errors='log', fuse_render=True,
+):
+    """ Create a pipeline that converts all markdown documents in basedir to HTML, like `compile_markdown_document()`.
+
+    The pipeline has the stages 'load', 'pico', 'render', and 'write' (the pico stage is left out if disabled).
+    The CPU-bound 'render' stage (markdown conversion and template) uses the given executor and workers;
+    the I/O-bound 'load' and 'write' stages use a small thread pool, and the 'pico' stage runs inline.
+    With fuse_render=False, the 'render' stage is split into separate 'markdown' and 'template' stages
+    (the template stage is left out if disabled), e.g. to insert a stage between them.
+    The pipeline yields the output filenames.
+
+    Args:
+        basedir: The directory to find markdown files in (recursively).
+        outputfn: The output filename (format string, e.g. "{filepath_noext}.html"), see `write_stage()`.
+        source: An iterable of markdown file paths (default: all markdown files in basedir).
+        parser, extensions: See `compile_markdown_to_html()`.
+        do_pico_substitution: Do Pico substitutions on the Markdown before compiling Markdown to HTML.
+        do_apply_template: Apply a (Jinja) template, see `apply_template_file_to_document()` for the other
+            template_* arguments.
+        executor: The executor for the CPU-bound stages ('inline', 'thread', or 'process').
+        workers: The number of workers for the CPU-bound stages (0 = one per CPU core).
+        chunksize: The number of documents submitted to a worker at a time.
+        queue_size: The maximum number of documents in each queue between stages.
+        errors: 'log' (log errors and skip the document) or 'raise' (stop at the first error).
+        fuse_render: Convert markdown and apply the template in a single 'render' stage (the default), rather than
+            in separate 'markdown' and 'template' stages. The fused stage avoids a queue hop, and for the 'process'
+            executor, sending each document to and from a worker process twice.
+
+    Returns:
+        Pipeline.
+    """
+    if source is None:
+        source = iter_md_files(basedir)
+    io_workers = min(4, get_worker_count(0))
+    stages = [Stage(load_stage, name='load', executor='thread', workers=io_workers, errors=errors)]
+    if do_pico_substitution:
+        stages.append(Stage(pico_stage, name='pico', errors=errors))
+    cpu_options = dict(executor=executor, workers=workers, chunksize=chunksize, errors=errors)
+    markdown_kwargs = dict(parser=parser, extensions=extensions)
+    template_kwargs = dict(
+        template_type=template_type, template=template, template_dir=template_dir,
+        default_template_name=default_template_name, template_vars=template_vars,
+        bytecode_cache_dir=template_bytecode_cache) if do_apply_template else None
+    if fuse_render:
+        stages.append(Stage(
+            functools.partial(render_stage, markdown_kwargs=markdown_kwargs, template_kwargs=template_kwargs),
+            name='render', **cpu_options))
+    else:
+        stages.append(Stage(functools.partial(markdown_stage, **markdown_kwargs), name='markdown', **cpu_options))
+        if template_kwargs is not None:
+            stages.append(Stage(functools.partial(template_stage, **template_kwargs), name='template', **cpu_options))
+    stages.append(Stage(functools.partial(write_stage, outputfn=outputfn),
+                        name='write', executor='thread', workers=io_workers, errors=errors))
+    return Pipeline(source, stages, queue_size=queue_size)
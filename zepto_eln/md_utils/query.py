@@ -0,0 +1,349 @@
+"""
+
+Module for querying document metadata (YFM), using the persistent metadata index.
+
+Queries are lists of conditions, written as `<field><op><value>` expressions, e.g.:
+
+    status=started
+    enddate<2026-01-01
+    author~jane
+    enddate=null
+
+Operators:
+
+    =, ==   Equal. For list values (e.g. tags), the condition matches if any item is equal.
+    !=      Not equal (also matches documents where the field is missing).
+    <, <=, >, >=    Ordering. Dates are compared as ISO 8601 strings, numbers numerically (if the value is a
+                    number, e.g. `version>=10`), and everything else as strings.
+    ~       Contains (case-insensitive substring).
+
+The value `null` (or `none`, or an empty value) matches missing/null fields, e.g. `enddate=null`.
+
+Conditions on the indexed fields (`metadata_index.INDEXED_FIELDS`: status, expid, author, startdate, enddate)
+are evaluated in SQL using the index' `field_values` table, which has a row for each item of list values, so e.g.
+`author=Jane Doe` matches `author: [Jane Doe, Kim Larsen]`, exactly as when the condition is evaluated in Python.
+Other fields (including nested fields, `project.name`) are evaluated in Python on the metadata of the documents
+matching the indexed conditions. Likewise, sorting is done in SQL if all sort fields are indexed fields,
+otherwise in Python. The returned values are always taken from the metadata (the parsed YFM), so they have the
+same types (e.g. `datetime.date`) regardless of how the query was evaluated. (Sorting in SQL compares all values
+as strings, though, whereas numbers are sorted numerically when sorting in Python.)
+
+Usage:
+
+    >>> query_metadata('.', ['status=started', 'enddate<2026-01-01'], sort='startdate', fields=['expid', 'titledesc'])
+
+"""
+
+import os
+import re
+import sqlite3
+import logging
+import itertools
+import contextlib
+from collections import namedtuple
+
+from .document_io import get_fileinfo, iter_documents
+from .metadata_index import MetadataIndex, INDEXED_FIELDS, index_value
+
+logger = logging.getLogger(__name__)
+
+Condition = namedtuple('Condition', 'field op value')
+
+OPERATORS = ('=', '!=', '<', '<=', '>', '>=', '~')
+NULL_VALUES = ('', 'null', 'none', '~')
+_CONDITION_REGEX = re.compile(r'\s*([A-Za-z_][\w.\-]*)\s*(==|=|!=|<=|>=|<|>|~)\s*(.*?)\s*')
+_SQL_OPERATORS = {'=': '=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+# The document path (relative to basedir) can be used like an indexed field:
+_SQL_FIELDS = frozenset(INDEXED_FIELDS) | {'path'}
+_FILEINFO_KEYS = frozenset(get_fileinfo('.'))
+
+
+def parse_condition(expr):
+    """ Parse a `<field><op><value>` query expression into a Condition(field, op, value) namedtuple.
+
+    Args:
+        expr: The query expression, e.g. 'status=started' or 'enddate<2026-01-01'.
+
+    Returns:
+        Condition namedtuple. The value is None for null values, see NULL_VALUES.
+
+    Raises:
+        ValueError, if the expression is not a valid query expression.
+    """
+    match = _CONDITION_REGEX.fullmatch(expr)
+    if match is None:
+        raise ValueError(f"Invalid query expression {expr!r}; expected <field><op><value>, "
+                         f"with op one of {' '.join(OPERATORS)}, e.g. 'status=started'.")
+    field, op, value = match.groups()
+    if op == '==':
+        op = '='
+    if value.lower() in NULL_VALUES:
+        if op not in ('=', '!='):
+            raise ValueError(f"Invalid query expression {expr!r}; null can only be used with = and !=.")
+        value = None
+    return Condition(field, op, value)
+
+
+def parse_sort(sort):
+    """ Parse sort fields, e.g. 'startdate,-expid', into a list of (field, descending) 2-tuples.
+
+    Args:
+        sort: Comma-separated string or list of field names. Prefix a field with '-' to sort descending.
+    """
+    if not sort:
+        return []
+    if isinstance(sort, str):
+        sort = sort.split(',')
+    keys = []
+    for field in sort:
+        field = field.strip()
+        if field:
+            keys.append((field.lstrip('-'), field.startswith('-')))
+    return keys
+
+
+def get_field(meta, field):
+    """ Get a (possibly nested, dot-separated) field from a metadata dict, returning None if missing. """
+    value = meta
+    for part in field.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def _sql_value_condition(column, op, value):
+    """ Return (sql, params) for comparing a column with a (non-null) value. """
+    if op == '~':
+        escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        return f"{column} LIKE ? ESCAPE '\\'", [f"%{escaped}%"]
+    return f"{column} {_SQL_OPERATORS[op]} ?", [value]
+
+
+def _sql_item_condition(op, value):
+    """ Return (sql, params) for comparing an item in the `field_values` table with a (non-null) value.
+
+    Like `_match_value()`, numeric items are compared numerically if the value is a number, otherwise as strings.
+    """
+    number = _as_number(value) if op != '~' else None
+    if number is None:
+        return _sql_value_condition('value', op, value)
+    op = _SQL_OPERATORS[op]
+    return f"(num {op} ? OR (num IS NULL AND value {op} ?))", [number, value]
+
+
+def _sql_condition(condition):
+    """ Return (sql, params) for a condition on an indexed field (or the path). """
+    field, op, value = condition
+    if value is None:
+        return f"{field} IS {'NOT ' if op == '!=' else ''}NULL", []
+    if field == 'path':
+        if op == '!=':
+            return "path != ?", [value]
+        return _sql_value_condition('path', op, value)
+    # Conditions are matched against each item of list values, see `match_condition()`:
+    if op == '!=':
+        # Like Python, documents without the field (or without a matching item) are "not equal":
+        clause, params = _sql_item_condition('=', value)
+        return f"path NOT IN (SELECT path FROM field_values WHERE field = ? AND {clause})", [field, *params]
+    clause, params = _sql_item_condition(op, value)
+    return f"path IN (SELECT path FROM field_values WHERE field = ? AND {clause})", [field, *params]
+
+
+def _as_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _match_value(actual, op, value):
+    """ Return True if a (non-list) metadata value matches the condition `op value`. """
+    if actual is None:
+        return op == '!='
+    if op == '~':
+        return value.lower() in str(actual).lower()
+    if isinstance(actual, (int, float)) and not isinstance(actual, bool) and _as_number(value) is not None:
+        value = _as_number(value)
+    else:
+        actual = index_value(actual)
+    if op == '=':
+        return actual == value
+    if op == '!=':
+        return actual != value
+    if op == '<':
+        return actual < value
+    if op == '<=':
+        return actual <= value
+    if op == '>':
+        return actual > value
+    return actual >= value
+
+
+def match_condition(meta, condition):
+    """ Return True if the metadata dict matches the condition (evaluated in Python). """
+    field, op, value = condition
+    actual = get_field(meta, field)
+    if value is None:
+        return (actual is None) == (op == '=')
+    if isinstance(actual, (list, tuple, set)):
+        if op == '!=':
+            return not any(_match_value(item, '=', value) for item in actual)
+        return any(_match_value(item, op, value) for item in actual)
+    return _match_value(actual, op, value)
+
+
+def _sort_key(value):
+    """ Sort key that orders None first, then numbers, then everything else (as strings). """
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (1, value)
+    return (2, index_value(value) if not isinstance(value, (list, dict)) else str(value))
+
+
+def _get_result_field(result, field):
+    """ Get a field from a (path, meta) query result; 'path' is the document path relative to basedir. """
+    path, meta = result
+    return path if field == 'path' else get_field(meta, field)
+
+
+def sort_results(results, sort_keys):
+    """ Sort a list of (path, meta) query results in place by the given (field, descending) sort keys. """
+    # Stable sort by each key, starting with the least significant key:
+    for field, descending in reversed(sort_keys):
+        results.sort(key=lambda result: _sort_key(_get_result_field(result, field)), reverse=descending)
+    return results
+
+
+def iter_query(index, conditions=(), sort=None, fields=None, limit=None, add_fileinfo_to_meta=True):
+    """ Query the documents in a metadata index, yielding matching metadata dicts.
+
+    The index is queried as-is; use `MetadataIndex.refresh()` first to bring it up-to-date.
+
+    Args:
+        index: An open MetadataIndex.
+        conditions: List of query expressions (str) or Condition tuples, see `parse_condition()`.
+        sort: Sort fields, see `parse_sort()`. Default: sort by path.
+        fields: Only include these fields in the returned dicts (projection). Default: all fields.
+            The field 'path' is the document path relative to the index basedir.
+        limit: Yield at most this many documents.
+        add_fileinfo_to_meta: Add fileinfo (filename, dirname, etc.) to the metadata.
+
+    Yields:
+        Metadata dicts.
+    """
+    conditions = [parse_condition(c) if isinstance(c, str) else Condition(*c) for c in conditions]
+    sort_keys = parse_sort(sort)
+    sql_conditions = [c for c in conditions if c.field in _SQL_FIELDS]
+    py_conditions = [c for c in conditions if c.field not in _SQL_FIELDS]
+    sql_sort = all(field in _SQL_FIELDS for field, _ in sort_keys)
+    # We only need to decode the metadata if it is needed for filtering, sorting, or output:
+    load_meta = bool(py_conditions) or not sql_sort or fields is None or any(
+        field != 'path' and not (add_fileinfo_to_meta and field in _FILEINFO_KEYS) for field in fields)
+    add_fileinfo = add_fileinfo_to_meta and (load_meta or any(field in _FILEINFO_KEYS for field in fields))
+
+    where, params = ["meta IS NOT NULL"], []
+    for condition in sql_conditions:
+        clause, clause_params = _sql_condition(condition)
+        where.append(clause)
+        params += clause_params
+    order = [f"{field} {'DESC' if descending else 'ASC'}" for field, descending in sort_keys] if sql_sort else []
+    order.append("path")
+    sql = (f"SELECT path{', meta' if load_meta else ''} FROM documents"
+           f" WHERE {' AND '.join(where)} ORDER BY {', '.join(order)}")
+    if limit is not None and sql_sort and not py_conditions:
+        sql += f" LIMIT {int(limit):d}"
+    logger.debug("Query: %s %s", sql, params)
+
+    def iter_rows():
+        for row in index.connection.execute(sql, params):
+            if load_meta:
+                meta = index.load_meta(row[-1])
+                if not isinstance(meta, dict) or not all(match_condition(meta, c) for c in py_conditions):
+                    continue
+            else:
+                meta = {}
+            if add_fileinfo:
+                meta.update(get_fileinfo(index.get_filepath(row[0])))
+            yield row[0], meta
+
+    results = iter_rows()
+    if not sql_sort:
+        results = iter(sort_results(list(results), sort_keys))
+    for result in itertools.islice(results, limit):
+        yield result[1] if fields is None else {field: _get_result_field(result, field) for field in fields}
+
+
+def iter_scan_query(basedir='.', conditions=(), sort=None, fields=None, limit=None, add_fileinfo_to_meta=True,
+                    workers=None):
+    """ Like `iter_query()`, but reading the YFM header of every document instead of using the metadata index.
+
+    All conditions are evaluated in Python. Used when the metadata index can't be used, see `iter_query_metadata()`.
+    """
+    conditions = [parse_condition(c) if isinstance(c, str) else Condition(*c) for c in conditions]
+    results = []
+    for document in iter_documents(basedir, add_fileinfo_to_meta=False, header_only=True, workers=workers):
+        meta = document['meta']
+        path = os.path.relpath(document['filename'], basedir).replace(os.sep, '/')
+        if not isinstance(meta, dict) or not all(match_condition(dict(meta, path=path), c) for c in conditions):
+            continue
+        if add_fileinfo_to_meta:
+            meta.update(document['fileinfo'])
+        results.append((path, meta))
+    results.sort(key=lambda result: result[0])
+    sort_results(results, parse_sort(sort))
+    for result in itertools.islice(results, limit):
+        yield result[1] if fields is None else {field: _get_result_field(result, field) for field in fields}
+
+
+def query_metadata(basedir='.', conditions=(), sort=None, fields=None, limit=None, add_fileinfo_to_meta=True,
+                   refresh=True, index_path=None, workers=None):
+    """ Query the metadata of the documents in basedir, using the persistent metadata index.
+
+    Args:
+        basedir: The notebook base directory.
+        conditions: List of query expressions, e.g. ['status=started', 'enddate<2026-01-01'].
+        sort: Sort fields, e.g. 'startdate' or '-startdate,expid' (descending startdate, then expid).
+        fields: Only include these fields in the returned dicts (default: all fields).
+        limit: Return at most this many documents.
+        add_fileinfo_to_meta: Add fileinfo (filename, dirname, etc.) to the metadata.
+        refresh: Bring the index up-to-date before querying (a stat of every file; only new/changed files are
+            parsed). If False, the index is queried as-is, which is faster but may return stale results.
+        index_path: The metadata index file (default: `<basedir>/.zepto-eln/metadata-index.sqlite`).
+        workers: Parse new/changed files using a pool of this many worker processes.
+
+    Returns:
+        List of metadata dicts.
+    """
+    return list(iter_query_metadata(
+        basedir=basedir, conditions=conditions, sort=sort, fields=fields, limit=limit,
+        add_fileinfo_to_meta=add_fileinfo_to_meta, refresh=refresh, index_path=index_path, workers=workers))
+
+
+def iter_query_metadata(basedir='.', conditions=(), sort=None, fields=None, limit=None, add_fileinfo_to_meta=True,
+                        refresh=True, index_path=None, workers=None):
+    """ Query the metadata of the documents in basedir, yielding metadata dicts. See `query_metadata()`.
+
+    If the metadata index can't be opened (or updated), e.g. if the index directory can't be created, the documents
+    are scanned instead, see `iter_scan_query()`.
+    """
+    index = MetadataIndex(basedir=basedir, index_path=index_path)
+    try:
+        index.open()
+        if refresh:
+            index.refresh(workers=workers)
+    except (sqlite3.Error, OSError) as exc:
+        with contextlib.suppress(sqlite3.Error):
+            index.close()
+        logger.warning("Unable to use metadata index (%r); scanning all documents.", exc)
+        yield from iter_scan_query(
+            basedir=basedir, conditions=conditions, sort=sort, fields=fields, limit=limit,
+            add_fileinfo_to_meta=add_fileinfo_to_meta, workers=workers)
+        return
+    try:
+        yield from iter_query(
+            index, conditions=conditions, sort=sort, fields=fields, limit=limit,
+            add_fileinfo_to_meta=add_fileinfo_to_meta)
+    finally:
+        index.close()
\ No newline at end of file
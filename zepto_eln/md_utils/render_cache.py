@@ -0,0 +1,247 @@
+"""
+
+Module with an in-memory cache of rendered HTML pages, for serving documents on request (e.g. from a web server).
+
+Rendering a document (`compile_markdown_document()`) reads the file, parses the YAML front matter, converts the
+markdown, and applies the template, which takes milliseconds. `RenderCache` keeps the rendered HTML of recently
+viewed documents, so repeat views only have to check that the cached HTML is still valid (a few `os.stat` calls).
+
+Cache entries are keyed by the source path and the render options, and are valid as long as these are unchanged:
+
+* The source file's mtime and size.
+* The template file's mtime and size (the template file is resolved when rendering, since it can be selected
+    by the document's YAML front matter), and those of the Jinja templates it extends, includes, or imports
+    (see `templating.find_template_dependencies()`).
+* The template directory's mtime (changes when templates are added or removed, which can change the resolved
+    template).
+
+The cache is an LRU cache with a byte budget (`max_bytes`, the total size of the cached HTML); the least recently
+used pages are evicted when the budget is exceeded. With `stale_while_revalidate=True`, an outdated page is served
+immediately from the cache while it is re-rendered in a background thread, so only the first view after a change
+sees the new version (and no view has to wait for rendering, once a page is in the cache).
+
+Usage:
+
+    >>> cache = RenderCache(max_bytes=64 * 2**20, template_dir='templates')
+    >>> html = cache.get('2019/RS123.md')
+    >>> cache.stats
+    {'hits': 0, 'misses': 1, 'stale': 0, 'evictions': 0, 'revalidations': 0, 'errors': 0}
+
+The cache is thread-safe.
+
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from .markdown_compilation import compile_markdown_document
+from .templating import find_template_dependencies
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 64 * 2**20
+
+
+def _freeze(value):
+    """ Return a hashable version of a render option value (e.g. a list of extensions). """
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+def _stat_validator(path):
+    """ Return (path, mtime_ns, size) for path, or (path, None, None) if it doesn't exist. """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return path, None, None
+    return path, st.st_mtime_ns, st.st_size
+
+
+class _Entry:
+    __slots__ = ('html', 'nbytes', 'validators', 'checked', 'revalidating')
+
+    def __init__(self, html, validators):
+        self.html = html
+        self.nbytes = len(html.encode('utf-8'))
+        self.validators = validators
+        self.checked = time.monotonic()
+        self.revalidating = False
+
+
+class RenderCache:
+    """ In-memory LRU cache of rendered HTML documents, see module docstring.
+
+    Args:
+        max_bytes: The maximum total size (bytes, UTF-8) of the cached HTML. Pages larger than this are not cached.
+        stale_while_revalidate: Serve outdated pages from the cache while re-rendering them in the background.
+        check_interval: Only check whether a cached page is still valid if it was last checked more than this many
+            seconds ago (default: check on every request).
+        render: The render function, called as `render(path, outputfn=None, **render_options)`, and returning a
+            document dict with an 'html' entry (and a 'template_file' entry, if a template was applied).
+            Default: `compile_markdown_document()`.
+        **render_options: The default render options, e.g. template_dir, passed to the render function.
+
+    Attributes:
+        stats: Dict with counters: 'hits', 'misses', 'stale' (outdated pages served while revalidating),
+            'evictions', 'revalidations' (background re-renders), and 'errors' (failed background re-renders).
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, stale_while_revalidate=False, check_interval=0.0,
+                 render=compile_markdown_document, **render_options):
+        self.max_bytes = max_bytes
+        self.stale_while_revalidate = stale_while_revalidate
+        self.check_interval = check_interval
+        self.render = render
+        self.render_options = render_options
+        self._options_key = _freeze(render_options)
+        self._entries = OrderedDict()
+        # {template file: validators for the template and the templates it extends/includes}, see `_render()`:
+        self._template_validators = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self.nbytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0, 'revalidations': 0, 'errors': 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """ Wait for background re-renders to finish, and stop the background thread. """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def get(self, path, **render_options):
+        """ Return the rendered HTML for the document at path, from the cache if it is still valid.
+
+        Args:
+            path: The markdown document.
+            **render_options: Render options overriding the cache's default render options for this request.
+
+        Returns:
+            HTML (str).
+        """
+        if render_options:
+            options = dict(self.render_options, **render_options)
+            key = (os.path.abspath(path), _freeze(options))
+        else:
+            options = self.render_options
+            key = (os.path.abspath(path), self._options_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            now = time.monotonic()
+            if now - entry.checked < self.check_interval or self._is_valid(entry):
+                entry.checked = now
+                self._count('hits')
+                return entry.html
+            if self.stale_while_revalidate:
+                self._count('stale')
+                self._revalidate(key, entry, path, options)
+                return entry.html
+        self._count('misses')
+        return self._render(key, path, options).html
+
+    def _count(self, counter):
+        with self._lock:
+            self.stats[counter] += 1
+
+    @staticmethod
+    def _is_valid_validators(validators):
+        return all(_stat_validator(validator[0]) == validator for validator in validators)
+
+    def _is_valid(self, entry):
+        return self._is_valid_validators(entry.validators)
+
+    def _render(self, key, path, options):
+        """ Render the document, and store it in the cache. """
+        # The validators are taken before rendering, so changes made while rendering are detected by the next check:
+        source_validator = _stat_validator(key[0])
+        template_dir = options.get('template_dir')
+        dir_validators = (_stat_validator(template_dir),) if template_dir else ()
+        document = self.render(path, outputfn=None, **options)
+        template_file = document.get('template_file')
+        template_validators = self._get_template_validators(str(template_file), options) if template_file else ()
+        entry = _Entry(document['html'], (source_validator, *template_validators, *dir_validators))
+        self._store(key, entry)
+        return entry
+
+    def _get_template_validators(self, template_file, options):
+        """ Return the validators for a template file and the Jinja templates it extends, includes, or imports.
+
+        The dependencies are only re-parsed if one of the template files has changed.
+        """
+        if not (options.get('template_type') or 'jinja2').startswith('jinja'):
+            return (_stat_validator(template_file),)
+        validators = self._template_validators.get(template_file)
+        if validators is None or not self._is_valid_validators(validators):
+            files = find_template_dependencies(
+                template_file, bytecode_cache_dir=options.get('template_bytecode_cache')) or [template_file]
+            validators = self._template_validators[template_file] = tuple(_stat_validator(fn) for fn in files)
+        return validators
+
+    def _store(self, key, entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            if entry.nbytes > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self.nbytes += entry.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.stats['evictions'] += 1
+
+    def _revalidate(self, key, entry, path, options):
+        """ Re-render the document in the background (unless it is already being re-rendered). """
+        with self._lock:
+            if entry.revalidating:
+                return
+            entry.revalidating = True
+            if self._executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='render-cache')
+        self._executor.submit(self._background_render, key, entry, path, options)
+
+    def _background_render(self, key, entry, path, options):
+        try:
+            self._render(key, path, options)
+            self._count('revalidations')
+        except Exception as exc:
+            # The stale page is dropped, so the next request renders the document (and gets the error):
+            logger.warning("%s: %s while re-rendering %r.", exc.__class__.__name__, exc, path)
+            self._count('errors')
+            self.invalidate(path)
+        finally:
+            entry.revalidating = False
+
+    def invalidate(self, path=None):
+        """ Remove the cached pages for the document at path (all render options), or all pages if path is None. """
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self.nbytes = 0
+                return
+            path = os.path.abspath(path)
+            for key in [key for key in self._entries if key[0] == path]:
+                self.nbytes -= self._entries.pop(key).nbytes
+
+    def info(self):
+        """ Return a dict with the cache statistics, the number of cached pages, and the cache size. """
+        return dict(self.stats, entries=len(self._entries), nbytes=self.nbytes, max_bytes=self.max_bytes)
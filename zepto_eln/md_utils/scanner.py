@@ -0,0 +1,200 @@
+"""
+
+Module for quickly finding (markdown) document files in a directory tree, using `os.scandir`.
+
+Compared to `glob.glob(os.path.join(basedir, '**/*.md'), recursive=True)`, the scanner:
+
+* Prunes directories that should never contain journals, e.g. `.git`, `node_modules`, and output folders.
+* Honours `.elnignore` files, see below.
+* Returns the stat results alongside the paths, so callers (e.g. the metadata index) don't have to stat every
+    file a second time.
+* Supports multiple roots, and can optionally scan the top-level sub-directories of each root concurrently.
+
+Like glob, symlinked directories are followed (unless follow_symlinks=False). A symlink pointing to one of its own
+parent directories is skipped, so symlink loops don't make the scanner recurse forever.
+
+
+The `.elnignore` file:
+------------------------
+
+An `.elnignore` file can be placed in any directory, and applies to the directory and all its sub-directories.
+The format is a simplified version of `.gitignore`:
+
+* Each line is a glob pattern (fnmatch-style, e.g. `*.draft.md`, `old_journals/`, or `archive/2015*`).
+* Blank lines and lines starting with '#' are ignored.
+* A pattern ending with '/' only matches directories.
+* A pattern containing a '/' (other than a trailing slash) is matched against the path relative to the
+    directory containing the `.elnignore` file; other patterns are matched against the file/directory name.
+* Negation patterns ('!pattern') are not supported.
+
+
+"""
+
+import os
+import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+
+# Directories that are never scanned (unless prune_dirs is specified explicitly):
+DEFAULT_PRUNE_DIRS = (
+    '.git', '.hg', '.svn', '.zepto-eln', '__pycache__', '.ipynb_checkpoints', 'node_modules',
+)
+ELNIGNORE_FILENAME = '.elnignore'
+
+
+def read_ignore_file(path):
+    """ Read ignore patterns from an `.elnignore` file.
+
+    Returns:
+        List of (pattern, dir_only, match_path) 3-tuples.
+    """
+    patterns = []
+    with open(path, encoding='utf-8') as fd:
+        for line in fd:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            match_path = '/' in line
+            patterns.append((line.lstrip('/'), dir_only, match_path))
+    return patterns
+
+
+def _is_ignored(name, relpaths, is_dir, ignore_rules):
+    """ Return True if the file/directory matches any of the ignore rules.
+
+    Args:
+        name: The file/directory name.
+        relpaths: Dict with the file/directory path relative to the directory of each ignore file.
+        is_dir: Whether the entry is a directory.
+        ignore_rules: List of (ignore_file_dir, patterns) 2-tuples.
+    """
+    for rule_dir, patterns in ignore_rules:
+        for pattern, dir_only, match_path in patterns:
+            if dir_only and not is_dir:
+                continue
+            if fnmatch.fnmatch(relpaths[rule_dir] if match_path else name, pattern):
+                return True
+    return False
+
+
+def _dir_id(stat):
+    return stat.st_dev, stat.st_ino
+
+
+def _list_dir(dirpath, patterns, prune_dirs, ignore_filename, ignore_rules, follow_symlinks=True, ancestors=()):
+    """ List a single directory.
+
+    Args:
+        follow_symlinks: Whether to include symlinked sub-directories.
+        ancestors: The (st_dev, st_ino) ids of dirpath and its parent directories; symlinked sub-directories
+            pointing to any of these are skipped, to avoid symlink loops.
+
+    Returns:
+        (files, subdirs, ignore_rules) 3-tuple, where files is a list of (path, stat) tuples for files matching
+        patterns, subdirs is a list of (path, ancestors) tuples for the sub-directories to scan, and ignore_rules
+        are the ignore rules that apply to the sub-directories.
+    """
+    try:
+        with os.scandir(dirpath) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except (PermissionError, FileNotFoundError, NotADirectoryError):
+        return [], [], ignore_rules
+    if ignore_filename and any(entry.name == ignore_filename for entry in entries):
+        ignore_rules = ignore_rules + [(dirpath, read_ignore_file(os.path.join(dirpath, ignore_filename)))]
+    files, subdirs = [], []
+    for entry in entries:
+        is_dir = entry.is_dir(follow_symlinks=follow_symlinks)
+        if is_dir and entry.name in prune_dirs:
+            continue
+        if not is_dir and not any(fnmatch.fnmatch(entry.name, pat) for pat in patterns):
+            continue
+        if ignore_rules:
+            relpaths = {
+                rule_dir: os.path.relpath(entry.path, rule_dir).replace(os.sep, '/') for rule_dir, _ in ignore_rules}
+            if _is_ignored(entry.name, relpaths, is_dir, ignore_rules):
+                continue
+        if is_dir:
+            try:
+                dir_id = _dir_id(entry.stat())
+            except OSError:
+                continue  # Deleted while scanning, or a broken symlink.
+            if dir_id in ancestors:
+                continue  # Symlink loop.
+            subdirs.append((entry.path, (*ancestors, dir_id)))
+            continue
+        try:
+            # On Windows, DirEntry.stat() is free (cached from the directory listing); on POSIX it is a single
+            # stat call, which is cached on the DirEntry so downstream consumers don't have to stat the file again.
+            files.append((entry.path, entry.stat()))
+        except FileNotFoundError:
+            continue  # File deleted while scanning.
+    return files, subdirs, ignore_rules
+
+
+def _scan_tree(dirpath, patterns, prune_dirs, ignore_filename, ignore_rules, follow_symlinks=True, ancestors=()):
+    """ Recursively scan a directory, yielding (path, stat) tuples for files matching patterns. """
+    files, subdirs, ignore_rules = _list_dir(
+        dirpath, patterns, prune_dirs, ignore_filename, ignore_rules, follow_symlinks, ancestors)
+    yield from files
+    for subdir, subdir_ancestors in subdirs:
+        yield from _scan_tree(
+            subdir, patterns, prune_dirs, ignore_filename, ignore_rules, follow_symlinks, subdir_ancestors)
+
+
+def _root_ancestors(root):
+    try:
+        return (_dir_id(os.stat(root)),)
+    except OSError:
+        return ()
+
+
+def scan_files(
+        roots='.', patterns=('*.md',), prune_dirs=DEFAULT_PRUNE_DIRS, ignore_filename=ELNIGNORE_FILENAME,
+        concurrent=False, max_workers=None, follow_symlinks=True,
+):
+    """ Recursively find files matching `patterns` within one or more root directories.
+
+    Args:
+        roots: A directory, or a list of directories, to scan.
+        patterns: Filename glob patterns for the files to find.
+        prune_dirs: Directory names that should not be scanned, e.g. '.git' or output folders.
+            Defaults to DEFAULT_PRUNE_DIRS.
+        ignore_filename: The name of ignore files (default: '.elnignore'), or None to disable ignore files.
+        concurrent: If True, scan the top-level sub-directories of each root concurrently using a thread pool.
+            This can be a lot faster on network drives and other high-latency file systems.
+        max_workers: The maximum number of scanning threads to use when `concurrent` is True.
+        follow_symlinks: Scan symlinked sub-directories (like glob), skipping symlinks to a parent directory.
+
+    Yields:
+        (path, stat_result) 2-tuples, in a deterministic order (sorted by name, files before sub-directories),
+        regardless of `concurrent`.
+    """
+    if isinstance(roots, (str, os.PathLike)):
+        roots = [roots]
+    patterns = (patterns,) if isinstance(patterns, str) else tuple(patterns)
+    prune_dirs = frozenset(prune_dirs or ())
+    for root in roots:
+        root = os.fspath(root)
+        ancestors = _root_ancestors(root)
+        if not concurrent:
+            yield from _scan_tree(root, patterns, prune_dirs, ignore_filename, [], follow_symlinks, ancestors)
+            continue
+        files, subdirs, ignore_rules = _list_dir(
+            root, patterns, prune_dirs, ignore_filename, [], follow_symlinks, ancestors)
+        yield from files
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(list, _scan_tree(
+                    subdir, patterns, prune_dirs, ignore_filename, ignore_rules, follow_symlinks, subdir_ancestors))
+                for subdir, subdir_ancestors in subdirs]
+            for future in futures:
+                yield from future.result()
+
+
+def scan_md_files(roots='.', prune_dirs=DEFAULT_PRUNE_DIRS, ignore_filename=ELNIGNORE_FILENAME, concurrent=False,
+                  follow_symlinks=True):
+    """ Recursively find Markdown (*.md) files, yielding (path, stat_result) tuples. See `scan_files()`. """
+    return scan_files(
+        roots=roots, patterns=('*.md',), prune_dirs=prune_dirs, ignore_filename=ignore_filename,
+        concurrent=concurrent, follow_symlinks=follow_symlinks)
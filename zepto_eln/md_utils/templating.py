@@ -8,15 +8,51 @@ See notes/templating.md
 """
 
 import os
-import sys
 import pathlib
 import glob
-from pprint import pprint
+import logging
+import functools
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_template_file(document, template=None, template_dir=None, default_template_name='index'):
+    """ Return the template file to apply to a document.
+
+    Args:
+        document: The document (dict); a 'template' entry in its metadata selects a template from template_dir.
+        template: The template to use (file or name). If None, the document's template (or the default) is used.
+        template_dir: Where to look for template files, if template is not a file.
+        default_template_name: The template name to use if neither template nor the document specify a template.
+
+    Returns:
+        The template file path (str).
+    """
+    if template is not None and os.path.isfile(template):
+        return template
+    # Template can be e.g. 'ProjectTemplate', which should map to the 'ProjectTemplate' template in template_dir.
+    if template is None:
+        template_name = (document.get('meta') or {}).get('template', default_template_name)
+        logger.debug("No template given, using template name from YFM (or default): %r.", template_name)
+    else:
+        template_name = template
+    logger.debug("Locating template %r in template_dir %r.", template_name, template_dir)
+    assert template_dir is not None
+    assert os.path.isdir(template_dir)
+    template_selection = get_templates_in_dir(template_dir, glob_patterns=("*.jinja",))
+    # glob_patterns=("*.html", "*.j2.html", "*.j2", "*.twig"))
+    try:
+        template = template_selection[template_name]
+    except KeyError:
+        raise FileNotFoundError(
+            f"WARNING: Template_dir does not contain any templates matching{template_name!r} (case sensitive).")
+    logger.debug("Using template %r from template directory %r.", template_name, template_dir)
+    return template
 
 
 def apply_template_file_to_document(
         document, template_type='jinja2', template=None, template_dir=None, default_template_name='index',
-        template_vars=None,
+        template_vars=None, bytecode_cache_dir=None,
 ):
     """ Locate the proper template file to use and apply it to the document.
 
@@ -26,9 +62,12 @@ def apply_template_file_to_document(
         template: The template to use (name).
         template_dir: Where to look for template files.
         default_template_name:
+        template_vars: Additional template variables.
+        bytecode_cache_dir: Cache compiled Jinja templates in this directory, see `get_jinja_environment()`.
 
     Returns:
         html (str) and also updates document['html'] in-place.
+        The template file used is stored in document['template_file'].
 
     See also:
         apply_template
@@ -36,44 +75,100 @@ def apply_template_file_to_document(
     """
     if template_vars is None:
         template_vars = {}
-    print("\nApplying template file to document...")
-    print(" - template_dir:", template_dir)
-
-    if template is None or not os.path.isfile(template):  # and template_dir is not None:
-        # Template can be e.g. 'ProjectTemplate', which should map to the 'ProjectTemplate' template in template_dir.
-        print("\n(template is None or not os.path.isfile(template)) and template_dir is not None.\n", file=sys.stderr)
-        if template is None:
-            template_name = document['meta'].get('template', default_template_name)
-            print(f"No template given, using template name from YFM (or default): {template_name!r}.", file=sys.stderr)
-        else:
-            template_name = template
-        print(f"Locating template {template!r} in template_dir {template_dir!r}.")
-        assert template_dir is not None
-        assert os.path.isdir(template_dir)
-        template_selection = get_templates_in_dir(template_dir, glob_patterns=("*.jinja",))
-        # glob_patterns=("*.html", "*.j2.html", "*.j2", "*.twig"))
-        try:
-            template = template_selection[template_name]
-        except KeyError:
-            raise FileNotFoundError(
-                f"WARNING: Template_dir does not contain any templates matching{template_name!r} (case sensitive).")
-        else:
-            print(f"Using template {template_name!r} from template directory {template_dir!r}.", file=sys.stderr)
+    logger.debug("Applying template file to document (template_dir=%r)...", template_dir)
+    template = resolve_template_file(
+        document, template=template, template_dir=template_dir, default_template_name=default_template_name)
+    document['template_file'] = template
 
-    print("Applying template:", template)
+    logger.debug("Applying template: %s", template)
     template_vars.update(document)
-    html = apply_template(template=pathlib.Path(template), template_type=template_type, template_vars=template_vars)
+    html = apply_template(template=pathlib.Path(template), template_type=template_type, template_vars=template_vars,
+                          bytecode_cache_dir=bytecode_cache_dir)
     document['html'] = html
     return html
 
 
-def apply_template(template, template_vars, template_type='jinja2'):
+@functools.lru_cache(maxsize=None)
+def get_jinja_environment(template_dir, bytecode_cache_dir=None):
+    """ Return a shared Jinja2 Environment for loading templates from template_dir.
+
+    The environment (and the templates compiled by it) is shared by all documents using templates from the
+    same directory, so each template is only read and compiled once per process.
+    Templates are automatically reloaded if the template file's mtime changes.
+
+    Args:
+        template_dir: The directory to load templates from.
+        bytecode_cache_dir: If given, compiled templates are also cached on disk in this directory,
+            using `jinja2.FileSystemBytecodeCache`, which speeds up the first use of a template in a new process.
+
+    Returns:
+        jinja2.Environment
+    """
+    import jinja2
+    bytecode_cache = None
+    if bytecode_cache_dir is not None:
+        os.makedirs(bytecode_cache_dir, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_cache_dir)
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(template_dir), auto_reload=True, bytecode_cache=bytecode_cache)
+
+
+def get_jinja_template(template_file, bytecode_cache_dir=None):
+    """ Return a compiled Jinja2 template for the given template file, using the shared environment for its directory.
+
+    The template is only re-compiled if the template file has been modified, see `get_jinja_environment()`.
+    """
+    template_dir, template_name = os.path.split(os.path.abspath(template_file))
+    env = get_jinja_environment(template_dir, bytecode_cache_dir=bytecode_cache_dir)
+    return env.get_template(template_name)
+
+
+def find_template_dependencies(template_file, bytecode_cache_dir=None):
+    """ Return the template file and the files of all templates it extends, includes, or imports (recursively).
+
+    Used to check if a rendered document is out of date, see `build_manifest.BuildManifest`. Templates referenced
+    by a dynamic name (e.g. `{% include page_template %}`), or that can't be found, are not included.
+
+    Args:
+        template_file: The Jinja template file.
+        bytecode_cache_dir: The bytecode cache directory, see `get_jinja_environment()`.
+
+    Returns:
+        List of template file paths, starting with template_file.
+    """
+    import jinja2
+    import jinja2.meta
+    template_dir, template_name = os.path.split(os.path.abspath(template_file))
+    env = get_jinja_environment(template_dir, bytecode_cache_dir=bytecode_cache_dir)
+    files, seen, names = [], {template_name}, [template_name]
+    while names:
+        try:
+            source, filename, _ = env.loader.get_source(env, names.pop())
+        except jinja2.TemplateNotFound:
+            continue
+        files.append(filename)
+        for name in jinja2.meta.find_referenced_templates(env.parse(source)):
+            if name is not None and name not in seen:
+                seen.add(name)
+                names.append(name)
+    return files
+
+
+@functools.lru_cache(maxsize=32)
+def compile_jinja_template_string(source):
+    """ Compile a Jinja2 template from a string. Compiled templates are cached, keyed by the template source. """
+    import jinja2
+    return jinja2.Template(source)
+
+
+def apply_template(template, template_vars, template_type='jinja2', bytecode_cache_dir=None):
     """ Generate HTML using the the given template and template_vars, with templating system specified by template_type.
 
     Args:
-        template: The template to use.
+        template: The template to use, either a template file (pathlib.Path) or the template itself (string).
         template_vars: Interpolate template with these variables.
         template_type: The templating system to use. Currently only 'jinja2' is supported.
+        bytecode_cache_dir: Cache compiled templates in this directory, see `get_jinja_environment()`.
 
     Returns:
         htm (text string)
@@ -83,16 +178,13 @@ def apply_template(template, template_vars, template_type='jinja2'):
         >>> flask.render_template(template, template_vars)
 
     """
-    if isinstance(template, pathlib.Path):
-        template = open(template, encoding='utf-8').read()
-
-    print("Performing template variable subsubstitution...", file=sys.stderr)
     # Twig/Jinja template interpolation:
 
     if template_type.startswith('jinja'):
-        import jinja2
-        print("template length:", len(template))
-        template = jinja2.Template(template)
+        if isinstance(template, pathlib.Path):
+            template = get_jinja_template(template, bytecode_cache_dir=bytecode_cache_dir)
+        else:
+            template = compile_jinja_template_string(template)
         html = template.render(**template_vars)
     else:
         raise ValueError(f"Value {template_type!r} for `template_type` not recognized.")
@@ -112,11 +204,9 @@ def get_templates_in_dir(template_dir, glob_patterns=('*.jinja',)):
     """
 
     files = [fn for pat in glob_patterns for fn in sorted(glob.iglob(os.path.join(template_dir, pat)))]
-    print(f"\nTemplate files in {template_dir!r}:", file=sys.stderr)
-    print("\n".join(f" - {fn!r}" for fn in files), file=sys.stderr)
+    logger.debug("Template files in %r: %s", template_dir, files)
 
     templates_by_name = {os.path.splitext(os.path.basename(fn))[0]: fn for fn in files}
     templates_by_name.update({fn: fn for fn in files})
-    pprint(templates_by_name)
 
     return templates_by_name
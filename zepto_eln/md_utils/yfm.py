@@ -7,8 +7,9 @@ Module for extracting and parsing YAML Front-Matter from documents.
 """
 
 import re
-import yaml
-import sys
+import logging
+
+from .flat_yaml import load_yaml
 # try:
 #     import frontmatter
 # except ImportError:
@@ -17,7 +18,11 @@ import sys
 # The frontmatter package doesn't provide very good error control, unless you go so low-level
 # that it is easier to just use re.split() + yaml.load() directly.
 
+logger = logging.getLogger(__name__)
+
 YFM_boundary_regex = re.compile(r'^-{3,}$', re.MULTILINE)
+# The maximum number of bytes to read when looking for the closing YFM boundary marker in header-only mode:
+YFM_HEADER_MAX_BYTES = 256 * 1024
 
 
 def split_yfm(raw_content, sep_regex=YFM_boundary_regex, require_leading_marker='raise', require_empty_pre=True):
@@ -30,7 +35,7 @@ def split_yfm(raw_content, sep_regex=YFM_boundary_regex, require_leading_marker=
         sep_regex: The regex pattern to use to split the YFM from the main content.
         require_leading_marker: Will require the YFM to be prefixed with the sep_regex pattern, i.e. "---\n".
             If 'raise' or True, will raise ValueError.
-            If 'warn', simply provide a warning on sys.stderr.
+            If 'warn', simply log a warning.
         require_empty_pre: If True
 
     Returns:
@@ -55,14 +60,14 @@ def split_yfm(raw_content, sep_regex=YFM_boundary_regex, require_leading_marker=
     if len(splitted) == 2:
         if require_leading_marker:
             if require_leading_marker == 'warn':
-                print(f"WARNING: Only found one YFM boundary marker ({sep_regex.pattern!r}).", file=sys.stderr)
+                logger.warning("Only found one YFM boundary marker (%r).", sep_regex.pattern)
             else:
                 raise ValueError(f"Only found one YFM boundary marker ({sep_regex.pattern!r}).")
         yfm_content, md_content = splitted
     else:
         pre, yfm_content, md_content = splitted
         if require_empty_pre:
-            if not pre.strip():
+            if pre.strip():
                 raise AssertionError(f"Non-empty text before YFM boundary marker ({sep_regex.pattern!r}). Text is:"
                                      f"{pre}" if len(pre) < 100 else f"{len(pre)} chars.")
     return yfm_content, md_content
@@ -134,5 +139,78 @@ def parse_yfm(raw_content, sep_regex=YFM_boundary_regex, require_leading_marker=
     yfm_content, md_content = split_yfm(
         raw_content, sep_regex=sep_regex,
         require_leading_marker=require_leading_marker, require_empty_pre=require_empty_pre)
-    yfm = yaml.load(yfm_content, Loader=yaml.SafeLoader)  # Exceptions caught in outer functions that knows filename.
+    # Flat headers use a fast path, everything else the (C) SafeLoader, see `flat_yaml.load_yaml()`.
+    yfm = load_yaml(yfm_content)  # Exceptions caught in outer functions that knows filename.
     return yfm, md_content
+
+
+def read_yfm_header(fd, sep_regex=YFM_boundary_regex, max_bytes=YFM_HEADER_MAX_BYTES):
+    """ Read the YAML frontmatter from the start of a file, without reading the rest of the file.
+
+    The file is read line by line until the closing YFM boundary marker, so only the first few hundred bytes
+    of a (potentially multi-megabyte) document are read.
+    Blank lines before the leading boundary marker are allowed, as in `split_yfm()`.
+
+    Args:
+        fd: A file object, opened in binary mode. The file is assumed to be utf-8 encoded.
+        sep_regex: The regex pattern used to identify the YFM boundary marker lines.
+        max_bytes: Give up (raise ValueError) if the closing boundary marker is not found within this many bytes.
+
+    Returns:
+        (yfm_content, content_offset) 2-tuple,
+        where yfm_content is the text-string containing the yfm,
+        and content_offset is the byte offset of the main content part of the file (right after the closing marker).
+        That is, `fd.seek(content_offset); fd.read()` gives the same content as `split_yfm()`.
+
+    Raises:
+        ValueError, if the file does not start with a YFM boundary marker,
+            or if the closing marker is not found within max_bytes.
+        UnicodeDecodeError (a ValueError), if the YFM is not valid utf-8.
+
+    """
+    if isinstance(sep_regex, str):
+        sep_regex = re.compile(sep_regex, re.MULTILINE)
+    yfm_lines = None  # None until we have found the leading boundary marker.
+    offset = 0
+    while True:
+        line = fd.readline(max_bytes - offset + 1)
+        if not line:
+            marker = "boundary marker" if yfm_lines is None else "closing boundary marker"
+            raise ValueError(f"Unable to extract YAML frontmatter from file; no {marker} {sep_regex.pattern!r}.")
+        line_offset, offset = offset, offset + len(line)
+        if offset > max_bytes:
+            raise ValueError(f"Unable to extract YAML frontmatter from file; no closing boundary marker "
+                             f"{sep_regex.pattern!r} within the first {max_bytes} bytes.")
+        text = line.decode('utf-8').rstrip('\r\n')
+        if sep_regex.search(text):
+            if yfm_lines is None:
+                yfm_lines = []
+                continue
+            return "\n".join(yfm_lines), line_offset + len(text.encode('utf-8'))
+        if yfm_lines is not None:
+            yfm_lines.append(text)
+        elif text.strip():
+            raise ValueError(f"Unable to extract YAML frontmatter from file; "
+                             f"file does not start with boundary marker {sep_regex.pattern!r}.")
+
+
+def parse_yfm_header(fd, sep_regex=YFM_boundary_regex, max_bytes=YFM_HEADER_MAX_BYTES):
+    """ Parse YAML front matter from the start of a file, without reading the rest of the file.
+
+    Args:
+        fd: A file object, opened in binary mode.
+        sep_regex: The regex on which the YFM is separated from the surrounding text.
+        max_bytes: The maximum number of bytes to read before giving up, see `read_yfm_header()`.
+
+    Returns:
+        Two-tuple of (frontmatter/metadata dict, content_offset), where content_offset is the byte offset
+        of the main content (after the YFM).
+
+    Raises:
+        ValueError, if the YFM cannot be extracted from the start of the file, see `read_yfm_header()`.
+        yaml.error.YAMLError, if there is an error in the YFM YAML markup.
+    """
+    yfm_content, content_offset = read_yfm_header(fd, sep_regex=sep_regex, max_bytes=max_bytes)
+    # Flat headers use a fast path, everything else the (C) SafeLoader, see `flat_yaml.load_yaml()`.
+    yfm = load_yaml(yfm_content)  # Exceptions caught in outer functions that knows filename.
+    return yfm, content_offset